@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BULK = "interactive", "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+# Class of the request the current task works for. Set once a request is admitted and inherited by
+# the tasks it spawns, so the shared LLM and OCR queues can serve interactive work first.
+current_priority: ContextVar[str] = ContextVar("current_priority", default=INTERACTIVE)
+
+# Requests running at once across both classes; ADMISSION_INTERACTIVE_RESERVED of those slots are
+# never given to bulk work, so a single upload does not wait behind an import. The same number of
+# LLM call slots (and OCR workers, when there are several) is kept free for interactive work.
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "4"))
+ADMISSION_INTERACTIVE_RESERVED = int(os.getenv("ADMISSION_INTERACTIVE_RESERVED", "1"))
+ADMISSION_INTERACTIVE_QUEUE = int(os.getenv("ADMISSION_INTERACTIVE_QUEUE", "16"))
+ADMISSION_BULK_QUEUE = int(os.getenv("ADMISSION_BULK_QUEUE", "256"))
+# Default deadlines; a client may ask for a shorter (or, for bulk, longer) one per request
+ADMISSION_INTERACTIVE_DEADLINE_SECONDS = float(os.getenv("ADMISSION_INTERACTIVE_DEADLINE_SECONDS", "60"))
+ADMISSION_BULK_DEADLINE_SECONDS = float(os.getenv("ADMISSION_BULK_DEADLINE_SECONDS", "900"))
+# Memory-derived limit: no new work starts unless MemAvailable stays above the floor after
+# budgeting ADMISSION_REQUEST_MEMORY_MB for it
+ADMISSION_REQUEST_MEMORY_MB = float(os.getenv("ADMISSION_REQUEST_MEMORY_MB", "150"))
+ADMISSION_MIN_FREE_MEMORY_MB = float(os.getenv("ADMISSION_MIN_FREE_MEMORY_MB", "256"))
+# Service-time estimate used before any request has finished
+ADMISSION_INITIAL_SERVICE_SECONDS = float(os.getenv("ADMISSION_INITIAL_SERVICE_SECONDS", "5"))
+
+
+class AdmissionRejected(Exception):
+    """The request was shed: 429 when its class queue is full, 503 when it cannot meet its deadline."""
+
+    def __init__(self, message: str, status_code: int, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+def available_memory_mb() -> Optional[float]:
+    """MemAvailable from /proc/meminfo (includes reclaimable cache), or None off Linux."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class PriorityLanes:
+    """A semaphore that hands freed slots to interactive waiters first, FIFO within a class.
+
+    Admission holds one slot per request, but an admitted batch fans out into many LLM calls and
+    OCR jobs. Resources shared by all requests queue through lanes so that fan-out cannot sit in
+    front of an interactive request, and bulk work never holds the last `reserved` slots, so an
+    interactive call need not wait for a bulk one to finish. Waiters take the class of
+    `current_priority` by default.
+    """
+
+    def __init__(self, value: int, reserved: int = ADMISSION_INTERACTIVE_RESERVED):
+        self.value = max(1, value)
+        self.reserved = min(max(0, reserved), self.value - 1)
+        self.in_use = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {priority: deque() for priority in PRIORITIES}
+        self.stats = {f"{priority}_waited": 0 for priority in PRIORITIES}
+
+    def waiting(self) -> Dict[str, int]:
+        return {priority: len(waiters) for priority, waiters in self._waiters.items()}
+
+    async def acquire(self, priority: Optional[str] = None) -> None:
+        priority = priority or current_priority.get()
+        if not self._waiting_ahead(priority) and self._has_room(priority):
+            self.in_use += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        self.stats[f"{priority}_waited"] += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the waiter was cancelled; pass the slot on
+                self.release()
+            else:
+                try:
+                    self._waiters[priority].remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def _has_room(self, priority: str) -> bool:
+        return self.in_use < (self.value if priority == INTERACTIVE else self.value - self.reserved)
+
+    def _waiting_ahead(self, priority: str) -> bool:
+        if priority == INTERACTIVE:
+            return bool(self._waiters[INTERACTIVE])
+        return any(self._waiters.values())
+
+    def release(self) -> None:
+        self.in_use -= 1
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters and self._has_room(priority):
+                waiter = waiters.popleft()
+                if waiter.done():
+                    continue
+                self.in_use += 1
+                waiter.set_result(None)
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """Two-class admission in front of the pipeline.
+
+    Each class has a bounded FIFO queue. Freed slots go to interactive waiters first. A request
+    is rejected up front when the queue ahead of it (at the observed service time) would push it
+    past its deadline, and a queued request gives up once it can no longer start in time.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        interactive_reserved: int = ADMISSION_INTERACTIVE_RESERVED,
+        queue_limits: Optional[Dict[str, int]] = None,
+        deadlines: Optional[Dict[str, float]] = None,
+        request_memory_mb: float = ADMISSION_REQUEST_MEMORY_MB,
+        min_free_memory_mb: float = ADMISSION_MIN_FREE_MEMORY_MB,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.max_concurrent - 1)
+        self.queue_limits = queue_limits or {INTERACTIVE: ADMISSION_INTERACTIVE_QUEUE, BULK: ADMISSION_BULK_QUEUE}
+        self.deadlines = deadlines or {INTERACTIVE: ADMISSION_INTERACTIVE_DEADLINE_SECONDS, BULK: ADMISSION_BULK_DEADLINE_SECONDS}
+        self.request_memory_mb = request_memory_mb
+        self.min_free_memory_mb = min_free_memory_mb
+        self.running = {priority: 0 for priority in PRIORITIES}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {priority: deque() for priority in PRIORITIES}
+        self._service_seconds = {priority: ADMISSION_INITIAL_SERVICE_SECONDS for priority in PRIORITIES}
+        self._memory_checked = 0.0
+        self._memory_mb: Optional[float] = None
+        self.stats = {
+            f"{priority}_{outcome}": 0
+            for priority in PRIORITIES
+            for outcome in ("admitted", "queued", "rejected_queue_full", "rejected_deadline")
+        }
+
+    def _free_memory_mb(self) -> Optional[float]:
+        # /proc/meminfo is cheap, but not free; one read per second is plenty
+        now = time.monotonic()
+        if now - self._memory_checked > 1.0:
+            self._memory_mb = available_memory_mb()
+            self._memory_checked = now
+        return self._memory_mb
+
+    def concurrency_limit(self) -> int:
+        """Slots usable right now: the configured maximum, lowered when memory is short.
+
+        Never below one, so the queue keeps draining (and deadlines keep firing) under pressure.
+        """
+        limit = self.max_concurrent
+        free_mb = self._free_memory_mb()
+        if free_mb is not None and self.request_memory_mb > 0:
+            headroom = int((free_mb - self.min_free_memory_mb) // self.request_memory_mb)
+            limit = min(limit, sum(self.running.values()) + max(0, headroom))
+        return max(1, limit)
+
+    def _class_limit(self, priority: str, total_limit: int) -> int:
+        return total_limit if priority == INTERACTIVE else max(0, total_limit - self.interactive_reserved)
+
+    def _can_start(self, priority: str) -> bool:
+        total_limit = self.concurrency_limit()
+        if sum(self.running.values()) >= total_limit:
+            return False
+        return priority == INTERACTIVE or self.running[BULK] < self._class_limit(BULK, total_limit)
+
+    def _expected_wait(self, priority: str, ahead: int) -> float:
+        """Seconds until a request with `ahead` waiters in front of it would start."""
+        slots = max(1, self._class_limit(priority, self.max_concurrent))
+        return math.ceil((ahead + 1) / slots) * self._service_seconds[priority]
+
+    def _waiting_ahead(self, priority: str) -> int:
+        if priority == INTERACTIVE:
+            return len(self._waiters[INTERACTIVE])
+        return len(self._waiters[INTERACTIVE]) + len(self._waiters[BULK])
+
+    async def acquire(self, priority: str = INTERACTIVE, deadline_seconds: Optional[float] = None) -> Tuple[str, float]:
+        """Wait for a slot. Returns a ticket for release(); raises AdmissionRejected when shed."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}")
+        budget = deadline_seconds if deadline_seconds is not None else self.deadlines[priority]
+        service = self._service_seconds[priority]
+
+        if not self._waiting_ahead(priority) and self._can_start(priority):
+            return self._start(priority)
+
+        ahead = self._waiting_ahead(priority)
+        expected_wait = self._expected_wait(priority, ahead)
+        if len(self._waiters[priority]) >= self.queue_limits[priority]:
+            self.stats[f"{priority}_rejected_queue_full"] += 1
+            raise AdmissionRejected(f"{priority} queue is full ({len(self._waiters[priority])} waiting)", 429, expected_wait)
+        if expected_wait + service > budget:
+            self.stats[f"{priority}_rejected_deadline"] += 1
+            raise AdmissionRejected(
+                f"Cannot finish within {budget:.0f}s: ~{expected_wait:.0f}s queue + ~{service:.0f}s processing", 503, expected_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        self.stats[f"{priority}_queued"] += 1
+        try:
+            # The latest moment the request can start and still finish before its deadline
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max(0.0, budget - service))
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the timer fired; hand the slot back
+                self.release((priority, time.monotonic()), record=False)
+            else:
+                waiter.cancel()
+            self._remove(priority, waiter)
+            self.stats[f"{priority}_rejected_deadline"] += 1
+            raise AdmissionRejected(f"Deadline of {budget:.0f}s passed while queued", 503, self._expected_wait(priority, self._waiting_ahead(priority)))
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release((priority, time.monotonic()), record=False)
+            else:
+                waiter.cancel()
+            self._remove(priority, waiter)
+            raise
+        return priority, time.monotonic()
+
+    def _start(self, priority: str) -> Tuple[str, float]:
+        self.running[priority] += 1
+        self.stats[f"{priority}_admitted"] += 1
+        return priority, time.monotonic()
+
+    def _remove(self, priority: str, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters[priority].remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, ticket: Tuple[str, float], record: bool = True) -> None:
+        priority, started = ticket
+        self.running[priority] -= 1
+        if record:
+            # Exponentially weighted service time drives the deadline and Retry-After estimates
+            elapsed = time.monotonic() - started
+            self._service_seconds[priority] = 0.8 * self._service_seconds[priority] + 0.2 * elapsed
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters and self._can_start(priority):
+                waiter = waiters.popleft()
+                if waiter.done():
+                    continue
+                self.running[priority] += 1
+                self.stats[f"{priority}_admitted"] += 1
+                waiter.set_result(None)
+            if waiters:
+                # Lower classes never jump ahead of a waiting higher class
+                return
+
+    @asynccontextmanager
+    async def admit(self, priority: str = INTERACTIVE, deadline_seconds: Optional[float] = None) -> AsyncIterator[None]:
+        ticket = await self.acquire(priority, deadline_seconds)
+        token = current_priority.set(priority)
+        try:
+            yield
+        finally:
+            current_priority.reset(token)
+            self.release(ticket)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "running": dict(self.running),
+            "queued": {priority: len(waiters) for priority, waiters in self._waiters.items()},
+            "service_seconds": {priority: round(value, 3) for priority, value in self._service_seconds.items()},
+            "concurrency_limit": self.concurrency_limit(),
+            "max_concurrent": self.max_concurrent,
+            "available_memory_mb": self._memory_mb,
+        }
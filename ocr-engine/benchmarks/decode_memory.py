@@ -0,0 +1,113 @@
+"""Per-request decode cost: the old base64/PIL round trip vs a single cv2.imdecode, and the
+spooled upload path /process uses (chunked spool, then decode from the spool).
+
+Usage: python benchmarks/decode_memory.py [--width 2480 --height 3508 --iterations 10]
+
+Each path runs in a fresh process, so growth of the peak RSS beyond the post-import baseline
+is attributable to that path alone (0 means it stayed under the import-time peak).
+Python-visible allocations (NumPy, bytes, str) are also reported via tracemalloc.
+"""
+import argparse
+import base64
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import decode_image  # noqa: E402
+from uploads import UPLOAD_CHUNK_BYTES, SpooledUpload  # noqa: E402
+
+
+def legacy_path(contents: bytes) -> np.ndarray:
+    """What /process did before: validate with PIL, base64 round trip, decode again, copy to NumPy."""
+    Image.open(io.BytesIO(contents)).load()
+    encoded = base64.b64encode(contents).decode("utf-8")
+    image = Image.open(io.BytesIO(base64.b64decode(encoded)))
+    return np.array(image)
+
+
+def direct_path(contents: bytes) -> np.ndarray:
+    return decode_image(contents)
+
+
+def direct_gray_path(contents: bytes) -> np.ndarray:
+    return decode_image(contents, grayscale=True)
+
+
+def spooled_path(contents: bytes) -> np.ndarray:
+    """What /process does now: spool the upload in chunks (to disk past the threshold), then decode."""
+    with SpooledUpload() as upload:
+        view = memoryview(contents)
+        for start in range(0, len(contents), UPLOAD_CHUNK_BYTES):
+            upload.write(view[start:start + UPLOAD_CHUNK_BYTES])
+        return decode_image(upload.buffer())
+
+
+PATHS = {"legacy": legacy_path, "direct": direct_path, "direct_grayscale": direct_gray_path, "spooled": spooled_path}
+
+
+def synthetic_scan(width: int, height: int) -> bytes:
+    """A noisy A4-at-300-DPI style page encoded as JPEG, like a phone photo or scanner output."""
+    rng = np.random.default_rng(0)
+    page = np.full((height, width, 3), 235, dtype=np.uint8)
+    page += rng.integers(0, 20, size=page.shape, dtype=np.uint8)
+    for row in range(20):
+        cv2.putText(page, f"Field {row}: handwritten value {row * 37}", (150, 200 + row * 150),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2.5, (20, 20, 20), 5)
+    ok, encoded = cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def _measure(name: str, contents: bytes, iterations: int, queue) -> None:
+    fn = PATHS[name]
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        image = fn(contents)
+        timings.append((time.perf_counter() - started) * 1000)
+        del image
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        "path": name,
+        "mean_ms": round(float(np.mean(timings)), 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+        "peak_rss_growth_mb": round((peak_kb - baseline_kb) / 1024, 1),
+        "traced_peak_mb": round(traced_peak / 1024 / 1024, 1),
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=2480)
+    parser.add_argument("--height", type=int, default=3508)
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    contents = synthetic_scan(args.width, args.height)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name in PATHS:
+        queue = context.Queue()
+        process = context.Process(target=_measure, args=(name, contents, args.iterations, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    print(json.dumps({"upload_bytes": len(contents), "width": args.width, "height": args.height,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
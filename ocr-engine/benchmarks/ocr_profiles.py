@@ -0,0 +1,85 @@
+"""Accuracy vs latency of the CPU inference profiles (OCR_PROFILE) on a local labeled set.
+
+Usage: python benchmarks/ocr_profiles.py <labeled_dir> [--profiles accurate,balanced,fast
+                                                          --threads 1 --repeat 1]
+
+<labeled_dir> holds images with a same-named .txt file of the expected text (see
+preprocessing.load_labeled_dir). Each profile runs in a fresh process with the worker thread
+layout, and reports reader load time, RSS after loading, mean character error rate and
+mean/p95 OCR latency per image (after one warmup inference). Needs the EasyOCR weights of
+every detector involved (python setup_ocr.py fetches them).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _resident_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def run_profile(name: str, labeled_dir: str, threads: int, repeat: int) -> Dict[str, Any]:
+    from ocr_pool import _set_torch_threads, _warmup_image
+    from preprocessing import character_error_rate, load_labeled_dir
+    from setup_ocr import build_reader, readtext_options, resolve_profile
+
+    _set_torch_threads(threads)
+    samples = load_labeled_dir(labeled_dir)
+    profile = resolve_profile(name)
+    options = readtext_options(profile)
+
+    started = time.perf_counter()
+    reader = build_reader(profile=profile)
+    load_ms = (time.perf_counter() - started) * 1000
+    reader.readtext(_warmup_image(), **options)
+
+    errors: List[float] = []
+    latencies: List[float] = []
+    for image, expected in samples:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = reader.readtext(image, **options)
+            latencies.append((time.perf_counter() - started) * 1000)
+        results.sort(key=lambda r: (r[0][0][1], r[0][0][0]))
+        errors.append(character_error_rate(" ".join(r[1] for r in results), expected))
+
+    return {
+        **profile,
+        "samples": len(samples),
+        "reader_load_ms": round(load_ms, 1),
+        "resident_mb": round(_resident_mb(), 1),
+        "mean_cer": round(float(np.mean(errors)), 4) if errors else None,
+        "mean_ocr_ms": round(float(np.mean(latencies)), 1) if latencies else None,
+        "p95_ocr_ms": round(float(np.percentile(latencies, 95)), 1) if latencies else None,
+    }
+
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("labeled_dir")
+    parser.add_argument("--profiles", default="accurate,balanced,fast")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("OCR_THREADS_PER_WORKER", "1")),
+                        help="torch intra-op threads, as in one OCR worker")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed inferences per image")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    report = {}
+    for name in args.profiles.split(","):
+        with context.Pool(1) as pool:
+            report[name] = pool.apply(run_profile, (name, args.labeled_dir, args.threads, args.repeat))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,488 @@
+"""End-to-end pipeline benchmark on a synthetic corpus, fully offline.
+
+Usage: python benchmarks/pipeline.py [--images 24 --pdfs 2 --pdf-pages 3 --llm-latency 0.5
+                                      --concurrency 1,4,8 --scenarios agent,batch --fake-ocr --output run.json
+                                      --baseline baseline.json --tolerance 0.2]
+
+Generates form images and multi-page PDFs with PIL, swaps Groq for the local stand-in LLM
+(LLM_BACKEND=local) and drives both ExtractionAgent.process and the /process endpoint
+(in-process, through httpx's ASGI transport). Reports:
+
+- startup: app import and OCR worker warmup time (cold start)
+- agent.cold / agent.warm: p50/p95/p99 per pipeline step, first pass vs a repeat pass served
+  from the result caches
+- throughput: requests/second and latency percentiles at each concurrency level, for the
+  agent and the HTTP endpoint
+- batch: the same images as one /process/batch call vs one /process call at a time, with how
+  many images each batched OCR pass held (images are grouped by padded size, so pages that
+  preprocessing cropped to different sizes may not share a pass)
+- mixed: interactive /process latency alone, then while a /process/batch of --images runs
+  alongside, once as bulk work and once sent as interactive (the batch's LLM calls and OCR jobs
+  then queue first-come first-served with the interactive requests, as without priority lanes)
+- tokens: LLM tokens per page (stand-in estimates, ~4 characters per token) with low-confidence
+  fields resolved inside the structuring call (LLM_CORRECTION_IN_PROMPT=1) vs by a second
+  correction call, and the net change
+- pdf: multi-page /process latency (needs poppler; skipped when pdfinfo is missing)
+- response: full vs detail=compact response bytes, and serialization time with the stdlib
+  encoder vs the app's encoder (orjson when installed)
+- peak_rss_mb: peak RSS of this process and of the OCR worker processes
+- ocr_worker_memory_mb: memory of the live OCR workers after the run, split into private pages
+  and pages shared with the server (the weights, with OCR_SHARE_WEIGHTS=1); compare runs with
+  different OCR_WORKERS to get the cost of each additional worker
+
+--fake-ocr replaces EasyOCR with an ink-blob detector (in-process worker), for machines
+without the model weights; OCR numbers are then not representative, everything else is.
+With --baseline, exits 1 when a latency/memory metric grows, or a throughput metric drops,
+by more than --tolerance (and by more than --min-delta in absolute terms).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCENARIOS = ("agent", "throughput", "batch", "mixed", "tokens", "pdf")
+
+FIELD_LABELS = [
+    "Policy No", "Claimant Name", "Date of Birth", "Address", "City", "Postal Code", "Phone",
+    "Email", "Date of Loss", "Amount Claimed", "Bank Account", "Employer", "Occupation",
+    "Vehicle Reg", "Witness", "Reference",
+]
+
+
+def _font(size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only ships the small bitmap font
+        return ImageFont.load_default()
+
+
+def synthetic_form(seed: int, width: int = 1240, height: int = 1754) -> Image.Image:
+    """An A4-at-150-DPI style form: title, two columns of label/value rows, a signature line."""
+    rng = np.random.default_rng(seed)
+    page = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(page)
+    draw.text((80, 60), f"CLAIM FORM {seed:05d}", fill="black", font=_font(44))
+    label_font, value_font = _font(26), _font(30)
+    rows = int(rng.integers(8, len(FIELD_LABELS) + 1))
+    for row, label in enumerate(FIELD_LABELS[:rows]):
+        column, line = divmod(row, (rows + 1) // 2)
+        x, y = 80 + column * 600, 200 + line * 120
+        draw.text((x, y), f"{label}:", fill="black", font=label_font)
+        value = "".join(rng.choice(list("ABCDEFGHJKLMNPRSTUVWXYZ0123456789"), size=int(rng.integers(4, 12))))
+        draw.text((x + 240, y - 4), value, fill=(20, 20, 90), font=value_font)
+    draw.line((80, height - 200, 500, height - 200), fill="black", width=2)
+    draw.text((80, height - 190), "Signature", fill="black", font=label_font)
+    # A slight tilt, like a phone photo or a feeder scan
+    return page.rotate(float(rng.uniform(-2, 2)), fillcolor="white", resample=Image.BICUBIC)
+
+
+def encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def synthetic_pdf(seed: int, pages: int) -> bytes:
+    images = [synthetic_form(seed * 100 + page) for page in range(pages)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffer.getvalue()
+
+
+class InkBlobReader:
+    """EasyOCR-shaped detector for --fake-ocr: one detection per horizontally merged ink blob.
+
+    Every fourth blob is read with low confidence, so the refinement and correction paths run.
+    """
+
+    def readtext(self, image: np.ndarray, **options: Any) -> List[Tuple[List[List[float]], str, float]]:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        mask = cv2.dilate(mask, np.ones((5, 25), np.uint8))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        results = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w * h < 200:
+                continue
+            box = [[float(x), float(y)], [float(x + w), float(y)], [float(x + w), float(y + h)], [float(x), float(y + h)]]
+            results.append((box, f"text{w // 10}x{h // 10}", 0.3 if len(results) % 4 == 3 else 0.9))
+        return results
+
+    def recognize(self, image: np.ndarray, **options: Any) -> List[Tuple[List[List[float]], str, float]]:
+        height, width = image.shape[:2]
+        return [([[0.0, 0.0], [float(width), 0.0], [float(width), float(height)], [0.0, float(height)]], f"read{width // 10}", 0.4)]
+
+    def readtext_batched(self, images: List[np.ndarray], batch_size: int = 1, **options: Any):
+        return [self.readtext(image, **options) for image in images]
+
+
+def _init_fake_reader(*args: Any, **kwargs: Any) -> None:
+    import ocr_pool
+    ocr_pool._reader = InkBlobReader()
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(np.mean(values)), 2),
+    }
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Percentiles of total latency and of each step's duration_ms across results."""
+    steps: Dict[str, List[float]] = {}
+    for run in runs:
+        for name, duration in run["steps"].items():
+            steps.setdefault(name, []).append(duration)
+    return {
+        "requests": len(runs),
+        "errors": sum(1 for run in runs if not run["ok"]),
+        "total": percentiles([run["total_ms"] for run in runs]),
+        "steps": {name: percentiles(values) for name, values in sorted(steps.items())},
+    }
+
+
+async def run_agent(main: Any, name: str, contents: bytes) -> Dict[str, Any]:
+    started = time.perf_counter()
+    image = main.agent.decode(contents)
+    decode_ms = (time.perf_counter() - started) * 1000
+    result = await main.agent.process(image, name)
+    steps = {"0. Decode": round(decode_ms, 2)}
+    steps.update({step["step"]: step["duration_ms"] for step in result.get("steps", []) if "duration_ms" in step})
+    return {"ok": result["status"] == "success", "total_ms": (time.perf_counter() - started) * 1000, "steps": steps,
+            "result": result}
+
+
+def response_costs(main: Any, results: List[Dict[str, Any]], repeats: int = 20) -> Dict[str, Any]:
+    """Bytes and serialization time of the full and compact response for each result."""
+    from responses import compact_result, dumps, orjson
+
+    def timed(encode, payload) -> float:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            encode(payload)
+        return (time.perf_counter() - started) * 1000 / repeats
+
+    stdlib = lambda payload: json.dumps(payload).encode("utf-8")
+    full_bytes, compact_bytes, stdlib_ms, fast_ms, compact_ms = [], [], [], [], []
+    for result in results:
+        compact = compact_result(result, "0" * 32)
+        full_bytes.append(len(dumps(result)))
+        compact_bytes.append(len(dumps(compact)))
+        stdlib_ms.append(timed(stdlib, result))
+        fast_ms.append(timed(dumps, result))
+        compact_ms.append(timed(dumps, compact))
+    return {
+        "encoder": "orjson" if orjson is not None else "json",
+        "full_bytes_mean": round(float(np.mean(full_bytes)), 1),
+        "compact_bytes_mean": round(float(np.mean(compact_bytes)), 1),
+        "serialize_full_stdlib_ms": round(float(np.mean(stdlib_ms)), 4),
+        "serialize_full_ms": round(float(np.mean(fast_ms)), 4),
+        "serialize_compact_ms": round(float(np.mean(compact_ms)), 4),
+    }
+
+
+async def run_http(client: Any, name: str, contents: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    started = time.perf_counter()
+    response = await client.post("/process", files={"file": (name, contents, content_type)}, headers=headers)
+    return {"ok": response.status_code == 200, "total_ms": (time.perf_counter() - started) * 1000, "steps": {}}
+
+
+async def throughput(call, items: List[Tuple[str, bytes]], concurrency: int) -> Dict[str, Any]:
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def bounded(name: str, contents: bytes) -> Dict[str, Any]:
+        async with limiter:
+            return await call(name, contents)
+
+    started = time.perf_counter()
+    runs = await asyncio.gather(*[bounded(name, contents) for name, contents in items])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(runs),
+        "errors": sum(1 for run in runs if not run["ok"]),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_second": round(len(runs) / elapsed, 3),
+        "latency": percentiles([run["total_ms"] for run in runs]),
+    }
+
+
+async def batch_vs_sequential(main: Any, client: Any, items: List[Tuple[str, bytes]]) -> Dict[str, Any]:
+    reset_caches(main)
+    started = time.perf_counter()
+    sequential = [await run_http(client, name, contents, "image/png") for name, contents in items]
+    sequential_s = time.perf_counter() - started
+
+    reset_caches(main)
+    stats = main.agent.ocr_pool.stats
+    micro_batches, batched_images = stats["micro_batches"], stats["batched_images"]
+    started = time.perf_counter()
+    response = await client.post("/process/batch", files=[("files", (name, contents, "image/png")) for name, contents in items])
+    batch_s = time.perf_counter() - started
+    micro_batches = stats["micro_batches"] - micro_batches
+    batched_images = stats["batched_images"] - batched_images
+    failed = response.json().get("failed", len(items)) if response.status_code == 200 else len(items)
+    return {
+        "images": len(items),
+        "errors": sum(1 for run in sequential if not run["ok"]) + failed,
+        "sequential_images_per_second": round(len(items) / sequential_s, 3),
+        "batch_images_per_second": round(len(items) / batch_s, 3),
+        "speedup": round(sequential_s / batch_s, 3),
+        "ocr_micro_batches": micro_batches,
+        "images_per_micro_batch": round(batched_images / micro_batches, 2) if micro_batches else None,
+    }
+
+
+async def mixed_load(main: Any, client: Any, images: int, interactive: int, seed: int) -> Dict[str, Any]:
+    """Interactive latency alone and next to a batch upload, with the batch as bulk and as interactive work."""
+
+    def forms(start: int, count: int) -> List[Tuple[str, bytes]]:
+        return [(f"form_{start + i}.png", encode_png(synthetic_form(start + i))) for i in range(count)]
+
+    async def interactive_runs(items: List[Tuple[str, bytes]]) -> List[Dict[str, Any]]:
+        return [await run_http(client, name, contents, "image/png") for name, contents in items]
+
+    reset_caches(main)
+    alone = await interactive_runs(forms(seed, interactive))
+    report = {"interactive_alone": percentiles([run["total_ms"] for run in alone]), "errors": sum(1 for run in alone if not run["ok"])}
+    for offset, (name, priority) in enumerate((("with_bulk_batch", "bulk"), ("with_unprioritized_batch", "interactive")), start=1):
+        reset_caches(main)
+        batch = forms(seed + offset * 1000, images)
+        batch_task = asyncio.ensure_future(client.post(
+            "/process/batch", files=[("files", (n, c, "image/png")) for n, c in batch], headers={"X-Priority": priority}))
+        # Let the batch fill the LLM and OCR queues before the interactive requests arrive
+        await asyncio.sleep(0.5)
+        runs = await interactive_runs(forms(seed + offset * 1000 + images, interactive))
+        started = time.perf_counter()
+        response = await batch_task
+        report[name] = {
+            "interactive": percentiles([run["total_ms"] for run in runs]),
+            "batch_remaining_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        report["errors"] += sum(1 for run in runs if not run["ok"])
+        report["errors"] += response.json().get("failed", images) if response.status_code == 200 else images
+    base = report["interactive_alone"].get("p95_ms")
+    if base:
+        for name in ("with_bulk_batch", "with_unprioritized_batch"):
+            report[name]["p95_vs_alone"] = round(report[name]["interactive"]["p95_ms"] / base, 3)
+    return report
+
+
+async def token_accounting(main: Any, items: List[Tuple[str, bytes]]) -> Dict[str, Any]:
+    """Structuring and correction tokens per page, with the correction in the structuring prompt and as a second call."""
+    report: Dict[str, Any] = {"images": len(items)}
+    for name, in_prompt in (("second_call", False), ("in_prompt", True)):
+        main.LLM_CORRECTION_IN_PROMPT = in_prompt
+        reset_caches(main)
+        totals = {"structuring_tokens": 0, "correction_tokens": 0, "correction_calls": 0, "uncertain_fields": 0, "errors": 0}
+        for filename, contents in items:
+            result = (await run_agent(main, filename, contents))["result"]
+            if result["status"] != "success":
+                totals["errors"] += 1
+                continue
+            steps = {step["step"]: step for step in result["steps"]}
+            structuring = steps.get("3. Extraction", {}).get("tokens", {})
+            correction = steps.get("4. Field Correction", {})
+            totals["structuring_tokens"] += structuring.get("input_tokens", 0) + structuring.get("output_tokens", 0)
+            totals["correction_tokens"] += sum(correction.get("tokens", {}).get(key, 0) for key in ("input_tokens", "output_tokens"))
+            totals["correction_calls"] += 1 if correction.get("sent") else 0
+            totals["uncertain_fields"] += correction.get("uncertain", 0)
+        pages = max(1, len(items) - totals["errors"])
+        report[name] = {
+            **totals,
+            "tokens_per_page": round((totals["structuring_tokens"] + totals["correction_tokens"]) / pages, 1),
+        }
+    main.LLM_CORRECTION_IN_PROMPT = True
+    before, after = report["second_call"]["tokens_per_page"], report["in_prompt"]["tokens_per_page"]
+    report["net_tokens_per_page"] = round(after - before, 1)
+    report["net_change"] = round((after - before) / before, 4) if before else None
+    report["errors"] = report["second_call"]["errors"] + report["in_prompt"]["errors"]
+    return report
+
+
+def worker_memory_summary(pool: Any) -> Dict[str, Any]:
+    # A worker that exited between listing and reading /proc reports no figures
+    workers = [usage for usage in pool.snapshot()["worker_memory_mb"].values() if usage]
+    if not workers:
+        return {"skipped": "no OCR worker processes (OCR_WORKERS=0)"}
+    return {
+        "workers": len(workers),
+        "share_weights": pool.share_weights,
+        "private_total": round(sum(w["private_mb"] for w in workers), 1),
+        "private_max": max(w["private_mb"] for w in workers),
+        "shared_max": max(w["shared_mb"] for w in workers),
+        "rss_total": round(sum(w["rss_mb"] for w in workers), 1),
+    }
+
+
+def reset_caches(main: Any) -> None:
+    """Fresh, memory-only result caches so a scenario measures real work, not earlier hits."""
+    main.agent.ocr_cache = main.ResultCache("ocr", max_entries=main.OCR_CACHE_ENTRIES)
+    main.agent.llm_cache = main.ResultCache("llm", max_entries=main.LLM_CACHE_ENTRIES)
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    import_started = time.perf_counter()
+    import main
+    import httpx
+    import_ms = (time.perf_counter() - import_started) * 1000
+
+    if args.fake_ocr:
+        import ocr_pool
+        ocr_pool._init_worker = _init_fake_reader
+    warmup_started = time.perf_counter()
+    await main.agent.ocr_pool.warmup()
+    report: Dict[str, Any] = {
+        "startup": {"import_ms": round(import_ms, 1), "ocr_warmup_ms": round((time.perf_counter() - warmup_started) * 1000, 1)},
+    }
+
+    scenarios = set(args.scenarios)
+    if "agent" in scenarios:
+        corpus = [(f"form_{i}.png", encode_png(synthetic_form(i))) for i in range(args.images)]
+        # Sequential passes: the first populates the caches, the repeat is served from them
+        reset_caches(main)
+        cold = [await run_agent(main, name, contents) for name, contents in corpus]
+        warm = [await run_agent(main, name, contents) for name, contents in corpus]
+        report["agent"] = {"cold": summarize(cold), "warm": summarize(warm)}
+        report["response"] = response_costs(main, [run["result"] for run in cold if run["ok"]])
+
+    if "tokens" in scenarios:
+        items = [(f"form_{80000 + i}.png", encode_png(synthetic_form(80000 + i))) for i in range(args.images)]
+        report["tokens"] = await token_accounting(main, items)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        if "throughput" in scenarios:
+            report["throughput"] = {"agent": {}, "http": {}}
+            for level, concurrency in enumerate(args.concurrency):
+                # New seeds per level so no request is answered from an earlier level's cache
+                offset = (level + 1) * 10000
+                items = [(f"form_{offset + i}.png", encode_png(synthetic_form(offset + i))) for i in range(args.images)]
+                reset_caches(main)
+                report["throughput"]["agent"][str(concurrency)] = await throughput(
+                    lambda name, contents: run_agent(main, name, contents), items, concurrency)
+                reset_caches(main)
+                report["throughput"]["http"][str(concurrency)] = await throughput(
+                    lambda name, contents: run_http(client, name, contents, "image/png"), items, concurrency)
+
+        if "batch" in scenarios:
+            items = [(f"form_{90000 + i}.png", encode_png(synthetic_form(90000 + i))) for i in range(args.images)]
+            report["batch"] = await batch_vs_sequential(main, client, items)
+
+        if "mixed" in scenarios:
+            report["mixed"] = await mixed_load(main, client, args.images, max(4, args.images // 4), 70000)
+
+        if "pdf" in scenarios and shutil.which("pdfinfo") is None:
+            report["pdf"] = {"skipped": "poppler (pdfinfo) is not installed"}
+        elif "pdf" in scenarios:
+            pdfs = [(f"doc_{i}.pdf", synthetic_pdf(50000 + i, args.pdf_pages)) for i in range(args.pdfs)]
+            reset_caches(main)
+            runs = [await run_http(client, name, contents, "application/pdf") for name, contents in pdfs]
+            report["pdf"] = {"pages_per_document": args.pdf_pages, **summarize(runs)}
+
+    report["ocr_worker_memory_mb"] = worker_memory_summary(main.agent.ocr_pool)
+    main.agent.ocr_pool.shutdown(wait=True)
+    # ru_maxrss is in KiB on Linux; workers count once they have exited (after shutdown)
+    report["peak_rss_mb"] = {
+        "server": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "ocr_workers": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    return report
+
+
+def _flatten(report: Any, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    if isinstance(report, dict):
+        for key, value in report.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(report, (int, float)) and not isinstance(report, bool):
+        flat[prefix] = float(report)
+    return flat
+
+
+def regressions(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta: float) -> List[str]:
+    """Metrics that got worse than the baseline: any new errors, throughput down by more than
+    `tolerance`, or latency/RSS up by more than `tolerance` and `min_delta`."""
+    found = []
+    now, before = _flatten(current), _flatten(baseline)
+    for key, old in sorted(before.items()):
+        new = now.get(key)
+        if new is None or key.startswith("config."):
+            continue
+        if "per_second" in key:
+            worse = new < old * (1 - tolerance)
+        elif key.endswith(".errors"):
+            worse = new > old
+        elif key.endswith("_ms") or key.startswith(("peak_rss_mb.", "ocr_worker_memory_mb.private")):
+            worse = new > old * (1 + tolerance) and new - old > min_delta
+        else:
+            continue
+        if worse:
+            found.append(f"{key}: {old:g} -> {new:g}")
+    return found
+
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=24)
+    parser.add_argument("--pdfs", type=int, default=2)
+    parser.add_argument("--pdf-pages", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Stand-in LLM latency in seconds")
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 8])
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS),
+                        help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--fake-ocr", action="store_true", help="Use the ink-blob detector instead of EasyOCR")
+    parser.add_argument("--templates", action="store_true", help="Keep form-template matching enabled")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--min-delta", type=float, default=5.0, help="Ignore regressions smaller than this (ms / MB)")
+    args = parser.parse_args()
+
+    # Configure the app before it is imported: offline LLM, no disk cache, no learned templates
+    os.environ["LLM_BACKEND"] = "local"
+    os.environ["LOCAL_LLM_LATENCY_SECONDS"] = str(args.llm_latency)
+    os.environ["CACHE_DIR"] = ""
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ["TEMPLATES_ENABLED"] = "1" if args.templates else "0"
+    if args.fake_ocr:
+        os.environ["OCR_WORKERS"] = "0"
+
+    report = asyncio.run(benchmark(args))
+    report["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    rendered = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(rendered)
+    else:
+        print(rendered)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(report, json.load(f), args.tolerance, args.min_delta)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
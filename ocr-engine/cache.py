@@ -0,0 +1,240 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def hash_bytes(*parts: bytes) -> str:
+    """Stable content hash used as a cache key."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def hash_json(payload: Any) -> str:
+    """Hash a JSON-serializable payload with sorted keys, so dict order never changes the key."""
+    return hash_bytes(json.dumps(payload, sort_keys=True, default=str).encode("utf-8"))
+
+
+class _Flight:
+    """One in-progress computation shared by every caller of the same key."""
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+        self.claimed = False
+
+
+class ResultCache:
+    """Bounded LRU cache with an optional on-disk tier, TTL expiry and request coalescing.
+
+    Values must be JSON-serializable. Callers always receive their own copy, so later pipeline
+    steps may mutate results freely. Concurrent callers of `get_or_compute` with the same key
+    share a single computation instead of starting duplicates.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 256,
+        ttl_seconds: Optional[float] = None,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 0,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Flight] = {}
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[tuple]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                os.remove(path)
+                self.stats["expired"] += 1
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return stored_at, json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cache '{self.name}': dropping unreadable disk entry {key}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, key: str, value: Any) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Cache '{self.name}': failed to persist {key}: {e}")
+            return
+        self._enforce_disk_limit()
+
+    def _enforce_disk_limit(self) -> None:
+        """Evict the oldest disk entries until the tier fits in `disk_max_bytes`."""
+        if not self.disk_max_bytes:
+            return
+        entries = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        while total > self.disk_max_bytes and entries:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+                total -= size
+                self.stats["evictions"] += 1
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                stored_at, value = item
+                if not self._expired(stored_at):
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return copy.deepcopy(value)
+                del self._memory[key]
+                self.stats["expired"] += 1
+
+        item = self._read_disk(key)
+        if item is not None:
+            self.stats["disk_hits"] += 1
+            self._put_memory(key, item[1], stored_at=item[0])
+            return copy.deepcopy(item[1])
+
+        self.stats["misses"] += 1
+        return None
+
+    def _put_memory(self, key: str, value: Any, stored_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._memory[key] = (stored_at or time.time(), value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def set(self, key: str, value: Any) -> None:
+        value = copy.deepcopy(value)
+        self._put_memory(key, value)
+        self._write_disk(key, value)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """`get` for async callers: a disk-tier lookup runs in a thread, off the event loop."""
+        if self.disk_dir:
+            return await asyncio.to_thread(self.get, key)
+        return self.get(key)
+
+    async def aset(self, key: str, value: Any) -> None:
+        if self.disk_dir:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = lambda value: True,
+    ) -> Any:
+        """Return the cached value for `key`, or run `compute` once and share it with concurrent callers.
+
+        The computation runs in its own task, so a caller that is cancelled (a disconnected
+        client, a cancelled job) does not take the shared result down with it; the task is only
+        cancelled once no caller is waiting on it any more.
+        """
+        cached = await self.aget(key)
+        if cached is not None:
+            return cached
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(self._compute(key, compute, should_cache)))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.stats["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            value, snapshot = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Every caller gave up: stop the work, and let the next caller start afresh
+                self._forget(key, flight)
+                flight.task.cancel()
+        if flight.claimed:
+            # Later callers copy from the private snapshot, never from the object handed out first
+            return copy.deepcopy(snapshot)
+        flight.claimed = True
+        return value
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]], should_cache: Callable[[Any], bool]) -> Tuple[Any, Any]:
+        value = await compute()
+        if should_cache(value):
+            await self.aset(key, value)
+        return value, copy.deepcopy(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_enabled": bool(self.disk_dir),
+            "hit_ratio": round((self.stats["hits"] + self.stats["disk_hits"]) / lookups, 4) if lookups else 0.0,
+        }
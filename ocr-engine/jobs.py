@@ -0,0 +1,350 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from admission import AdmissionRejected
+from ocr_pool import OCRPoolSaturated
+
+logger = logging.getLogger(__name__)
+
+# Durable job queue: metadata in SQLite, uploads as files next to it (mount JOBS_DIR on a volume).
+# The default is next to this module, not the working directory.
+JOBS_DIR = os.getenv("JOBS_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs")
+# Jobs processed concurrently, and an optional cap on job starts per minute (0 = no cap)
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "1"))
+JOBS_MAX_PER_MINUTE = float(os.getenv("JOBS_MAX_PER_MINUTE", "0"))
+# A job interrupted this many times (e.g. the process crashed while running it) is failed, not retried
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "5"))
+# Finished jobs (and their results) are deleted after this long
+JOBS_RETENTION_SECONDS = float(os.getenv("JOBS_RETENTION_SECONDS", str(7 * 86400)))
+JOBS_CALLBACK_RETRIES = int(os.getenv("JOBS_CALLBACK_RETRIES", "3"))
+JOBS_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOBS_CALLBACK_TIMEOUT_SECONDS", "10"))
+# Callbacks go to https URLs whose host resolves only to public addresses, so a job cannot make the
+# engine POST into its own network. Hosts listed here (comma-separated) are trusted as they are,
+# http and private addresses included, e.g. an internal service receiving the results.
+JOBS_CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("JOBS_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    callback_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    callback_status TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, available_at, created_at);
+"""
+
+
+def check_callback_url(url: str, allowed_hosts: Optional[set] = None) -> None:
+    """Raise ValueError unless `url` is a callback the engine may POST to (see JOBS_CALLBACK_ALLOWED_HOSTS).
+
+    Blocking: resolves the host name.
+    """
+    allowed_hosts = JOBS_CALLBACK_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError("callback_url must be an http(s) URL")
+    if host in allowed_hosts:
+        return
+    if allowed_hosts:
+        raise ValueError(f"callback_url host {host!r} is not in JOBS_CALLBACK_ALLOWED_HOSTS")
+    if parts.scheme != "https":
+        raise ValueError("callback_url must use https")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"callback_url host {host!r} does not resolve: {e}")
+    for address in addresses:
+        # Drop any IPv6 scope ("fe80::1%eth0") before parsing
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise ValueError(f"callback_url host {host!r} resolves to a non-public address ({address})")
+
+
+class JobQueue:
+    """Persistent FIFO of uploaded documents. All methods are blocking; call them from a thread."""
+
+    def __init__(self, directory: str = JOBS_DIR):
+        self.directory = directory
+        self.upload_dir = os.path.join(directory, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "jobs.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        # WAL keeps status reads from blocking on a writer
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def upload_path(self, job_id: str) -> str:
+        return os.path.join(self.upload_dir, job_id)
+
+    def enqueue(self, filename: str, content_type: str, source: BinaryIO, callback_url: Optional[str] = None) -> str:
+        """Copy the upload from `source` into the queue and return the new job id.
+
+        Raises ValueError for a `callback_url` that check_callback_url rejects.
+        """
+        if callback_url:
+            check_callback_url(callback_url)
+        job_id = uuid.uuid4().hex
+        path = self.upload_path(job_id)
+        # The upload is on disk (fsynced) before the job becomes visible to workers
+        with open(path, "wb") as f:
+            shutil.copyfileobj(source, f)
+            f.flush()
+            os.fsync(f.fileno())
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, filename, content_type, callback_url, created_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, content_type, callback_url, now, now),
+            )
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest available queued job to running and return it."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND available_at <= ? ORDER BY created_at LIMIT 1",
+                    (QUEUED, time.time()),
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, time.time(), row["id"]),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def requeue(self, job_id: str, delay_seconds: float) -> None:
+        """Put a running job back, e.g. when the OCR pool is saturated; does not count as an attempt."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, attempts = attempts - 1 WHERE id = ? AND status = ?",
+                (QUEUED, time.time() + delay_seconds, job_id, RUNNING),
+            )
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (FAILED if error else SUCCEEDED, time.time(), json.dumps(result) if result is not None else None, error, job_id),
+            )
+        try:
+            os.remove(self.upload_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def set_callback_status(self, job_id: str, status: str) -> None:
+        with self._lock:
+            self._db.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def recover(self, max_attempts: int = JOBS_MAX_ATTEMPTS) -> Dict[str, int]:
+        """After a restart, re-queue jobs that were running when the process stopped.
+
+        Jobs that already used `max_attempts` are failed instead, so a document that crashes the
+        engine cannot crash it forever.
+        """
+        with self._lock:
+            failed = self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE status = ? AND attempts >= ?",
+                (FAILED, time.time(), f"Interrupted {max_attempts} time(s) while running", RUNNING, max_attempts),
+            ).rowcount
+            requeued = self._db.execute(
+                "UPDATE jobs SET status = ?, available_at = ? WHERE status = ?", (QUEUED, time.time(), RUNNING)
+            ).rowcount
+        return {"requeued": requeued, "failed": failed}
+
+    def purge(self, older_than_seconds: float = JOBS_RETENTION_SECONDS) -> int:
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (SUCCEEDED, FAILED, time.time() - older_than_seconds),
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """What GET /jobs/{id} returns: status and timings, plus the result or error once finished."""
+    view = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if job["callback_url"]:
+        view["callback_status"] = job["callback_status"]
+    if job["status"] == SUCCEEDED:
+        view["result"] = job["result"]
+    elif job["status"] == FAILED:
+        view["error"] = job["error"]
+    return view
+
+
+class JobRunner:
+    """Background workers that drain the JobQueue at a controlled rate and deliver callbacks."""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[str, str, str], Awaitable[Dict[str, Any]]],
+        workers: int = JOBS_WORKERS,
+        max_per_minute: float = JOBS_MAX_PER_MINUTE,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.min_interval = 60.0 / max_per_minute if max_per_minute > 0 else 0.0
+        self._next_start = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"processed": 0, "failed": 0, "requeued": 0, "callbacks_failed": 0}
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        recovered = await asyncio.to_thread(self.queue.recover)
+        purged = await asyncio.to_thread(self.queue.purge)
+        if recovered["requeued"] or recovered["failed"] or purged:
+            logger.info(f"Job queue recovery: {recovered}, purged {purged} expired job(s)")
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        # A job cancelled mid-run stays "running" in the database and is re-queued by the next start()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Wake an idle worker after an enqueue instead of waiting for the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _pace(self) -> None:
+        if not self.min_interval:
+            return
+        now = time.monotonic()
+        start_at = max(now, self._next_start)
+        self._next_start = start_at + self.min_interval
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+
+    async def _work(self, index: int) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except Exception as e:
+                logger.error(f"Job worker {index} could not claim a job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOBS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._pace()
+            await self._run(job)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        try:
+            # The handler reads the upload straight from its queue file
+            result = await self.handler(self.queue.upload_path(job_id), job["filename"], job["content_type"])
+        except (OCRPoolSaturated, AdmissionRejected) as e:
+            # Interactive traffic has the engine; try again later rather than failing the job
+            self.stats["requeued"] += 1
+            delay = getattr(e, "retry_after", JOBS_POLL_SECONDS)
+            await asyncio.to_thread(self.queue.requeue, job_id, delay)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            result = {"status": "error", "error": str(e)}
+
+        error = result.get("error") if result.get("status") == "error" else None
+        await asyncio.to_thread(self.queue.finish, job_id, None if error else result, error)
+        self.stats["failed" if error else "processed"] += 1
+        if job["callback_url"]:
+            await self._deliver_callback(job_id, job["callback_url"])
+
+    async def _deliver_callback(self, job_id: str, url: str) -> None:
+        # Checked again at delivery: the host may resolve differently than when the job was queued
+        try:
+            await asyncio.to_thread(check_callback_url, url)
+        except ValueError as e:
+            self.stats["callbacks_failed"] += 1
+            logger.warning(f"Callback for job {job_id} not sent: {e}")
+            await asyncio.to_thread(self.queue.set_callback_status, job_id, f"rejected ({e})")
+            return
+        payload = public_view(await asyncio.to_thread(self.queue.get, job_id))
+        async with httpx.AsyncClient(timeout=JOBS_CALLBACK_TIMEOUT_SECONDS) as client:
+            for attempt in range(JOBS_CALLBACK_RETRIES + 1):
+                try:
+                    response = await client.post(url, json=payload)
+                    if response.status_code < 400:
+                        await asyncio.to_thread(self.queue.set_callback_status, job_id, f"delivered ({response.status_code})")
+                        return
+                    status = f"HTTP {response.status_code}"
+                except httpx.HTTPError as e:
+                    status = f"{type(e).__name__}: {e}"
+                if attempt < JOBS_CALLBACK_RETRIES:
+                    await asyncio.sleep(2 ** attempt)
+        self.stats["callbacks_failed"] += 1
+        logger.warning(f"Callback for job {job_id} to {url} failed: {status}")
+        await asyncio.to_thread(self.queue.set_callback_status, job_id, f"failed ({status})")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "workers": self.workers, "jobs": self.queue.counts()}
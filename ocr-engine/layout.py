@@ -0,0 +1,184 @@
+import math
+import re
+from statistics import median
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Detections whose vertical extents overlap by at least this fraction of the smaller height
+# belong to the same line.
+LINE_OVERLAP_RATIO = 0.5
+# A horizontal gap wider than this many line heights starts a new cell (column) within a line.
+CELL_GAP_RATIO = 1.5
+# A cell of at most this many words can be a label without a trailing colon.
+LABEL_MAX_WORDS = 4
+# Coordinates in the prompt are quantized to this many steps across the page.
+COORD_GRID = 100
+
+_LABEL_RE = re.compile(r"^(.{1,40}?)\s*[:：]\s*(.*)$")
+
+
+def box_of(bbox: Sequence[Sequence[float]]) -> List[int]:
+    """Axis-aligned [x0, y0, x1, y1] around an EasyOCR four-point box."""
+    xs = [point[0] for point in bbox]
+    ys = [point[1] for point in bbox]
+    return [int(min(xs)), int(min(ys)), int(math.ceil(max(xs))), int(math.ceil(max(ys)))]
+
+
+def _vertical_overlap(a: List[int], b: List[int]) -> float:
+    overlap = min(a[3], b[3]) - max(a[1], b[1])
+    smaller = max(1, min(a[3] - a[1], b[3] - b[1]))
+    return overlap / smaller
+
+
+def group_lines(elements: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Cluster elements (each with a `bbox`) into reading-order lines.
+
+    Each element joins the line whose horizontally nearest member overlaps it vertically, so
+    slightly tilted lines stay together instead of interleaving by top-left corner.
+    """
+    lines: List[List[Dict[str, Any]]] = []
+    for element in sorted(elements, key=lambda e: (e["bbox"][1] + e["bbox"][3]) / 2):
+        box = element["bbox"]
+        best_line, best_overlap = None, LINE_OVERLAP_RATIO
+        # Only recent lines can still overlap, since elements arrive in vertical order
+        for line in lines[-3:]:
+            nearest = min(line, key=lambda e: abs((e["bbox"][0] + e["bbox"][2]) - (box[0] + box[2])))
+            overlap = _vertical_overlap(nearest["bbox"], box)
+            if overlap >= best_overlap:
+                best_line, best_overlap = line, overlap
+        if best_line is None:
+            lines.append([element])
+        else:
+            best_line.append(element)
+    for line in lines:
+        line.sort(key=lambda e: e["bbox"][0])
+    lines.sort(key=lambda line: min(e["bbox"][1] for e in line))
+    return lines
+
+
+def split_cells(line: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Split a line into cells at horizontal gaps much wider than the text height."""
+    height = median(e["bbox"][3] - e["bbox"][1] for e in line) or 1
+    cells = [[line[0]]]
+    for previous, element in zip(line, line[1:]):
+        if element["bbox"][0] - previous["bbox"][2] > CELL_GAP_RATIO * height:
+            cells.append([element])
+        else:
+            cells[-1].append(element)
+    return cells
+
+
+def _cell_text(cell: List[Dict[str, Any]]) -> str:
+    return " ".join(e["text"] for e in cell).strip()
+
+
+def _marked_text(element: Dict[str, Any], uncertain_below: float) -> str:
+    # Low-confidence text carries its other readings: `text{?alt1|alt2}` (`text{?}` when none)
+    if element.get("clarity", 1.0) >= uncertain_below:
+        return element["text"]
+    return f"{element['text']}{{?{'|'.join(element.get('alternatives', []))}}}"
+
+
+def _bare_label_pair(cells: List[str]) -> bool:
+    # Without a colon, two cells read as label and value only when the first is short and
+    # digit-free and the second looks like a filled-in value (a number, date, ID or email), so
+    # rows of two headings or two columns of prose are not paired
+    label, value = cells
+    return (0 < len(label.split()) <= LABEL_MAX_WORDS and not any(ch.isdigit() for ch in label)
+            and any(ch.isdigit() or ch == "@" for ch in value))
+
+
+def key_value_pairs(lines: List[List[Dict[str, Any]]]) -> List[Dict[str, str]]:
+    """Label/value pairs from "Label: value" text, a "Label:" cell followed by a value cell, or a
+    two-cell row of a short label and a number, date, ID or email."""
+    pairs = []
+    for line in lines:
+        cells = [_cell_text(cell) for cell in split_cells(line)]
+        i = 0
+        while i < len(cells):
+            match = _LABEL_RE.match(cells[i])
+            if match and match.group(2):
+                pairs.append({"key": match.group(1), "value": match.group(2)})
+            elif match and i + 1 < len(cells):
+                pairs.append({"key": match.group(1), "value": cells[i + 1]})
+                i += 1
+            elif len(cells) == 2 and i == 0 and _bare_label_pair(cells):
+                # Two-cell row without a colon, e.g. "Policy No."  "AB-12345"
+                pairs.append({"key": cells[0], "value": cells[1]})
+                i += 1
+            i += 1
+    return pairs
+
+
+def reading_order_text(lines: List[List[Dict[str, Any]]]) -> str:
+    return "\n".join(" ".join(e["text"] for e in line) for line in lines)
+
+
+def encode_compact(lines: List[List[Dict[str, Any]]], width: int, height: int, grid: int = COORD_GRID,
+                   uncertain_below: float = 0.0) -> str:
+    """Token-efficient layout encoding: one row per line, each string exactly once.
+
+    Row format: `y|x:cell x:cell`, coordinates quantized to 0..grid-1 across the page. A cell
+    ending in ":" is a label for the cell that follows it. Text with clarity below
+    `uncertain_below` is followed by `{?alt1|alt2}`, its alternative readings.
+    """
+    def quantize(value: float, extent: int) -> int:
+        return min(grid - 1, int(value * grid / max(1, extent)))
+
+    rows = []
+    for line in lines:
+        y = quantize(min(e["bbox"][1] for e in line), height)
+        cells = " ".join(
+            f"{quantize(cell[0]['bbox'][0], width)}:{' '.join(_marked_text(e, uncertain_below) for e in cell).strip()}"
+            for cell in split_cells(line)
+        )
+        rows.append(f"{y}|{cells}")
+    return "\n".join(rows)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for Llama-family tokenizers (~4 characters per token of English)."""
+    return math.ceil(len(text) / 4)
+
+
+def page_extent(elements: List[Dict[str, Any]], shape: Optional[Tuple[int, ...]] = None) -> Tuple[int, int]:
+    """Page width and height: the image shape when known, else the extent of the detections."""
+    if shape is not None:
+        return int(shape[1]), int(shape[0])
+    if not elements:
+        return 1, 1
+    return max(e["bbox"][2] for e in elements), max(e["bbox"][3] for e in elements)
+
+
+def chunk_lines(lines: List[List[Dict[str, Any]]], width: int, height: int, max_tokens: int,
+                uncertain_below: float = 0.0) -> List[List[List[Dict[str, Any]]]]:
+    """Split lines into chunks whose encoding fits `max_tokens`, cutting at layout boundaries.
+
+    When a chunk fills up, it is cut at the widest vertical gap in its last half (usually a
+    section break) rather than at whichever line happened to overflow it. A line that alone
+    exceeds `max_tokens` gets a chunk of its own.
+    """
+    chunks: List[List[List[Dict[str, Any]]]] = []
+    current: List[List[Dict[str, Any]]] = []
+    sizes: List[int] = []
+    for line in lines:
+        line_tokens = estimate_tokens(encode_compact([line], width, height, uncertain_below=uncertain_below)) + 1
+        # The lines carried over from a cut can still leave no room for this one, so cut again until it fits
+        while current and sum(sizes) + line_tokens > max_tokens:
+            cut = _widest_gap(current, start=len(current) // 2)
+            chunks.append(current[:cut])
+            current, sizes = current[cut:], sizes[cut:]
+        current.append(line)
+        sizes.append(line_tokens)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _widest_gap(lines: List[List[Dict[str, Any]]], start: int) -> int:
+    """Index of the line after the widest vertical gap among lines[start:], or len(lines)."""
+    best_index, best_gap = len(lines), -1
+    for i in range(max(1, start), len(lines)):
+        gap = min(e["bbox"][1] for e in lines[i]) - max(e["bbox"][3] for e in lines[i - 1])
+        if gap > best_gap:
+            best_index, best_gap = i, gap
+    return best_index
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from admission import PriorityLanes
+from layout import estimate_tokens
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+# Concurrency and retry policy for the structuring LLM. Size GROQ_MAX_CONCURRENCY to the
+# account's requests-per-minute budget divided by the typical call duration.
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "4"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+GROQ_BACKOFF_BASE_SECONDS = float(os.getenv("GROQ_BACKOFF_BASE_SECONDS", "0.5"))
+GROQ_BACKOFF_MAX_SECONDS = float(os.getenv("GROQ_BACKOFF_MAX_SECONDS", "8"))
+GROQ_CALL_DEADLINE_SECONDS = float(os.getenv("GROQ_CALL_DEADLINE_SECONDS", "90"))
+GROQ_POOL_CONNECTIONS = int(os.getenv("GROQ_POOL_CONNECTIONS", "20"))
+
+# LLM_STREAMING=1 streams completions so their sections can be processed as they close. If the
+# provider refuses to stream, whole completions are requested for LLM_STREAM_RETRY_SECONDS.
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1").lower() in ("1", "true", "yes")
+LLM_STREAM_RETRY_SECONDS = float(os.getenv("LLM_STREAM_RETRY_SECONDS", "300"))
+
+# LLM_BACKEND=local swaps Groq for an offline stand-in with LOCAL_LLM_LATENCY_SECONDS latency
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq").lower()
+LOCAL_LLM_LATENCY_SECONDS = float(os.getenv("LOCAL_LLM_LATENCY_SECONDS", "0.5"))
+
+
+_LAYOUT_ROW_RE = re.compile(r"^\d+\|")
+# Provider messages that refuse streaming itself, e.g. "json mode does not support streaming responses"
+_STREAM_UNSUPPORTED_RE = re.compile(
+    r"(does not|doesn't|not) support\w*( \w+)? stream|stream\w*`? (is |are )?not (supported|allowed|available)", re.IGNORECASE)
+
+
+def build_http_clients(max_connections: int = GROQ_POOL_CONNECTIONS):
+    """Shared keep-alive connection pools so concurrent calls reuse TLS connections."""
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.Client(limits=limits), httpx.AsyncClient(limits=limits)
+
+
+class LocalStandInLLM(BaseChatModel):
+    """Offline chat model for load tests: sleeps for a fixed latency and echoes the OCR lines as JSON
+    (or, for a field-correction prompt, the fields unchanged). Lines with low-confidence marks are
+    reported in `unclear_fields`, and token usage is estimated from the text lengths.
+
+    Streaming spreads the latency over chunks of `stream_chunk_chars` characters.
+    """
+
+    latency_seconds: float = LOCAL_LLM_LATENCY_SECONDS
+    stream_chunk_chars: int = 64
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-stand-in"
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt = "\n".join(str(m.content) for m in messages)
+        if "UNCERTAIN FIELDS:" in prompt:
+            # Field correction: keep every value, and stay unsure of it
+            fields = json.loads(prompt.split("UNCERTAIN FIELDS:", 1)[1].split("[/INST]", 1)[0])
+            reply = {"fields": [{"id": f["id"], "value": f["value"], "certain": False} for f in fields]}
+            return self._result(prompt, json.dumps(reply))
+        ocr_payload = prompt.split("RAW OCR DATA", 1)[-1].split("[/INST]", 1)[0]
+        lines = [line.strip() for line in ocr_payload.splitlines()[1:] if line.strip()]
+        # Prefer the `y|x:text` layout rows when the prompt carries them
+        layout_rows = [line for line in lines if _LAYOUT_ROW_RE.match(line)]
+        lines = layout_rows or lines
+        response = {
+            "document_type": "Local Stand-In",
+            "summary": f"Echo of {len(lines)} OCR line(s)",
+            "sections": [
+                {
+                    "section_name": "OCR Lines",
+                    "fields": [
+                        {"field_name": f"line_{i + 1}", "field_value": line}
+                        for i, line in enumerate(lines)
+                    ],
+                }
+            ],
+        }
+        if '"unclear_fields"' in prompt:
+            response["unclear_fields"] = [f"OCR Lines / line_{i + 1}" for i, line in enumerate(lines) if "{?" in line]
+        return self._result(prompt, json.dumps(response))
+
+    @staticmethod
+    def _result(prompt: str, content: str) -> ChatResult:
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        message = AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return self._respond(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        return self._respond(messages)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._respond(messages).generations[0].message
+        text = str(message.content)
+        pieces = [text[i:i + self.stream_chunk_chars] for i in range(0, len(text), self.stream_chunk_chars)]
+        for index, piece in enumerate(pieces):
+            await asyncio.sleep(self.latency_seconds / len(pieces))
+            # Like the provider, usage arrives with the last chunk
+            usage = message.usage_metadata if index == len(pieces) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage))
+
+
+class LLMCallError(Exception):
+    """The LLM call failed after exhausting retries or the per-call deadline."""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_streaming_unsupported(exc: BaseException) -> bool:
+    """A 4xx (other than 429) whose message says the request cannot be streamed."""
+    status = _status_code(exc)
+    return status is not None and 400 <= status < 500 and status != 429 and bool(_STREAM_UNSUPPORTED_RE.search(str(exc)))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429s, 5xx responses and transport errors are worth retrying; other 4xx are not."""
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)) or (
+        type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+    )
+
+
+class StructuringLLMClient:
+    """Async, concurrency-limited LLM caller with jittered backoff retries and a per-call deadline."""
+
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        max_concurrency: int = GROQ_MAX_CONCURRENCY,
+        max_retries: int = GROQ_MAX_RETRIES,
+        backoff_base: float = GROQ_BACKOFF_BASE_SECONDS,
+        backoff_max: float = GROQ_BACKOFF_MAX_SECONDS,
+        deadline_seconds: float = GROQ_CALL_DEADLINE_SECONDS,
+        streaming: bool = LLM_STREAMING,
+        stream_retry_seconds: float = LLM_STREAM_RETRY_SECONDS,
+    ):
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline_seconds = deadline_seconds
+        self.streaming = streaming
+        self.stream_retry_seconds = stream_retry_seconds
+        self._stream_paused_until = 0.0
+        self._semaphore: Optional[PriorityLanes] = None
+        self.in_flight = 0
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0, "stream_refused": 0}
+
+    def _limiter(self) -> PriorityLanes:
+        # Created lazily so it binds to the running event loop; interactive calls are served first
+        if self._semaphore is None:
+            self._semaphore = PriorityLanes(self.max_concurrency)
+        return self._semaphore
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        # Full jitter: uniform over [0, min(cap, base * 2^attempt)], never sooner than Retry-After
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = _retry_after(exc)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    async def _call(self, attempt: Callable[[], Awaitable[Any]], can_retry: Callable[[], bool] = lambda: True) -> Any:
+        self.stats["calls"] += 1
+        deadline = time.monotonic() + self.deadline_seconds
+        async with self._limiter():
+            self.in_flight += 1
+            try:
+                retries = 0
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["deadline_exceeded"] += 1
+                        raise LLMCallError(f"LLM call exceeded its {self.deadline_seconds:.0f}s deadline")
+                    try:
+                        return await asyncio.wait_for(attempt(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        self.stats["deadline_exceeded"] += 1
+                        raise LLMCallError(f"LLM call exceeded its {self.deadline_seconds:.0f}s deadline")
+                    except Exception as e:
+                        if retries >= self.max_retries or not is_retryable(e) or not can_retry():
+                            self.stats["failures"] += 1
+                            raise
+                        delay = self._backoff(retries, e)
+                        if time.monotonic() + delay >= deadline:
+                            self.stats["failures"] += 1
+                            raise
+                        logger.warning(f"LLM call failed ({e}); retry {retries + 1} in {delay:.2f}s")
+                        self.stats["retries"] += 1
+                        retries += 1
+                        await asyncio.sleep(delay)
+            finally:
+                self.in_flight -= 1
+
+    async def ainvoke(self, prompt: Any, config: Optional[Dict[str, Any]] = None) -> BaseMessage:
+        return await self._call(lambda: self.llm.ainvoke(prompt, config=config))
+
+    async def astream(
+        self,
+        prompt: Any,
+        config: Optional[Dict[str, Any]] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> BaseMessage:
+        """Like `ainvoke`, but streams the completion and passes each text delta to `on_text`.
+
+        Only failures before the first token are retried: once `on_text` has seen part of a
+        completion, a broken stream raises. If the provider refuses to stream this request,
+        calls fetch whole completions for `stream_retry_seconds` (`on_text` then receives the
+        full text at once) before streaming is tried again.
+        """
+        if not self.streaming_now():
+            message = await self.ainvoke(prompt, config)
+            if on_text is not None and message.content:
+                on_text(str(message.content))
+            return message
+
+        started = False
+
+        async def consume() -> BaseMessage:
+            nonlocal started
+            message = None
+            async for chunk in self.llm.astream(prompt, config=config):
+                started = True
+                message = chunk if message is None else message + chunk
+                if on_text is not None and chunk.content:
+                    on_text(str(chunk.content))
+            return message if message is not None else AIMessage(content="")
+
+        try:
+            return await self._call(consume, can_retry=lambda: not started)
+        except Exception as e:
+            if started or not is_streaming_unsupported(e):
+                raise
+            logger.warning(f"LLM provider refused to stream ({e}); requesting whole completions "
+                           f"for {self.stream_retry_seconds:.0f}s")
+            self.stats["stream_refused"] += 1
+            self._stream_paused_until = time.monotonic() + self.stream_retry_seconds
+            return await self.astream(prompt, config, on_text)
+
+    def streaming_now(self) -> bool:
+        return self.streaming and time.monotonic() >= self._stream_paused_until
+
+    def snapshot(self) -> Dict[str, Any]:
+        queued = self._semaphore.waiting() if self._semaphore else {}
+        return {**self.stats, "in_flight": self.in_flight, "queued": queued, "max_concurrency": self.max_concurrency,
+                "streaming": self.streaming_now()}
@@ -1,15 +1,25 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-import cv2
+import time
+APP_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from contextlib import ExitStack, asynccontextmanager
+import asyncio
 import numpy as np
 from PIL import Image
 from dotenv import load_dotenv
-import io
 import os
 import json
-import base64
-import time
 import traceback
-from typing import List, Dict, Any, Optional
+import zipfile
+import mimetypes
+import uuid
+from collections import deque
+from dataclasses import replace
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
 
 load_dotenv()
 
@@ -27,13 +37,109 @@ from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import PromptTemplate
 from langfuse.langchain import CallbackHandler
 import re
-from pdf2image import convert_from_bytes
+from preprocessing import PreprocessConfig, decode_image, pil_to_array, preprocess_image
+from layout import box_of, chunk_lines, encode_compact, estimate_tokens, group_lines, key_value_pairs, page_extent, reading_order_text
+from pdf_pages import iter_pdf_pages, page_dpi, pdf_info
+from cache import ResultCache, hash_bytes, hash_json
+from templates import TemplateRegistry
+from streaming_json import SectionStream
+from refinement import (LLM_CORRECTION_MAX_FIELDS, OCR_LOW_CONFIDENCE, apply_corrections, apply_readings, correction_prompt,
+                        crop_detection, low_confidence_indices, merge_unclear, settings_signature, structuring_reply,
+                        uncertain_fields)
+from jobs import JobQueue, JobRunner, check_callback_url, public_view
+from uploads import UPLOAD_MAX_BYTES, SpooledUpload, UploadRejected, check_image_pixels, check_page_count, spool
+from responses import COMPACT, DETAIL_LEVELS, FastJSONResponse, compact_result, dumps, ndjson_line
+from admission import BULK, INTERACTIVE, PRIORITIES, AdmissionController, AdmissionRejected, current_priority
+from metrics import (JSON_PARSE, LLM_FIRST_SECTION_SECONDS, LLM_TOKENS, OCR_ELEMENTS, OCR_REFINED, REGISTRY,
+                     REQUEST_SECONDS, REQUESTS_IN_FLIGHT, UPLOAD_BYTES, finish_trace, process_memory_bytes, span, start_trace)
+from ocr_pool import OCR_MICROBATCH_SIZE, OCR_TILE_MAX_SIDE, OCRWorkerPool, OCRPoolError, OCRPoolSaturated, OCRTimeoutError
+from llm_client import LLM_BACKEND, LLM_STREAMING, LocalStandInLLM, StructuringLLMClient, build_http_clients
+
+# Readiness state: /ready only reports healthy once every OCR worker has loaded and warmed its model
+startup_state: Dict[str, Any] = {"ready": False, "error": None, "phases": {}}
 
-app = FastAPI(title="Agentic Pro Handwritten Extraction")
+async def warm_up():
+    """Load and warm the OCR workers, timing each startup phase."""
+    phases = startup_state["phases"]
+    started = time.perf_counter()
+    try:
+        workers = await agent.ocr_pool.warmup()
+        phases["ocr_pool_warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        phases["ocr_workers"] = workers
+        phases["total_to_ready_ms"] = round((time.perf_counter() - APP_IMPORT_STARTED) * 1000, 1)
+        startup_state["ready"] = True
+        logger.info(f"OCR engine ready: {json.dumps(phases)}")
+    except Exception as e:
+        startup_state["error"] = str(e)
+        logger.error(f"OCR warmup failed: {e}")
+        traceback.print_exc()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_state["phases"]["app_import_ms"] = round((time.perf_counter() - APP_IMPORT_STARTED) * 1000, 1)
+    # Warm up in the background so /health answers while the models load
+    warmup_task = asyncio.create_task(warm_up())
+    # The queue opens its database here rather than at import, so importing main has no side effects
+    global job_runner
+    job_runner = JobRunner(JobQueue(), run_job)
+    await job_runner.start()
+    yield
+    await job_runner.stop()
+    warmup_task.cancel()
+    agent.ocr_pool.shutdown(wait=False)
+
+app = FastAPI(title="Agentic Pro Handwritten Extraction", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Global Config
 GROQ_MODEL = "llama-3.3-70b-versatile"
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# LLM_JSON_MODE=1 requests Groq's JSON mode (response_format json_object): the completion is
+# always one JSON object, so parse fallbacks only happen on truncated output. Groq cannot stream in
+# JSON mode, so it applies to the correction calls and, with LLM_STREAMING=0, to structuring;
+# streamed structuring relies on the prompt and the fence-tolerant parser instead.
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "1").lower() in ("1", "true", "yes")
+# Low-confidence fields go to a small, cheap model for correction instead of another full-document pass
+LLM_CORRECTION_ENABLED = os.getenv("LLM_CORRECTION_ENABLED", "1").lower() in ("1", "true", "yes")
+LLM_CORRECTION_MODEL = os.getenv("LLM_CORRECTION_MODEL", "llama-3.1-8b-instant")
+# LLM_CORRECTION_IN_PROMPT=1 marks low-confidence text and its alternative readings in the structuring
+# prompt, so the structuring model resolves them and lists what stays unclear in the same call. The
+# correction model then only checks fields it did not read (template values); 0 sends every page's
+# uncertain fields to the correction model in a second call.
+LLM_CORRECTION_IN_PROMPT = os.getenv("LLM_CORRECTION_IN_PROMPT", "1").lower() in ("1", "true", "yes")
+
+# Result cache config (CACHE_DIR enables the on-disk tier that survives restarts)
+OCR_CACHE_ENTRIES = int(os.getenv("OCR_CACHE_ENTRIES", "256"))
+LLM_CACHE_ENTRIES = int(os.getenv("LLM_CACHE_ENTRIES", "512"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "86400"))
+CACHE_DIR = os.getenv("CACHE_DIR") or None
+CACHE_DISK_MAX_MB = int(os.getenv("CACHE_DISK_MAX_MB", "512"))
+
+# OCR payloads above this estimated token count are structured in concurrent chunks, keeping
+# each call's JSON output well inside the model's max_tokens budget
+LLM_CHUNK_MAX_OCR_TOKENS = int(os.getenv("LLM_CHUNK_MAX_OCR_TOKENS", "1200"))
+
+# Learned form templates map known layouts without the LLM, or shrink its prompt to what they do not
+# cover (registry defaults to CACHE_DIR/templates.json). Learning new layouts is opt-in.
+TEMPLATES_ENABLED = os.getenv("TEMPLATES_ENABLED", "1").lower() in ("1", "true", "yes")
+TEMPLATE_LEARN = os.getenv("TEMPLATE_LEARN", "0").lower() in ("1", "true", "yes")
+TEMPLATE_REGISTRY_PATH = os.getenv("TEMPLATE_REGISTRY_PATH") or (os.path.join(CACHE_DIR, "templates.json") if CACHE_DIR else None)
+
+# detail=compact responses carry step timings only; the full results stay retrievable by reference
+# from /results/{id} for RESULTS_STORE_TTL_SECONDS. RESPONSE_DETAIL sets the default detail level.
+RESPONSE_DETAIL = os.getenv("RESPONSE_DETAIL", "full").lower()
+RESULTS_STORE_ENTRIES = int(os.getenv("RESULTS_STORE_ENTRIES", "256"))
+RESULTS_STORE_TTL_SECONDS = float(os.getenv("RESULTS_STORE_TTL_SECONDS", "3600"))
+
+# Multipart framing allowed on top of UPLOAD_MAX_BYTES when checking a request's Content-Length
+UPLOAD_MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Upper bounds on one /process/batch call: images (zip members included) and their total size
+# (inflated, for zip members). Images are read window by window, so memory does not grow with these.
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Pages of one PDF processed concurrently (OCR of page N+1 overlaps the LLM call for page N)
+PDF_PIPELINE_DEPTH = max(1, int(os.getenv("PDF_PIPELINE_DEPTH", "2")))
 
 # Initialize Langfuse Handler (reads from environment variables)
 try:
@@ -43,77 +149,241 @@ except Exception as e:
     logger.error(f"Failed to initialize Langfuse CallbackHandler: {e}")
     langfuse_handler = None
 
-llm = ChatGroq(
-    model=GROQ_MODEL,
-    groq_api_key=GROQ_API_KEY,
-    temperature=0.1,
-    max_tokens=4096
+if LLM_BACKEND == "local":
+    llm = LocalStandInLLM()
+    correction_llm = LocalStandInLLM()
+else:
+    # Retries are handled by StructuringLLMClient so they share its backoff and deadline
+    http_client, http_async_client = build_http_clients()
+    llm = ChatGroq(
+        model=GROQ_MODEL,
+        groq_api_key=GROQ_API_KEY,
+        temperature=0.1,
+        max_tokens=4096,
+        max_retries=0,
+        model_kwargs={"response_format": {"type": "json_object"}} if LLM_JSON_MODE and not LLM_STREAMING else {},
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+    correction_llm = ChatGroq(
+        model=LLM_CORRECTION_MODEL,
+        groq_api_key=GROQ_API_KEY,
+        temperature=0,
+        max_tokens=1024,
+        max_retries=0,
+        model_kwargs={"response_format": {"type": "json_object"}} if LLM_JSON_MODE else {},
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+
+ocr_cache = ResultCache(
+    "ocr",
+    max_entries=OCR_CACHE_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    disk_dir=CACHE_DIR,
+    disk_max_bytes=CACHE_DISK_MAX_MB * 1024 * 1024,
+)
+llm_cache = ResultCache(
+    "llm",
+    max_entries=LLM_CACHE_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    disk_dir=CACHE_DIR,
+    disk_max_bytes=CACHE_DISK_MAX_MB * 1024 * 1024,
 )
 
+# Serialized full results behind compact responses
+result_store = ResultCache("results", max_entries=RESULTS_STORE_ENTRIES, ttl_seconds=RESULTS_STORE_TTL_SECONDS)
+
+ocr_pool = OCRWorkerPool()
+template_registry = TemplateRegistry(TEMPLATE_REGISTRY_PATH)
+
+OCR_FAILED_CONTEXT = "OCR Extraction Failed"
+FALLBACK_DOCUMENT_TYPE = "Extraction Parsed as Text"
+# Low-confidence marks from the prompt (`{?alt1|alt2}`), should the model copy one into a value
+UNCERTAIN_MARK_RE = re.compile(r"\{\?[^{}]*\}")
+
 class ExtractionAgent:
     def __init__(self, callback_handler=None):
         self.handler = callback_handler
         self.llm = llm
+        self.llm_client = StructuringLLMClient(llm)
+        self.correction_llm = correction_llm
+        self.correction_client = StructuringLLMClient(correction_llm) if LLM_CORRECTION_ENABLED else None
+        self.ocr_cache = ocr_cache
+        self.llm_cache = llm_cache
+        self.ocr_pool = ocr_pool
+        self.templates = template_registry if TEMPLATES_ENABLED else None
+        self.preprocess_config = PreprocessConfig()
+        if ocr_pool.tile_size and 0 < self.preprocess_config.max_side < OCR_TILE_MAX_SIDE:
+            # Tiled OCR reads large scans at full resolution, so only downscale past OCR_TILE_MAX_SIDE
+            self.preprocess_config = replace(self.preprocess_config, max_side=OCR_TILE_MAX_SIDE)
+        # Decode straight to one channel when preprocessing would convert to grayscale anyway
+        self.decode_grayscale = self.preprocess_config.enabled and self.preprocess_config.grayscale
+
+    def decode(self, buffer: bytes) -> np.ndarray:
+        with span("decode"):
+            return decode_image(buffer, grayscale=self.decode_grayscale)
+
+    def ocr_signature(self) -> str:
+        """Everything besides the pixels that changes the OCR result: preprocessing, refinement, the
+        OCR profile and tiling."""
+        return f"{self.preprocess_config.signature()}:{settings_signature()}:{self.ocr_pool.signature()}"
 
-    async def _step_visual_extraction(self, base64_image: str) -> Dict[str, Any]:
+    def upload_cache_key(self, upload_sha256: str) -> str:
+        """OCR cache key for the exact uploaded bytes, so a repeated upload skips decoding too."""
+        return f"upload:{upload_sha256}:{self.decode_grayscale}:{self.ocr_signature()}"
+
+    async def _step_visual_extraction(self, image_np: np.ndarray, upload_key: Optional[str] = None) -> Dict[str, Any]:
         """Step 1: Real Local OCR Extraction using EasyOCR."""
         print("INFO: Starting Local OCR Extraction...")
+        cacheable = lambda result: result.get("visual_context") != OCR_FAILED_CONTEXT
         try:
-            import easyocr
-            import numpy as np
-            import base64
-            from PIL import Image
-            import io
-
-            # Decode image
-            image_data = base64.b64decode(base64_image)
-            image = Image.open(io.BytesIO(image_data))
-            image_np = np.array(image)
-
-            # Perform Detection using the pre-loaded reader
-            if not hasattr(self, 'reader'):
-                import easyocr
-                self.reader = easyocr.Reader(['en'], gpu=False, verbose=False)
-            
-            results = self.reader.readtext(image_np)
+            # Hashing a full-resolution page takes milliseconds; hashlib releases the GIL, so a thread keeps the loop free
+            key = await asyncio.to_thread(self._ocr_cache_key, image_np)
+            result = await self.ocr_cache.get_or_compute(
+                key,
+                lambda: self._run_ocr(image_np),
+                should_cache=cacheable,
+            )
+            if upload_key and cacheable(result):
+                await self.ocr_cache.aset(upload_key, result)
+            return result
+        except OCRPoolError:
+            raise
+        except Exception as e:
+            print(f"ERROR: Local OCR failed ({str(e)}). Falling back to simulation.")
+            traceback.print_exc()
+            return self._ocr_failure_result()
 
-            # Sort results top-to-bottom (primary) and left-to-right (secondary)
-            # usage of a tolerance could be better, but simple sort usually works for single column forms
-            results.sort(key=lambda r: (r[0][0][1], r[0][0][0]))
-            
-            # Format results into our expected structure
-            elements = []
-            full_text_context = []
-            
-            for (bbox, text, prob) in results:
-                elements.append({
-                    "label": "Detected Text",
-                    "text": text,
-                    "clarity": float(prob)
-                })
-                full_text_context.append(text)
-            
-            print(f"INFO: OCR found {len(elements)} elements.")
-            
-            return {
-                "elements": elements,
-                "visual_context": " \n".join(full_text_context),
-                "detected_language": "en"
-            }
+    async def _run_ocr(self, image_np: np.ndarray) -> Dict[str, Any]:
+        """Run EasyOCR on a decoded image and format the detections."""
+        try:
+            # Shrink the image first; OpenCV releases the GIL, so a thread keeps the loop free
+            with span("preprocess"):
+                image_np, preprocessing = await asyncio.to_thread(preprocess_image, image_np, self.preprocess_config)
+            # Detection runs on a pool worker holding a pre-loaded reader, off the event loop
+            with span("ocr", tiled=self.ocr_pool.needs_tiling(image_np)) as attributes:
+                results = await self.ocr_pool.readtext(image_np)
+                attributes["elements"] = len(results)
+            alternatives, refinement = await self._refine_detections(image_np, results)
+            return {**self._format_ocr_results(results, image_np.shape, alternatives), "preprocessing": preprocessing,
+                    "refinement": refinement}
+        except OCRPoolError:
+            raise
         except Exception as e:
             print(f"ERROR: Local OCR failed ({str(e)}). Falling back to simulation.")
             traceback.print_exc()
-            return {
-                "elements": [
-                    {"label": "Error", "text": "OCR Failed to read image", "clarity": 0.0}
-                ],
-                "visual_context": "OCR Extraction Failed",
-                "detected_language": "en"
-            }
+            return self._ocr_failure_result()
+
+    async def _refine_detections(self, image_np: np.ndarray, results: List[Any]) -> Tuple[Dict[int, List[str]], Dict[str, Any]]:
+        """Re-recognize low-confidence detections from their crops, keeping better readings in place.
+
+        Only the least confident detections are re-read, so the cost follows how unclear the
+        handwriting is rather than the page size. Returns the alternative readings per detection
+        and a report for the response.
+        """
+        indices = low_confidence_indices(results)
+        if not indices:
+            return {}, {"low_confidence": 0}
+        started = time.perf_counter()
+        with span("refine", crops=len(indices)):
+            try:
+                readings = await self.ocr_pool.rerecognize([crop_detection(image_np, results[i][0]) for i in indices])
+            except (OCRPoolSaturated, OCRTimeoutError) as e:
+                # A busy or slow pool costs the alternatives, not the page
+                print(f"WARNING: Re-recognition skipped ({type(e).__name__}: {e}); keeping the first readings.")
+                return {}, {"low_confidence": len(indices), "error": str(e)}
+            except OCRPoolError:
+                raise
+            except Exception as e:
+                print(f"WARNING: Re-recognition failed ({e}); keeping the first readings.")
+                return {}, {"low_confidence": len(indices), "error": str(e)}
+        alternatives, improved = apply_readings(results, indices, readings)
+        OCR_REFINED.inc("improved", amount=improved)
+        OCR_REFINED.inc("unchanged", amount=len(indices) - improved)
+        return alternatives, {
+            "low_confidence": len(indices),
+            "improved": improved,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def _format_ocr_results(self, results: List[Any], shape: Optional[Tuple[int, ...]] = None,
+                            alternatives: Optional[Dict[int, List[str]]] = None) -> Dict[str, Any]:
+        """Group detections into reading-order lines, keeping each element's box and line index."""
+        elements = [
+            {"label": "Detected Text", "text": text, "clarity": float(prob), "bbox": box_of(bbox)}
+            for (bbox, text, prob) in results
+        ]
+        for index, texts in (alternatives or {}).items():
+            elements[index]["alternatives"] = texts
+        lines = group_lines(elements)
+        ordered = []
+        for line_index, line in enumerate(lines):
+            for element in line:
+                element["line"] = line_index
+                ordered.append(element)
+        
+        print(f"INFO: OCR found {len(ordered)} elements in {len(lines)} lines.")
+        OCR_ELEMENTS.observe(len(ordered))
+        
+        return {
+            "elements": ordered,
+            "visual_context": reading_order_text(lines),
+            "key_value_pairs": key_value_pairs(lines),
+            "page_size": list(page_extent(ordered, shape)),
+            "detected_language": "en"
+        }
+
+    def _ocr_cache_key(self, image_np: np.ndarray) -> str:
+        # Key on the decoded pixels so re-encoded copies of the same scan share an entry
+        # and include the settings that change what OCR actually sees and returns
+        return hash_bytes(
+            f"{image_np.shape}:{image_np.dtype}:{self.ocr_signature()}".encode(),
+            image_np.data,
+        )
+
+    def _ocr_failure_result(self) -> Dict[str, Any]:
+        return {
+            "elements": [
+                {"label": "Error", "text": "OCR Failed to read image", "clarity": 0.0}
+            ],
+            "visual_context": OCR_FAILED_CONTEXT,
+            "detected_language": "en"
+        }
+
+    def _prompt_payloads(self, raw_data: Dict[str, Any]) -> List[str]:
+        """Compact layout encoding of the OCR result, split into chunks that fit LLM_CHUNK_MAX_OCR_TOKENS.
+
+        Falls back to a single plain-text payload when there are no boxes (OCR failure).
+        """
+        elements = raw_data.get("elements", [])
+        if not elements or any("bbox" not in e for e in elements):
+            return [raw_data.get("visual_context", "")]
+        lines: Dict[int, List[Dict[str, Any]]] = {}
+        for element in elements:
+            lines.setdefault(element["line"], []).append(element)
+        width, height = raw_data.get("page_size") or page_extent(elements)
+        ordered = [lines[i] for i in sorted(lines)]
+        uncertain_below = OCR_LOW_CONFIDENCE if LLM_CORRECTION_IN_PROMPT else 0.0
+        return [
+            encode_compact(chunk, width, height, uncertain_below=uncertain_below)
+            for chunk in chunk_lines(ordered, width, height, LLM_CHUNK_MAX_OCR_TOKENS, uncertain_below=uncertain_below)
+        ]
 
-    async def _step_cleaning_normalization(self, raw_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Step 2: Forensic OCR Extraction."""
-        prompt_text = f"""
+    def _build_prompt(self, ocr_payload: str, part: int = 1, parts: int = 1, known: str = "") -> str:
+        scope = "" if parts == 1 else f"""
+        NOTE: This is part {part} of {parts} of one document. Extract only what appears in this part;
+        use the same section names you would use for the whole document.
+        """
+        scope += known
+        review = "" if not LLM_CORRECTION_IN_PROMPT else """
+        Text followed by {?...} was read with low confidence; the readings after "?" (separated by "|")
+        are other readings of the same handwriting. Choose the reading that fits the field (e.g. digits
+        in a phone number, a common name) and never copy the {?...} marks into values. List each field
+        whose value you are still unsure of as "Section / Field" in "unclear_fields".
+        """
+        unclear_shape = ', "unclear_fields": []' if LLM_CORRECTION_IN_PROMPT else ""
+        return f"""
         [INST]
         You are an expert OCR system specialized in reading handwritten text with maximum accuracy.
         
@@ -136,60 +406,279 @@ class ExtractionAgent:
         10. Double-check your extraction before returning the JSON
         
         IMPORTANT: Read slowly and carefully. Accuracy is more important than speed.
-        Return ONLY valid JSON with no additional text, markdown, or explanation before or after.
-        The JSON should have descriptive keys based on the actual content structure.
-        
-        RAW OCR DATA (spatial text coordinates):
-        {json.dumps(raw_data)}
+        Return ONLY valid JSON with no additional text, markdown, or explanation before or after,
+        in exactly this shape:
+        {{"document_type": "...", "summary": "...",
+          "sections": [{{"section_name": "...", "fields": [{{"field_name": "...", "field_value": "..."}}]}}],
+          "key_entities": {{"name": "value"}}, "signatures_detected": false{unclear_shape}}}
+        Name sections and fields after the labels, headings and form structure you see.
+        {review}{scope}
+        RAW OCR DATA (one row per text line in reading order, formatted `y|x:text x:text`;
+        x and y are positions from 0 to 99 across the page; a cell ending in ":" labels the cell after it):
+        {ocr_payload}
         [/INST]
         """
-        
+
+    def _step_template_extraction(self, raw_data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Map fields from a matching learned template.
+
+        Returns (extraction, info): see TemplateRegistry.extract; `extraction["skip_llm"]` tells
+        whether the template covers the whole page. (None, info) when the values were unclear.
+        """
+        if self.templates is None or raw_data.get("visual_context") == OCR_FAILED_CONTEXT:
+            return None, None
+        match = self.templates.match(raw_data)
+        if match is None:
+            return None, None
+        info = {"id": match["template"]["id"], "score": match["score"]}
+        extraction = self.templates.extract(raw_data, match)
+        if extraction is None:
+            print(f"INFO: Template {info['id']} matched but values were unclear; using the LLM.")
+            return None, {**info, "used": False}
+        info.update(score=extraction["score"], coverage=extraction["coverage"],
+                    used="full" if extraction["skip_llm"] else "prefill")
+        return extraction, info
+
+    def _learn_template(self, raw_data: Dict[str, Any], structured: Dict[str, Any], llm_ms: float, known_layout: bool = False):
+        if self.templates is None:
+            return
+        self.templates.record_llm_latency(llm_ms)
+        # A matched-but-unclear page already has a template; learning it again would only add a duplicate
+        if not TEMPLATE_LEARN or known_layout or structured.get("document_type") == FALLBACK_DOCUMENT_TYPE:
+            return
+        template_id = self.templates.learn(raw_data, structured)
+        if template_id:
+            print(f"INFO: Learned form template {template_id}.")
+            try:
+                self.templates.save()
+            except OSError as e:
+                print(f"WARNING: Could not save template registry: {e}")
+
+    async def _step_cleaning_normalization(self, raw_data: Dict[str, Any],
+                                           prefilled: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Step 2: Forensic OCR Extraction. Returns the structured JSON and call statistics.
+
+        Oversized OCR dumps are split into layout-coherent chunks that are structured
+        concurrently and merged, so no single call overflows the output token budget.
+        `prefilled` fields (from a form template) are named in the prompt so the model neither
+        repeats them nor invents other names for their sections.
+        """
+        payloads = self._prompt_payloads(raw_data)
+        known = self._prefilled_note(prefilled) if prefilled else ""
+        prompts = [self._build_prompt(payload, i + 1, len(payloads), known) for i, payload in enumerate(payloads)]
+        chunk_results = await asyncio.gather(*[self._structure_prompt(prompt) for prompt in prompts])
+
+        usage = {"prompt_tokens_estimate": sum(estimate_tokens(prompt) for prompt in prompts)}
+        for _, chunk_usage, _ in chunk_results:
+            for key in ("input_tokens", "output_tokens"):
+                if key in chunk_usage:
+                    usage[key] = usage.get(key, 0) + chunk_usage[key]
+
+        if len(chunk_results) == 1:
+            return chunk_results[0][0], usage
+        merged, conflicts = self._merge_chunk_results([data for data, _, _ in chunk_results])
+        usage["chunks"] = {
+            "count": len(chunk_results),
+            "latency_ms": [latency for _, _, latency in chunk_results],
+            "merge_conflicts": conflicts,
+        }
+        return merged, usage
+
+    async def _structure_prompt(self, prompt_text: str) -> Tuple[Dict[str, Any], Dict[str, Any], int]:
+        """One structuring call (through the cache); returns data, token usage and latency."""
+        start_t = time.time()
         try:
-            # Use the handler if available
-            callbacks = [self.handler] if self.handler else []
-            response = self.llm.invoke(prompt_text, config={"callbacks": callbacks})
-            # Extract content from LangChain message
-            if hasattr(response, 'content'):
-                response_text = response.content
-            else:
-                response_text = str(response)
-            
-            return self._extract_json_from_text(response_text)
+            cache_key = hash_json({
+                "prompt": prompt_text,
+                "backend": type(self.llm).__name__,
+                "model": getattr(self.llm, "model_name", GROQ_MODEL),
+                "temperature": getattr(self.llm, "temperature", None),
+                "max_tokens": getattr(self.llm, "max_tokens", None),
+                "model_kwargs": getattr(self.llm, "model_kwargs", None),
+            })
+            result = await self.llm_cache.get_or_compute(
+                cache_key,
+                lambda: self._invoke_structuring(prompt_text),
+                should_cache=lambda result: result["data"].get("document_type") != FALLBACK_DOCUMENT_TYPE,
+            )
+            return result["data"], result["usage"], int((time.time() - start_t) * 1000)
         except Exception as e:
             print(f"Extraction Step Error: {e}")
             traceback.print_exc()
-            return self._create_fallback_data(str(e))
+            return self._create_fallback_data(str(e)), {}, int((time.time() - start_t) * 1000)
+
+    def _prefilled_note(self, prefilled: Dict[str, Any]) -> str:
+        names = "; ".join(
+            f"{section['section_name']} / {field['field_name']}"
+            for section in prefilled.get("sections", []) for field in section.get("fields", [])
+        )
+        return f"""
+        NOTE: This is a known {prefilled.get('document_type', 'form')} layout. These fields were already
+        read and their text is left out of the OCR data below: {names}.
+        Extract everything else; reuse those section names where the rest belongs to them.
+        """
+
+    def _merge_prefilled(self, prefilled: Dict[str, Any], structured: Dict[str, Any]) -> Dict[str, Any]:
+        """Template fields plus what the LLM read from the rest of the page (template values win)."""
+        merged, _ = self._merge_chunk_results([prefilled, structured])
+        merged["summary"] = structured.get("summary") or prefilled.get("summary", "")
+        return merged
+
+    def _merge_chunk_results(self, chunk_data: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Deterministically merge per-chunk outputs in document order.
+
+        Sections with the same name (case-insensitive) are combined. When chunks disagree on a
+        field or key entity, the earliest chunk wins and the disagreement is reported.
+        """
+        sections: Dict[str, Dict[str, Any]] = {}
+        key_entities: Dict[str, Any] = {}
+        conflicts: List[Dict[str, Any]] = []
+        for chunk_index, data in enumerate(chunk_data, start=1):
+            self._ensure_sections(data)
+            for section in data.get("sections", []):
+                name = str(section.get("section_name", "General Information"))
+                merged_section = sections.setdefault(name.strip().lower(), {"section_name": name, "fields": []})
+                existing = {str(f.get("field_name")).strip().lower(): f for f in merged_section["fields"]}
+                for field in section.get("fields", []):
+                    previous = existing.get(str(field.get("field_name")).strip().lower())
+                    if previous is None:
+                        merged_section["fields"].append(field)
+                        existing[str(field.get("field_name")).strip().lower()] = field
+                    elif previous.get("field_value") != field.get("field_value"):
+                        conflicts.append({
+                            "section": name,
+                            "field": field.get("field_name"),
+                            "kept": previous.get("field_value"),
+                            "dropped": field.get("field_value"),
+                            "chunk": chunk_index,
+                        })
+            for key, value in (data.get("key_entities") or {}).items():
+                if key not in key_entities:
+                    key_entities[key] = value
+                elif key_entities[key] != value:
+                    conflicts.append({"key_entity": key, "kept": key_entities[key], "dropped": value, "chunk": chunk_index})
+
+        merged = {
+            "document_type": next((d["document_type"] for d in chunk_data
+                                   if d.get("document_type") and d["document_type"] != FALLBACK_DOCUMENT_TYPE),
+                                  chunk_data[0].get("document_type")),
+            "summary": " ".join(str(d.get("summary", "")) for d in chunk_data if d.get("summary")).strip(),
+            "sections": list(sections.values()),
+            "key_entities": key_entities,
+            "signatures_detected": any(bool(d.get("signatures_detected")) for d in chunk_data),
+        }
+        if all(isinstance(d.get("unclear_fields"), list) for d in chunk_data):
+            # A field split across chunks may be listed by each of them
+            merged["unclear_fields"] = list(dict.fromkeys(name for d in chunk_data for name in d["unclear_fields"]))
+        return merged, conflicts
+
+    async def _invoke_structuring(self, prompt_text: str) -> Dict[str, Any]:
+        """Stream one structuring call, timing when its first section closes in the output.
+
+        Sections are only counted as they stream in; the complete reply is parsed once and cleaned
+        in step 3.
+        """
+        # Use the handler if available
+        callbacks = [self.handler] if self.handler else []
+        stream = SectionStream()
+        started = time.perf_counter()
+
+        def on_text(delta: str) -> None:
+            seen = stream.count
+            if stream.feed(delta) and not seen:
+                LLM_FIRST_SECTION_SECONDS.observe(time.perf_counter() - started)
+
+        with span("llm") as attributes:
+            response = await self.llm_client.astream(prompt_text, config={"callbacks": callbacks}, on_text=on_text)
+            attributes["streamed_sections"] = stream.count
+        # Extract content from LangChain message
+        if hasattr(response, 'content'):
+            response_text = response.content
+        else:
+            response_text = str(response)
+        
+        # Provider-reported token counts, when the model returns them
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        usage = {key: usage_metadata[key] for key in ("input_tokens", "output_tokens") if key in usage_metadata}
+        LLM_TOKENS.inc("prompt", amount=usage.get("input_tokens", 0))
+        LLM_TOKENS.inc("completion", amount=usage.get("output_tokens", 0))
+        with span("json_parse"):
+            data = self._extract_json_from_text(response_text)
+        return {"data": data, "usage": usage}
+
+    async def _step_field_correction(self, structured: Dict[str, Any], raw_data: Dict[str, Any],
+                                     reviewed: bool = False) -> Dict[str, Any]:
+        """Step 4: Re-check only the fields that rest on low-confidence OCR, with the small model.
+
+        When the structuring model already `reviewed` the marked low-confidence text (see
+        LLM_CORRECTION_IN_PROMPT), its own `unclear_fields` decide instead and no call is made.
+        Sets `unclear_fields` (names of fields that stay uncertain, including any the model listed
+        itself) and `unclear_details` on the structured data, and returns a report for the workflow log.
+        """
+        self._ensure_sections(structured)
+        candidates = uncertain_fields(structured, raw_data.get("elements", []))
+        model_unclear = structured.get("unclear_fields")
+        model_unclear = model_unclear if isinstance(model_unclear, list) else []
+        reviewed = reviewed and isinstance(structured.get("unclear_fields"), list)
+        if reviewed:
+            sent, reply, usage = [], structuring_reply(candidates, model_unclear), {}
+        else:
+            # Fields no detection supports (marked unreadable by the model) have nothing to correct from
+            sent = [c for c in candidates if c["lines"]][:LLM_CORRECTION_MAX_FIELDS] if self.correction_client else []
+            reply, usage = (await self._correct_fields(sent)) if sent else (None, {})
+        unclear, structured["unclear_details"] = apply_corrections(candidates, reply)
+        structured["unclear_fields"] = merge_unclear(unclear, model_unclear)
+        return {
+            "uncertain": len(candidates),
+            "reviewed_in_structuring": reviewed,
+            "sent": len(sent),
+            "corrected": sum(1 for detail in structured["unclear_details"] if "corrected_from" in detail),
+            "unclear": len(structured["unclear_fields"]),
+            "tokens": usage,
+        }
+
+    async def _correct_fields(self, candidates: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """One correction call (through the LLM cache); returns the parsed reply and token usage."""
+        prompt_text = correction_prompt(candidates)
+        cache_key = hash_json({
+            "prompt": prompt_text,
+            "backend": type(self.correction_llm).__name__,
+            "model": getattr(self.correction_llm, "model_name", LLM_CORRECTION_MODEL),
+        })
+        try:
+            with span("correction_llm", fields=len(candidates)):
+                result = await self.llm_cache.get_or_compute(
+                    cache_key,
+                    lambda: self._invoke_correction(prompt_text),
+                    should_cache=lambda result: result["data"] is not None,
+                )
+            return result["data"], result["usage"]
+        except Exception as e:
+            print(f"WARNING: Field correction failed ({e}); reporting the fields as unclear.")
+            return None, {}
+
+    async def _invoke_correction(self, prompt_text: str) -> Dict[str, Any]:
+        callbacks = [self.handler] if self.handler else []
+        response = await self.correction_client.ainvoke(prompt_text, config={"callbacks": callbacks})
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        usage = {key: usage_metadata[key] for key in ("input_tokens", "output_tokens") if key in usage_metadata}
+        LLM_TOKENS.inc("correction_prompt", amount=usage.get("input_tokens", 0))
+        LLM_TOKENS.inc("correction_completion", amount=usage.get("output_tokens", 0))
+        text = str(getattr(response, "content", response))
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else None
+        except ValueError:
+            data = None
+        return {"data": data, "usage": usage}
 
     async def _step_validation_cleaning(self, extracted_json: Dict[str, Any]) -> Dict[str, Any]:
         """Step 3: Data Table Formatting."""
         # Convert the extracted data into the exact format needed for the Data Table
         try:
             # Ensure we have the required structure
-            if "sections" not in extracted_json:
-                # Try to auto-convert flat structure to sections
-                sections = []
-                for key, value in extracted_json.items():
-                    if key not in ["document_type", "summary", "signatures_detected", "key_entities"]:
-                        if isinstance(value, dict):
-                            # This is a section
-                            fields = []
-                            for field_key, field_val in value.items():
-                                fields.append({
-                                    "field_name": field_key,
-                                    "field_value": str(field_val)
-                                })
-                            sections.append({
-                                "section_name": key,
-                                "fields": fields
-                            })
-                        else:
-                            # This is a standalone field
-                            sections.append({
-                                "section_name": "General Information",
-                                "fields": [{"field_name": key, "field_value": str(value)}]
-                            })
-                
-                extracted_json["sections"] = sections
+            self._ensure_sections(extracted_json)
+            extracted_json["sections"] = [self._clean_section(section) for section in extracted_json["sections"]]
             
             # Ensure required keys exist
             if "document_type" not in extracted_json:
@@ -202,12 +691,66 @@ class ExtractionAgent:
                 extracted_json["key_entities"] = {}
             if "confidence_score" not in extracted_json:
                 extracted_json["confidence_score"] = 0.85
+            if "unclear_fields" not in extracted_json:
+                extracted_json["unclear_fields"] = []
                 
             return extracted_json
         except Exception as e:
             print(f"Validation Error: {e}")
             return extracted_json
 
+    def _clean_section(self, section: Any) -> Dict[str, Any]:
+        """Normalize one section: a name, and `fields` as a list of field_name/field_value dicts."""
+        if not isinstance(section, dict):
+            return {"section_name": "General Information", "fields": [{"field_name": "value", "field_value": str(section)}]}
+        name = section.get("section_name")
+        section["section_name"] = str(name).strip() if name not in (None, "") else "General Information"
+        fields = section.get("fields")
+        if isinstance(fields, dict):
+            # {"label": "value"} instead of a list of fields
+            fields = [{"field_name": key, "field_value": value} for key, value in fields.items()]
+        elif not isinstance(fields, list):
+            fields = []
+        for field in fields:
+            if not isinstance(field, dict):
+                continue
+            value = field.get("field_value")
+            if value is None:
+                field["field_value"] = "unreadable"
+            elif isinstance(value, str):
+                field["field_value"] = UNCERTAIN_MARK_RE.sub("", value).strip()
+        section["fields"] = [field for field in fields if isinstance(field, dict)]
+        return section
+
+    def _ensure_sections(self, extracted_json: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a flat or nested model output into the `sections` structure, in place."""
+        if "sections" not in extracted_json:
+            # Try to auto-convert flat structure to sections
+            sections = []
+            for key, value in extracted_json.items():
+                if key not in ["document_type", "summary", "signatures_detected", "key_entities", "unclear_fields"]:
+                    if isinstance(value, dict):
+                        # This is a section
+                        fields = []
+                        for field_key, field_val in value.items():
+                            fields.append({
+                                "field_name": field_key,
+                                "field_value": str(field_val)
+                            })
+                        sections.append({
+                            "section_name": key,
+                            "fields": fields
+                        })
+                    else:
+                        # This is a standalone field
+                        sections.append({
+                            "section_name": "General Information",
+                            "fields": [{"field_name": key, "field_value": str(value)}]
+                        })
+            
+            extracted_json["sections"] = sections
+        return extracted_json
+
     def _extract_json_from_text(self, text: str) -> Dict[str, Any]:
         """Aggressive JSON extraction from potential chatty output."""
         try:
@@ -215,7 +758,9 @@ class ExtractionAgent:
             
             # 1. Try direct parse
             try:
-                return json.loads(text)
+                parsed = json.loads(text)
+                JSON_PARSE.inc("direct")
+                return parsed
             except:
                 pass
             
@@ -223,23 +768,28 @@ class ExtractionAgent:
             match = re.search(r'(\{.*\})', text, re.DOTALL)
             if match:
                 json_str = match.group(1)
-                return json.loads(json_str)
+                parsed = json.loads(json_str)
+                JSON_PARSE.inc("brace_block")
+                return parsed
                 
             # 3. Try to find markdown code blocks
             match = re.search(r'```json\s*(\{.*?\})\s*```', text, re.DOTALL)
             if match:
-                return json.loads(match.group(1))
+                parsed = json.loads(match.group(1))
+                JSON_PARSE.inc("code_block")
+                return parsed
 
             raise ValueError("No JSON found in response")
             
         except Exception as e:
             print(f"JSON Extraction Failed: {e}")
+            JSON_PARSE.inc("fallback")
             return self._create_fallback_data(text)
 
     def _create_fallback_data(self, raw_text: str) -> Dict[str, Any]:
         """Create a valid structure even from failure."""
         return {
-            "document_type": "Extraction Parsed as Text",
+            "document_type": FALLBACK_DOCUMENT_TYPE,
             "summary": "The model return could not be parsed as strict JSON, but here is the content.",
             "sections": [
                 {
@@ -253,65 +803,74 @@ class ExtractionAgent:
             "signatures_detected": False
         }
 
-    def _parse_json(self, content: str) -> Dict[str, Any]:
-        try:
-            # Clean up the response
-            content = content.strip()
-            
-            # Remove Markdown indicators
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            # Find the actual JSON block using braces if needed
-            start_idx = content.find("{")
-            end_idx = content.rfind("}")
-            if start_idx != -1 and end_idx != -1:
-                content = content[start_idx:end_idx+1]
-                
-            return json.loads(content)
-        except Exception as e:
-            print(f"Failed to parse JSON: {content[:100]}... Error: {str(e)}")
-            # Robust Fallback for frontend
-            return {
-                "document_type": "Extraction Result",
-                "summary": "Data extracted but required structure correction. Data is preserved.",
-                "sections": [
-                    {
-                        "section_name": "Auto-Recovered Data",
-                        "fields": [
-                            {"field_name": "Status", "field_value": "Success with Formatting Fallback", "confidence": "high"},
-                            {"field_name": "Raw Signal Content", "field_value": content[:2000], "confidence": "low"}
-                        ]
-                    }
-                ],
-                "key_entities": {},
-                "signatures_detected": False,
-                "confidence_score": 0.5
-            }
+    async def process(self, image: Optional[np.ndarray], filename: str, raw_results: Optional[Dict[str, Any]] = None,
+                      upload_key: Optional[str] = None) -> Dict[str, Any]:
+        """Run the full pipeline on a decoded image.
 
-    async def process(self, image_bytes: bytes, filename: str) -> Dict[str, Any]:
+        The array is passed by reference through the steps; `raw_results` skips visual extraction
+        when OCR already ran (batch path, or a cached upload), in which case `image` may be None.
+        `upload_key` additionally caches the OCR result under the upload's byte hash.
+        """
         start_t = time.time()
         workflow_log = []
+        step_started = time.perf_counter()
+
+        def step_ms() -> float:
+            # Wall time since the previous step finished, so steps add up to the request latency
+            nonlocal step_started
+            now = time.perf_counter()
+            elapsed, step_started = round((now - step_started) * 1000, 2), now
+            return elapsed
         
         try:
             # 1. Validation & Prep
-            img = Image.open(io.BytesIO(image_bytes))
-            workflow_log.append({"step": "1. Validation", "status": "COMPLETED"})
+            if raw_results is None and (image is None or image.size == 0):
+                raise ValueError("Empty or undecodable image")
+            workflow_log.append({"step": "1. Validation", "status": "COMPLETED", "duration_ms": step_ms()})
             
             # 2. Visual Extraction
-            base64_img = base64.b64encode(image_bytes).decode('utf-8')
-            raw_results = await self._step_visual_extraction(base64_img)
-            workflow_log.append({"step": "2. Visual Extraction", "status": "COMPLETED", "data": raw_results})
+            if raw_results is None:
+                raw_results = await self._step_visual_extraction(image, upload_key)
+            # The preprocessing and refinement reports are for the response, not for the LLM prompt
+            preprocessing = raw_results.pop("preprocessing", None)
+            refinement = raw_results.pop("refinement", None)
+            workflow_log.append({"step": "2. Visual Extraction", "status": "COMPLETED", "data": raw_results, "preprocessing": preprocessing,
+                                 "refinement": refinement, "duration_ms": step_ms()})
             
-            # 3. Structural Extraction
-            structural_json = await self._step_cleaning_normalization(raw_results)
-            workflow_log.append({"step": "3. Extraction", "status": "COMPLETED", "data": structural_json})
+            # 3. Structural Extraction (a known form layout is mapped from its template; the LLM
+            # only reads what the template does not account for, or is skipped when that is nothing)
+            with span("template_match"):
+                extraction, template_info = self._step_template_extraction(raw_results)
+            if extraction is not None and extraction["skip_llm"]:
+                structural_json = extraction["data"]
+                workflow_log.append({"step": "3. Extraction", "status": "COMPLETED", "data": structural_json, "template": template_info, "duration_ms": step_ms()})
+            else:
+                llm_started = time.time()
+                if extraction is None:
+                    structural_json, token_usage = await self._step_cleaning_normalization(raw_results)
+                else:
+                    structural_json, token_usage = await self._step_cleaning_normalization(
+                        {**raw_results, "elements": extraction["remaining"]}, prefilled=extraction["data"])
+                    structural_json = self._merge_prefilled(extraction["data"], structural_json)
+                self._learn_template(raw_results, structural_json, (time.time() - llm_started) * 1000, known_layout=bool(template_info))
+                extraction_step = {"step": "3. Extraction", "status": "COMPLETED", "data": structural_json, "tokens": token_usage}
+                if "chunks" in token_usage:
+                    extraction_step["chunks"] = token_usage.pop("chunks")
+                if template_info:
+                    extraction_step["template"] = template_info
+                extraction_step["duration_ms"] = step_ms()
+                workflow_log.append(extraction_step)
             
-            # 4. Expert Validation & Cleaning
-            final_data = await self._step_validation_cleaning(structural_json)
-            workflow_log.append({"step": "4. Validation & Cleaning", "status": "COMPLETED", "data": final_data})
+            # 4. Field Correction (only fields resting on low-confidence OCR; on the small model unless
+            # the structuring model read the whole page with those fields marked)
+            reviewed = LLM_CORRECTION_IN_PROMPT and extraction is None
+            correction = await self._step_field_correction(structural_json, raw_results, reviewed=reviewed)
+            workflow_log.append({"step": "4. Field Correction", "status": "COMPLETED", **correction, "duration_ms": step_ms()})
+
+            # 5. Expert Validation & Cleaning
+            with span("validation"):
+                final_data = await self._step_validation_cleaning(structural_json)
+            workflow_log.append({"step": "5. Validation & Cleaning", "status": "COMPLETED", "data": final_data, "duration_ms": step_ms()})
             
             latency = int((time.time() - start_t) * 1000)
             
@@ -325,6 +884,8 @@ class ExtractionAgent:
                 "steps": workflow_log,
                 "latency_ms": latency
             }
+        except OCRPoolError:
+            raise
         except Exception as e:
             traceback.print_exc()
             return {
@@ -333,40 +894,688 @@ class ExtractionAgent:
                 "steps": workflow_log
             }
 
+    async def _ocr_batch(self, images: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """Visual extraction for many images: cache hits are reused, misses share micro-batched OCR."""
+        keys = await asyncio.gather(*[asyncio.to_thread(self._ocr_cache_key, image_np) for image_np in images])
+        raw_results: List[Optional[Dict[str, Any]]] = list(await asyncio.gather(*[self.ocr_cache.aget(key) for key in keys]))
+        misses = [i for i, cached in enumerate(raw_results) if cached is None]
+        if misses:
+            try:
+                with span("preprocess", images=len(misses)):
+                    prepared = await asyncio.gather(*[
+                        asyncio.to_thread(preprocess_image, images[i], self.preprocess_config) for i in misses
+                    ])
+                with span("ocr_batch", images=len(misses)):
+                    detections = await self.ocr_pool.readtext_batch([image_np for image_np, _ in prepared])
+            except OCRPoolError:
+                raise
+            except Exception as e:
+                print(f"ERROR: Batched OCR failed ({str(e)}).")
+                traceback.print_exc()
+                detections = None
+            for position, index in enumerate(misses):
+                if detections is None:
+                    raw_results[index] = self._ocr_failure_result()
+                    continue
+                image_np = prepared[position][0]
+                alternatives, refinement = await self._refine_detections(image_np, detections[position])
+                raw_results[index] = {
+                    **self._format_ocr_results(detections[position], image_np.shape, alternatives),
+                    "preprocessing": prepared[position][1],
+                    "refinement": refinement,
+                }
+                await self.ocr_cache.aset(keys[index], raw_results[index])
+        return raw_results
+
+    async def process_batch(self, items: List[Tuple[str, Callable[[], Any]]]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Process many images, yielding `(index, result)` as each finishes.
+
+        Each item is a filename and a function returning its encoded bytes, called only when
+        the item's window comes up. Images are read, decoded and OCR'd one window at a time to
+        bound memory; the LLM steps of a window run concurrently (limited by the LLM client)
+        while the next window is in OCR.
+        """
+        # At least two images per worker, so each worker has its next image queued within a window
+        window_size = max(2, OCR_MICROBATCH_SIZE) * max(1, self.ocr_pool.workers)
+        pending = set()
+        try:
+            for window_start in range(0, len(items), window_size):
+                window = list(enumerate(items[window_start:window_start + window_size], start=window_start))
+                loaded = await asyncio.gather(*[asyncio.to_thread(self._load_batch_item, load) for _, (_, load) in window],
+                                              return_exceptions=True)
+                decoded = []
+                for (index, (filename, _)), image_np in zip(window, loaded):
+                    if isinstance(image_np, BaseException):
+                        yield index, {"status": "error", "filename": filename, "error": f"Invalid image: {image_np}", "steps": []}
+                    else:
+                        decoded.append((index, filename, image_np))
+                del loaded
+
+                raw_results = await self._ocr_batch([image_np for _, _, image_np in decoded])
+                for (index, filename, _), raw in zip(decoded, raw_results):
+                    pending.add(asyncio.ensure_future(self._process_indexed(index, filename, raw)))
+                # Pixels are no longer needed once OCR is done; only the detections move on
+                del decoded
+
+                # Hand back whatever already finished before starting the next window
+                finished = {task for task in pending if task.done()}
+                pending -= finished
+                for task in finished:
+                    yield task.result()
+
+            for next_done in asyncio.as_completed(pending):
+                yield await next_done
+        finally:
+            # Also reached when OCR of a later window fails or the consumer goes away
+            for task in pending:
+                task.cancel()
+
+    def _load_batch_item(self, load: Callable[[], Any]) -> np.ndarray:
+        contents = load()
+        check_image_pixels(contents)
+        return self.decode(contents)
+
+    async def _process_indexed(self, index: int, filename: str, raw_results: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        return index, await self.process(None, filename, raw_results=raw_results)
+
+    async def process_pages(self, pages: AsyncIterator[Tuple[int, Image.Image]], filename: str) -> AsyncIterator[Dict[str, Any]]:
+        """Run document pages through the pipeline, yielding per-page results in page order."""
+        in_flight = deque()
+        try:
+            async for page_number, page_image in pages:
+                page_np = await asyncio.to_thread(pil_to_array, page_image, self.decode_grayscale)
+                del page_image
+                task = asyncio.ensure_future(self.process(page_np, f"{filename}#page={page_number}"))
+                in_flight.append((page_number, task))
+                if len(in_flight) >= PDF_PIPELINE_DEPTH:
+                    done_page, done_task = in_flight.popleft()
+                    yield {"page": done_page, **await done_task}
+            while in_flight:
+                done_page, done_task = in_flight.popleft()
+                yield {"page": done_page, **await done_task}
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+
+    def merge_page_results(self, page_results: List[Dict[str, Any]], filename: str, latency_ms: int) -> Dict[str, Any]:
+        """Combine per-page results into one document, keeping the single-image response shape."""
+        succeeded = [r for r in page_results if r["status"] == "success"]
+        if not succeeded:
+            errors = "; ".join(f"page {r['page']}: {r.get('error')}" for r in page_results)
+            return {"status": "error", "error": f"No page could be processed ({errors})", "steps": []}
+
+        multi_page = len(page_results) > 1
+        sections = []
+        key_entities: Dict[str, Any] = {}
+        unclear_fields: List[str] = []
+        unclear_details: List[Dict[str, Any]] = []
+        for result in succeeded:
+            data = result["data"]
+            prefix = f"Page {result['page']} - " if multi_page else ""
+            for section in data.get("sections", []):
+                if multi_page:
+                    section = {**section, "section_name": f"{prefix}{section.get('section_name', '')}"}
+                sections.append(section)
+            unclear_fields.extend(prefix + name for name in result.get("unclear_fields", []))
+            unclear_details.extend({**detail, "field": prefix + detail["field"]} for detail in data.get("unclear_details", []))
+            for key, value in (data.get("key_entities") or {}).items():
+                key_entities.setdefault(key, value)
+
+        first = succeeded[0]["data"]
+        confidence = sum(r["confidence_score"] for r in succeeded) / len(succeeded)
+        merged = {
+            "document_type": first.get("document_type", "Handwritten Form"),
+            "summary": " ".join(r["data"].get("summary", "") for r in succeeded).strip(),
+            "sections": sections,
+            "key_entities": key_entities,
+            "signatures_detected": any(r["data"].get("signatures_detected") for r in succeeded),
+            "confidence_score": round(confidence, 4),
+            "unclear_fields": unclear_fields,
+            "unclear_details": unclear_details,
+        }
+        return {
+            "status": "success",
+            "filename": filename,
+            "data": merged,
+            "unclear_fields": unclear_fields,
+            "confidence_score": merged["confidence_score"],
+            "raw_text": "\n\n".join(
+                f"--- Page {r['page']} ---\n{r.get('raw_text', '')}" if multi_page else r.get("raw_text", "")
+                for r in succeeded
+            ),
+            "steps": [
+                {"step": f"Page {r['page']}", "status": "COMPLETED" if r["status"] == "success" else "FAILED",
+                 "latency_ms": r.get("latency_ms")}
+                for r in page_results
+            ],
+            "latency_ms": latency_ms,
+            "page_count": len(page_results),
+            "pages": page_results,
+        }
+
 agent = ExtractionAgent(langfuse_handler)
 
+def collect_runtime_metrics() -> List[Tuple[str, str, str, List[Tuple[str, Dict[str, str], float]]]]:
+    """Gauges read at scrape time from the pool, LLM client, caches, templates and the process."""
+    pool = agent.ocr_pool.snapshot()
+    llm_stats = agent.llm_client.snapshot()
+    caches = {"ocr": agent.ocr_cache.snapshot(), "llm": agent.llm_cache.snapshot()}
+    memory = process_memory_bytes()
+    parse_outcomes = {labels["outcome"]: value for _, labels, value in JSON_PARSE.samples()}
+    parsed = sum(parse_outcomes.values())
+    families = [
+        ("ocr_pool_pending_jobs", "gauge", "OCR jobs running or queued on the worker pool.", [("ocr_pool_pending_jobs", {}, pool["pending"])]),
+        ("ocr_pool_capacity", "gauge", "OCR jobs the pool accepts before rejecting with 503.", [("ocr_pool_capacity", {}, pool["capacity"])]),
+        ("ocr_pool_jobs_total", "counter", "OCR pool job outcomes.",
+         [("ocr_pool_jobs_total", {"outcome": key}, pool[key]) for key in ("submitted", "completed", "rejected", "timeouts", "failed")]),
+        ("ocr_pool_recycles_total", "counter", "Times the OCR workers were replaced (job count or memory limit).",
+         [("ocr_pool_recycles_total", {}, pool["recycled"])]),
+        ("ocr_worker_memory_bytes", "gauge", "Memory of each OCR worker process: private pages and pages shared with the server.",
+         [("ocr_worker_memory_bytes", {"worker": str(index), "kind": kind}, usage[f"{kind}_mb"] * 2**20)
+          for index, usage in enumerate(pool["worker_memory_mb"].values()) if usage for kind in ("private", "shared")]),
+        ("llm_calls_in_flight", "gauge", "Structuring LLM calls in progress.", [("llm_calls_in_flight", {}, llm_stats["in_flight"])]),
+        ("llm_calls_total", "counter", "Structuring LLM call outcomes.",
+         [("llm_calls_total", {"outcome": key}, llm_stats[key]) for key in ("calls", "retries", "failures", "deadline_exceeded")]),
+        ("llm_json_parse_failure_ratio", "gauge", "Share of structuring outputs that were not valid JSON (fallback data returned).",
+         [("llm_json_parse_failure_ratio", {}, parse_outcomes.get("fallback", 0.0) / parsed if parsed else 0.0)]),
+        ("cache_hit_ratio", "gauge", "Result cache hit ratio since startup.",
+         [("cache_hit_ratio", {"cache": name}, stats["hit_ratio"]) for name, stats in caches.items()]),
+        ("process_resident_memory_bytes", "gauge", "Resident memory of the API process.",
+         [("process_resident_memory_bytes", {}, memory["resident"])]),
+        ("process_peak_resident_memory_bytes", "gauge", "Peak resident memory of the API process.",
+         [("process_peak_resident_memory_bytes", {}, memory["peak_resident"])]),
+    ]
+    admission_stats = admission.snapshot()
+    families.extend([
+        ("admission_running", "gauge", "Admitted requests running, by priority class.",
+         [("admission_running", {"priority": p}, n) for p, n in admission_stats["running"].items()]),
+        ("admission_queued", "gauge", "Requests waiting for admission, by priority class.",
+         [("admission_queued", {"priority": p}, n) for p, n in admission_stats["queued"].items()]),
+        ("admission_rejected_total", "counter", "Requests shed by admission control.",
+         [("admission_rejected_total", {"priority": p, "reason": reason}, admission_stats[f"{p}_rejected_{reason}"])
+          for p in PRIORITIES for reason in ("queue_full", "deadline")]),
+        ("admission_concurrency_limit", "gauge", "Concurrent requests currently allowed (memory-adjusted).",
+         [("admission_concurrency_limit", {}, admission_stats["concurrency_limit"])]),
+    ])
+    if job_runner is not None:
+        jobs = job_runner.queue.counts()
+        families.append(("jobs", "gauge", "Asynchronous jobs by status.",
+                         [("jobs", {"status": status}, count) for status, count in jobs.items()]))
+    if agent.templates is not None:
+        templates = agent.templates.snapshot()
+        families.append(("template_skip_ratio", "gauge", "Share of pages structured from a learned template instead of the LLM.",
+                         [("template_skip_ratio", {}, templates["skip_rate"])]))
+    return families
+
+REGISTRY.add_collector(collect_runtime_metrics)
+
+class UploadSizeLimit:
+    """Reject uploads past their route's limit before the body is parsed.
+
+    A declared Content-Length is checked before anything is read; a chunked body (no
+    Content-Length) is counted as it arrives and cut off once it passes the limit, so neither can
+    make the multipart parser spool more than the limit.
+    """
+
+    LIMITS = {"/process": UPLOAD_MAX_BYTES, "/jobs": UPLOAD_MAX_BYTES, "/process/batch": BATCH_MAX_BYTES}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = self.LIMITS.get(scope.get("path", "")) if scope["type"] == "http" and scope.get("method") == "POST" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+        allowed = limit + UPLOAD_MULTIPART_OVERHEAD_BYTES
+        detail = f"Upload exceeds {limit} bytes"
+        try:
+            declared = int(Headers(scope=scope).get("content-length", "0"))
+        except ValueError:
+            declared = 0
+        if declared > allowed:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > allowed:
+                    # Raised inside body parsing, which passes HTTPExceptions through
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimit)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Per-request latency, in-flight gauge and a stage-timing trace that works without Langfuse."""
+    path = request.url.path
+    if path in ("/metrics", "/health", "/ready"):
+        return await call_next(request)
+    trace, token = start_trace(f"{request.method} {path}")
+    REQUESTS_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = trace.id
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        # Label by route template so unmatched or parameterized URLs cannot explode the series count
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(time.perf_counter() - trace.started, getattr(route, "path", "unmatched"), str(status))
+        finish_trace(trace, token, status=status)
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "ocr": agent.ocr_cache.snapshot(),
+        "llm": agent.llm_cache.snapshot(),
+    }
+
+@app.get("/ocr/pool")
+async def ocr_pool_stats():
+    return agent.ocr_pool.snapshot()
+
+@app.get("/templates/stats")
+async def template_stats():
+    if agent.templates is None:
+        return {"enabled": False}
+    return {"enabled": True, **agent.templates.snapshot()}
+
+def stored_result(result_id: str) -> str:
+    stored = result_store.get(result_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail=f"Result {result_id} is unknown or expired")
+    return stored
+
+@app.get("/results/{result_id}")
+async def full_result(result_id: str):
+    """The full response (every step's intermediate data) behind a detail=compact response."""
+    return Response(content=stored_result(result_id), media_type="application/json")
+
+@app.get("/results/{result_id}/steps/{index}")
+async def result_step(result_id: str, index: int):
+    steps = json.loads(stored_result(result_id)).get("steps", [])
+    if not 0 <= index < len(steps):
+        raise HTTPException(status_code=404, detail=f"Result {result_id} has no step {index}")
+    return FastJSONResponse(steps[index])
+
+@app.get("/results/{result_id}/pages/{page}/steps/{index}")
+async def result_page_step(result_id: str, page: int, index: int):
+    pages = json.loads(stored_result(result_id)).get("pages", [])
+    steps = pages[page].get("steps", []) if 0 <= page < len(pages) else []
+    if not 0 <= index < len(steps):
+        raise HTTPException(status_code=404, detail=f"Result {result_id} has no step {index} on page {page}")
+    return FastJSONResponse(steps[index])
+
+@app.get("/admission")
+async def admission_stats():
+    return admission.snapshot()
+
+@app.get("/llm/stats")
+async def llm_stats():
+    return agent.llm_client.snapshot()
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    status_code = 200 if startup_state["ready"] else 503
+    return JSONResponse(status_code=status_code, content={
+        "ready": startup_state["ready"],
+        "error": startup_state["error"],
+        "startup": startup_state["phases"],
+    })
+
+def is_supported_upload(content_type: Optional[str]) -> bool:
+    return bool(content_type) and (content_type.startswith("image/") or "pdf" in content_type.lower())
+
+async def receive_upload(file: UploadFile) -> SpooledUpload:
+    """Spool an upload (to disk past the threshold), hashing it and enforcing UPLOAD_MAX_BYTES chunk by chunk.
+
+    The multipart parser has already received the body by now; UploadSizeLimit bounds that part.
+    """
+    try:
+        with span("spool") as attributes:
+            upload = await spool(file)
+            attributes.update(bytes=upload.size, on_disk=upload.on_disk)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    UPLOAD_BYTES.observe(upload.size)
+    return upload
+
+async def extract_upload(upload: SpooledUpload, filename: str, content_type: str) -> Dict[str, Any]:
+    """Run one uploaded image or PDF through the pipeline (shared by /process and the job workers).
+
+    Raises UploadRejected past a size limit, ValueError for an unreadable image and OCRPoolError
+    when the OCR pool cannot take the work.
+    """
+    if "pdf" in content_type.lower():
+        start_t = time.time()
+        page_count, dpi = await open_pdf(upload, filename)
+        page_results = []
+        async for page_result in process_pdf(upload, page_count, dpi, filename):
+            page_results.append(page_result)
+        return agent.merge_page_results(page_results, filename, int((time.time() - start_t) * 1000))
+    return await extract_image(upload, filename)
+
+async def extract_image(upload: SpooledUpload, filename: str) -> Dict[str, Any]:
+    # A byte-identical upload reuses its OCR result without being decoded again. The hash is already
+    # known for a spooled request, but a queued job's file is read for it, so that runs in a thread too.
+    upload_key = agent.upload_cache_key(await asyncio.to_thread(getattr, upload, "sha256"))
+    cached = await agent.ocr_cache.aget(upload_key)
+    if cached is not None:
+        return await agent.process(None, filename, raw_results=cached)
+    # Header parsing and decoding take tens of milliseconds on a full page; keep them off the event loop
+    await asyncio.to_thread(check_image_pixels, upload)
+    image = await asyncio.to_thread(agent.decode, upload.buffer())
+    # Free the encoded bytes (or spool file) before OCR
+    upload.close()
+    return await agent.process(image, filename, upload_key=upload_key)
+
+admission = AdmissionController()
+
+def check_detail(detail: str) -> str:
+    detail = detail.lower()
+    if detail not in DETAIL_LEVELS:
+        raise HTTPException(status_code=400, detail=f"detail must be one of {', '.join(DETAIL_LEVELS)}")
+    return detail
+
+def shape_result(result: Dict[str, Any], detail: str) -> Dict[str, Any]:
+    """Return the result at the requested detail level, storing the full version behind a compact one."""
+    if detail != COMPACT or result.get("status") != "success":
+        return result
+    result_id = uuid.uuid4().hex
+    # Kept serialized: one encoder pass now, and /results serves the bytes without re-encoding
+    result_store.set(result_id, dumps(result).decode("utf-8"))
+    return compact_result(result, result_id)
+
+async def run_admitted(request: Request, default_priority: str, handler):
+    """Run `handler()` once admission grants a slot in the request's priority class.
+
+    Clients may set `X-Priority: interactive|bulk` and `X-Deadline-Seconds`. Shed requests get
+    429 (class queue full) or 503 (deadline cannot be met) with a Retry-After estimate.
+    """
+    priority = (request.headers.get("X-Priority") or default_priority).lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"X-Priority must be one of {', '.join(PRIORITIES)}")
+    deadline = request.headers.get("X-Deadline-Seconds")
+    try:
+        deadline_seconds = float(deadline) if deadline else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Deadline-Seconds must be a number")
+    try:
+        ticket = await admission.acquire(priority, deadline_seconds)
+    except AdmissionRejected as e:
+        print(f"INFO: Shed {priority} request to {request.url.path}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    # Everything the handler starts (LLM calls, OCR jobs, batch items) queues in this class
+    current_priority.set(priority)
+    try:
+        response = await handler()
+    except BaseException:
+        admission.release(ticket)
+        raise
+    if isinstance(response, StreamingResponse):
+        # Streams keep their slot until the last chunk is sent
+        response.background = BackgroundTask(admission.release, ticket)
+    else:
+        admission.release(ticket)
+    return response
+
 @app.post("/process")
-async def process_form(file: UploadFile = File(...)):
+async def process_form(request: Request, file: UploadFile = File(...), stream: bool = False, detail: str = RESPONSE_DETAIL):
+    """Extract a form from an image or PDF. With `stream=true`, PDF results stream back per page as NDJSON.
+
+    `detail=compact` omits per-step intermediates (see /results/{result_id}).
+    """
+    detail = check_detail(detail)
+    return await run_admitted(request, INTERACTIVE, lambda: process_upload(file, stream, detail))
+
+async def process_upload(file: UploadFile, stream: bool, detail: str):
     print(f"INFO: Received file {file.filename} with content_type: {file.content_type}")
-    if not file.content_type.startswith("image/") and "pdf" not in file.content_type.lower():
+    if not is_supported_upload(file.content_type):
         raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}. Only images and PDFs are supported.")
-        
-    contents = await file.read()
-    
-    # Handle PDF conversion
-    if "pdf" in file.content_type.lower():
-        print(f"INFO: Converting PDF {file.filename} to image...")
-        try:
-            images = convert_from_bytes(contents)
-            if not images:
-                raise HTTPException(status_code=500, detail="Failed to convert PDF: No images generated")
-            
-            # Use the first page for extraction (consistent with current single-image logic)
-            img_byte_arr = io.BytesIO()
-            images[0].save(img_byte_arr, format='JPEG')
-            contents = img_byte_arr.getvalue()
-            print("INFO: PDF successfully converted to image.")
-        except Exception as e:
-            print(f"ERROR: PDF Conversion failed: {str(e)}")
-            traceback.print_exc()
-            raise HTTPException(status_code=500, detail=f"PDF conversion failed: {str(e)}")
 
-    result = await agent.process(contents, file.filename)
-    
+    upload = await receive_upload(file)
+    is_pdf = "pdf" in file.content_type.lower()
+    try:
+        # PDFs are rendered from the spooled file and processed page by page
+        if is_pdf and stream:
+            page_count, dpi = await open_pdf(upload, file.filename)
+            response = StreamingResponse(stream_pdf(upload, page_count, dpi, file.filename, detail), media_type="application/x-ndjson")
+            # The stream closes the upload once the last page is sent
+            upload = None
+            return response
+        result = await extract_upload(upload, file.filename, file.content_type)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except OCRPoolError as e:
+        raise pool_error_to_http(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        if not is_pdf:
+            if isinstance(e, ValueError):
+                raise HTTPException(status_code=400, detail=str(e))
+            raise
+        print(f"ERROR: PDF processing failed: {str(e)}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"PDF conversion failed: {str(e)}")
+    finally:
+        if upload is not None:
+            upload.close()
+
     if result["status"] == "error":
         raise HTTPException(status_code=500, detail=result["error"])
         
-    return result
+    return FastJSONResponse(shape_result(result, detail))
+
+async def run_job(path: str, filename: str, content_type: str) -> Dict[str, Any]:
+    try:
+        # Queued jobs are bulk work: they yield to interactive /process calls
+        async with admission.admit(BULK):
+            with SpooledUpload.from_path(path) as upload:
+                return await extract_upload(upload, filename, content_type)
+    except HTTPException as e:
+        return {"status": "error", "error": str(e.detail)}
+
+# Created in lifespan()
+job_runner: Optional[JobRunner] = None
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), callback_url: Optional[str] = Form(None)):
+    """Queue an image or PDF for extraction and return a job id immediately.
+
+    Poll GET /jobs/{job_id}, or pass `callback_url` to receive the finished job as a POST.
+    """
+    if not is_supported_upload(file.content_type):
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}. Only images and PDFs are supported.")
+    if callback_url:
+        try:
+            await asyncio.to_thread(check_callback_url, callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    with await receive_upload(file) as upload, upload.open() as source:
+        job_id = await asyncio.to_thread(job_runner.queue.enqueue, file.filename, file.content_type, source, callback_url)
+    job_runner.notify()
+    print(f"INFO: Queued job {job_id} for {file.filename}")
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await asyncio.to_thread(job_runner.queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return public_view(job)
+
+@app.get("/jobs")
+async def job_stats():
+    return await asyncio.to_thread(job_runner.snapshot)
+
+def pool_error_to_http(e: OCRPoolError) -> HTTPException:
+    if isinstance(e, OCRPoolSaturated):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if isinstance(e, OCRTimeoutError):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+async def open_pdf(upload: SpooledUpload, filename: str) -> Tuple[int, int]:
+    """Page count and render DPI of a spooled PDF; PDF_MAX_PAGES is enforced before any page renders."""
+    page_count, page_size = await asyncio.to_thread(pdf_info, upload.path())
+    if page_count < 1:
+        raise HTTPException(status_code=500, detail="Failed to convert PDF: No images generated")
+    check_page_count(page_count)
+    dpi = page_dpi(page_size)
+    print(f"INFO: Processing PDF {filename}: {page_count} page(s) at {dpi} DPI")
+    return page_count, dpi
+
+async def process_pdf(upload: SpooledUpload, page_count: int, dpi: int, filename: str) -> AsyncIterator[Dict[str, Any]]:
+    """Render a PDF lazily from its spool file, one page at a time, and yield each page's extraction result."""
+    async for page_result in agent.process_pages(iter_pdf_pages(upload.path(), page_count, dpi), filename):
+        yield page_result
+
+async def stream_pdf(upload: SpooledUpload, page_count: int, dpi: int, filename: str,
+                     detail: str = RESPONSE_DETAIL) -> AsyncIterator[bytes]:
+    """NDJSON stream: one "page" event as each page finishes, then the merged "document" event."""
+    start_t = time.time()
+    page_results = []
+    try:
+        async for page_result in process_pdf(upload, page_count, dpi, filename):
+            page_results.append(page_result)
+            yield ndjson_line({"event": "page", "page": page_result["page"], "result": shape_result(page_result, detail)})
+        merged = agent.merge_page_results(page_results, filename, int((time.time() - start_t) * 1000))
+        merged.pop("pages", None)
+        yield ndjson_line({"event": "document", "result": merged})
+    except Exception as e:
+        traceback.print_exc()
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        yield ndjson_line({"event": "error", "error": error})
+    finally:
+        upload.close()
+
+BatchItem = Tuple[str, Callable[[], Any]]
+
+def expand_batch_upload(filename: str, content_type: str, upload: SpooledUpload, stack: ExitStack) -> List[Tuple[BatchItem, int]]:
+    """The images in one batch upload (the file itself, or every image inside a zip) with their sizes.
+
+    Nothing is read yet: each item loads its bytes when processing reaches it, and zip members
+    are checked by their declared size first. Readers stay open until `stack` closes.
+    """
+    if "zip" in (content_type or "").lower() or filename.lower().endswith(".zip"):
+        try:
+            archive = stack.enter_context(zipfile.ZipFile(stack.enter_context(upload.open())))
+        except zipfile.BadZipFile as e:
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive {filename}: {e}")
+        items = []
+        for member in archive.infolist():
+            guessed_type = mimetypes.guess_type(member.filename)[0] or ""
+            if member.is_dir() or not guessed_type.startswith("image/"):
+                continue
+            name = f"{filename}/{member.filename}"
+            if member.file_size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"{name} exceeds {UPLOAD_MAX_BYTES} bytes")
+            items.append(((name, lambda member=member, name=name: read_zip_member(archive, member, name)), member.file_size))
+        return items
+    if not (content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail=f"Unsupported file type in batch: {content_type}. Only images and zip archives are supported.")
+    return [((filename, upload.buffer), upload.size)]
+
+def read_zip_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo, name: str) -> bytes:
+    # Inflate at most one byte past the declared size, so a lying header cannot blow up memory
+    with archive.open(member) as f:
+        contents = f.read(member.file_size + 1)
+    if len(contents) > member.file_size:
+        raise UploadRejected(f"{name} inflates past its declared {member.file_size} bytes")
+    return contents
+
+@app.post("/process/batch")
+async def process_batch(request: Request, files: List[UploadFile] = File(...), stream: bool = False, detail: str = RESPONSE_DETAIL):
+    """Extract many images (or zips of images) in one call using micro-batched OCR.
+
+    With `stream=true`, per-file results stream back as NDJSON in completion order, followed by
+    a summary line; otherwise one JSON response lists results in upload order. Batches are
+    admitted as bulk work.
+    """
+    detail = check_detail(detail)
+    return await run_admitted(request, BULK, lambda: process_batch_upload(files, stream, detail))
+
+async def process_batch_upload(files: List[UploadFile], stream: bool, detail: str):
+    stack = ExitStack()
+    try:
+        items: List[BatchItem] = []
+        total_bytes = 0
+        for file in files:
+            upload = stack.enter_context(await receive_upload(file))
+            for item, size in expand_batch_upload(file.filename, file.content_type, upload, stack):
+                items.append(item)
+                total_bytes += size
+            # Checked on declared sizes, before any image is read or inflated
+            if len(items) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_FILES} images")
+            if total_bytes > BATCH_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Batch images exceed {BATCH_MAX_BYTES} bytes")
+        if not items:
+            raise HTTPException(status_code=400, detail="No images found in batch upload")
+        print(f"INFO: Received batch of {len(items)} image(s), {total_bytes} bytes")
+
+        if stream:
+            # The stream closes the uploads once the last result is sent
+            response = StreamingResponse(stream_batch(items, detail, stack), media_type="application/x-ndjson")
+            stack = None
+            return response
+
+        start_t = time.time()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        try:
+            async for index, result in agent.process_batch(items):
+                results[index] = shape_result(result, detail)
+        except OCRPoolError as e:
+            raise pool_error_to_http(e)
+    finally:
+        if stack is not None:
+            stack.close()
+    succeeded = sum(1 for r in results if r["status"] == "success")
+    return FastJSONResponse({**batch_summary(len(results), succeeded, time.time() - start_t), "results": results})
+
+def batch_summary(count: int, succeeded: int, elapsed_s: float) -> Dict[str, Any]:
+    return {
+        "status": "success" if succeeded else "error",
+        "count": count,
+        "succeeded": succeeded,
+        "failed": count - succeeded,
+        "latency_ms": int(elapsed_s * 1000),
+        "images_per_second": round(count / elapsed_s, 3) if elapsed_s > 0 else None,
+    }
+
+async def stream_batch(items: List[BatchItem], detail: str = RESPONSE_DETAIL, stack: Optional[ExitStack] = None) -> AsyncIterator[bytes]:
+    start_t = time.time()
+    succeeded = 0
+    try:
+        async for index, result in agent.process_batch(items):
+            succeeded += result["status"] == "success"
+            yield ndjson_line({"event": "result", "index": index, "result": shape_result(result, detail)})
+        yield ndjson_line({"event": "summary", **batch_summary(len(items), succeeded, time.time() - start_t)})
+    except Exception as e:
+        traceback.print_exc()
+        yield ndjson_line({"event": "error", "error": str(e)})
+    finally:
+        if stack is not None:
+            stack.close()
 
 if __name__ == "__main__":
     import uvicorn
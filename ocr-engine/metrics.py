@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# TRACE_LOG=1 logs one JSON line of stage timings per request (independent of Langfuse)
+TRACE_LOG = os.getenv("TRACE_LOG", "1").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _labels(self, values: Sequence[str]) -> Dict[str, str]:
+        return dict(zip(self.label_names, values))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = float(value)
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1.0) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last slot is +Inf), sum, count
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, bucket_count in zip(list(self.buckets) + [float("inf")], counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf" if bound == float("inf") else f"{bound:g}"}, cumulative))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Registry:
+    """Metrics plus collector callbacks evaluated at scrape time, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[Tuple[str, str, str, List[Sample]]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, str, List[Sample]]]]) -> None:
+        """`collector()` returns (name, type, help, samples) tuples for values read on demand."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        families = [(m.name, m.kind, m.help_text, m.samples()) for m in self._metrics]
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "ocr_stage_duration_seconds", "Time spent in each pipeline stage.", ["stage"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "ocr_request_duration_seconds", "HTTP request latency until the response starts.", ["path", "status"]))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "ocr_requests_in_flight", "HTTP requests currently being handled."))
+OCR_ELEMENTS = REGISTRY.register(Histogram(
+    "ocr_elements_per_page", "Text elements detected per image or page.",
+    buckets=(0, 5, 10, 25, 50, 100, 250, 500, 1000)))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "LLM tokens (provider-reported): prompt/completion for structuring, correction_* for field correction.",
+    ["kind"]))
+OCR_REFINED = REGISTRY.register(Counter(
+    "ocr_refined_detections_total", "Low-confidence detections re-recognized, by whether a better reading was found.", ["outcome"]))
+UPLOAD_BYTES = REGISTRY.register(Histogram(
+    "upload_size_bytes", "Size of accepted uploads.",
+    buckets=(64 * 1024, 256 * 1024, 1024**2, 4 * 1024**2, 16 * 1024**2, 64 * 1024**2)))
+LLM_FIRST_SECTION_SECONDS = REGISTRY.register(Histogram(
+    "llm_time_to_first_section_seconds", "Time from starting a structuring call to the first complete section in its streamed output."))
+JSON_PARSE = REGISTRY.register(Counter(
+    "llm_json_parse_total", "How LLM output was parsed: direct, brace_block, code_block or fallback.", ["outcome"]))
+
+
+def process_memory_bytes() -> Dict[str, float]:
+    """Current and peak resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    current = 0.0
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    return {"resident": float(current), "peak_resident": float(peak)}
+
+
+class Trace:
+    """Stage timings of one request, collected through a context variable."""
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, stage: str, started: float, duration: float, attributes: Dict[str, Any]) -> None:
+        span = {"stage": stage, "start_ms": round((started - self.started) * 1000, 2), "duration_ms": round(duration * 1000, 2)}
+        if attributes:
+            span.update(attributes)
+        self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def start_trace(name: str) -> Tuple[Trace, Any]:
+    trace = Trace(name)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace: Trace, token: Any, **attributes: Any) -> None:
+    _current_trace.reset(token)
+    if TRACE_LOG and trace.spans:
+        logger.info(f"TRACE {json.dumps({**trace.to_dict(), **attributes})}")
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """Time a stage into the stage histogram and the current request's trace, if any.
+
+    The yielded dict may be filled with attributes (e.g. element counts) inside the block.
+    """
+    started = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, started, duration, attributes)
@@ -0,0 +1,541 @@
+import asyncio
+import gc
+import json
+import logging
+import multiprocessing
+import math
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from admission import PriorityLanes
+from refinement import Reading
+from tiling import Detection, merge_tile_detections, tile_grid
+
+logger = logging.getLogger(__name__)
+
+# Pool sizing: OCR_CORES is the core budget for OCR, split into workers of OCR_THREADS_PER_WORKER
+# torch threads each. OCR_WORKERS overrides the derived count; 0 runs OCR on a single
+# in-process thread instead of a process pool (lowest memory, no parallelism).
+OCR_CORES = int(os.getenv("OCR_CORES", str(os.cpu_count() or 1)))
+OCR_THREADS_PER_WORKER = max(1, int(os.getenv("OCR_THREADS_PER_WORKER", "1")))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, OCR_CORES // OCR_THREADS_PER_WORKER))))
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", "16"))
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "120"))
+OCR_START_METHOD = os.getenv("OCR_START_METHOD", "spawn")
+OCR_LANGUAGES = [lang.strip() for lang in os.getenv("OCR_LANGUAGES", "en").split(",") if lang.strip()]
+# Micro-batching: with OCR_MICROBATCH_SIZE > 1, images are padded up to multiples of OCR_BATCH_BUCKET
+# pixels so similar sizes share one batched detector pass. On CPU that is slower than one image per
+# pass (padding adds pixels and the batched tensors outgrow the caches: ~25.5 s vs ~16.7 s per
+# page, two pages per pass, one core), so the default sends each image to a worker at its own
+# size; batching pays off on GPU. OCR_RECOGNIZER_BATCH_SIZE is EasyOCR's recognizer batch size.
+OCR_MICROBATCH_SIZE = max(1, int(os.getenv("OCR_MICROBATCH_SIZE", "1")))
+OCR_BATCH_BUCKET = max(1, int(os.getenv("OCR_BATCH_BUCKET", "256")))
+OCR_RECOGNIZER_BATCH_SIZE = max(1, int(os.getenv("OCR_RECOGNIZER_BATCH_SIZE", "8")))
+# Beam width of the second recognition pass over low-confidence crops (see refinement.py)
+OCR_REFINE_BEAM_WIDTH = max(1, int(os.getenv("OCR_REFINE_BEAM_WIDTH", "5")))
+# Set to 0 in images where setup_ocr.py already baked the weights, so a missing model fails fast
+OCR_DOWNLOAD_ENABLED = os.getenv("OCR_DOWNLOAD_ENABLED", "1") == "1"
+# OCR_SHARE_WEIGHTS=1 loads the reader once in this process and forks the workers from it, so the
+# weights are shared copy-on-write instead of loaded per worker (Linux; ignores OCR_START_METHOD).
+OCR_SHARE_WEIGHTS = os.getenv("OCR_SHARE_WEIGHTS", "0") == "1"
+# Worker recycling: the workers are replaced after OCR_RECYCLE_AFTER_TASKS jobs per worker, or once
+# one of them holds more than OCR_RECYCLE_PRIVATE_MB of unshared memory (0 disables either check).
+# Jobs already submitted finish on the old workers.
+OCR_RECYCLE_AFTER_TASKS = int(os.getenv("OCR_RECYCLE_AFTER_TASKS", "0"))
+OCR_RECYCLE_PRIVATE_MB = float(os.getenv("OCR_RECYCLE_PRIVATE_MB", "0"))
+OCR_RECYCLE_CHECK_SECONDS = float(os.getenv("OCR_RECYCLE_CHECK_SECONDS", "10"))
+# Tiled OCR: images larger than OCR_TILE_SIZE pixels on a side are read as overlapping tiles of that
+# size, spread over the workers, so large scans keep full resolution (0 disables). The overlap
+# should exceed the height of a text line. OCR_TILE_MAX_SIDE is then the preprocessing downscale
+# limit, in place of PREPROCESS_MAX_SIDE.
+OCR_TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", "0"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "256"))
+OCR_TILE_MAX_SIDE = int(os.getenv("OCR_TILE_MAX_SIDE", "10000"))
+
+
+class OCRPoolError(Exception):
+    """Base class for errors raised by the OCR worker pool itself (not by OCR of a bad image)."""
+
+
+class OCRPoolSaturated(OCRPoolError):
+    """The submission queue is full; the caller should retry later."""
+
+
+class OCRTimeoutError(OCRPoolError):
+    """An OCR job did not finish within the per-request timeout."""
+
+
+# Per-worker state. Each worker process (or the single in-process thread) owns one reader.
+_reader = None
+_readtext_defaults: Dict[str, Any] = {}
+_startup_timings: Dict[str, Any] = {}
+
+
+def _warmup_image() -> np.ndarray:
+    """Small synthetic text image that exercises both the detector and the recognizer."""
+    import cv2
+
+    image = np.full((96, 320, 3), 255, dtype=np.uint8)
+    cv2.putText(image, "Warmup 123", (12, 62), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 0, 0), 3)
+    return image
+
+
+def _set_torch_threads(threads: int) -> None:
+    """Intra-op threads from the worker layout; one inter-op thread, since EasyOCR runs ops serially."""
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only settable before the first parallel op, e.g. not when reused in-process
+        pass
+
+
+def _init_worker(languages: Sequence[str], threads: int, profile: Optional[Dict[str, Any]] = None,
+                 download_enabled: bool = OCR_DOWNLOAD_ENABLED) -> None:
+    global _reader, _readtext_defaults
+    started = time.perf_counter()
+    import torch  # noqa: F401
+    import easyocr  # noqa: F401  (timed separately from model loading)
+    from setup_ocr import build_reader, readtext_options, resolve_profile
+
+    imported = time.perf_counter()
+    _set_torch_threads(threads)
+    profile = profile or resolve_profile()
+    _reader = build_reader(languages, download_enabled=download_enabled, profile=profile)
+    _readtext_defaults = readtext_options(profile)
+    loaded = time.perf_counter()
+    # First inference pays for lazy kernel initialization; do it before serving real traffic
+    _reader.readtext(_warmup_image(), **_readtext_defaults)
+    warmed = time.perf_counter()
+
+    _startup_timings.update({
+        "profile": profile["name"],
+        "import_ms": round((imported - started) * 1000, 1),
+        "reader_load_ms": round((loaded - imported) * 1000, 1),
+        "warmup_inference_ms": round((warmed - loaded) * 1000, 1),
+    })
+    logger.info(f"OCR worker {os.getpid()} ready ({threads} thread(s), {profile}): {_startup_timings}")
+
+
+def _load_shared_reader(languages: Sequence[str], profile: Dict[str, Any],
+                        download_enabled: bool = OCR_DOWNLOAD_ENABLED) -> None:
+    """Load the reader in the parent process, ready to be inherited by forked workers."""
+    global _reader, _readtext_defaults
+    if _reader is not None:
+        return
+    from setup_ocr import build_reader, readtext_options
+
+    # A single thread here keeps OpenMP from starting a thread pool, which does not survive fork
+    _set_torch_threads(1)
+    started = time.perf_counter()
+    _reader = build_reader(languages, download_enabled=download_enabled, profile=profile)
+    _readtext_defaults = readtext_options(profile)
+    # Lazily allocated inference state is then created once and shared as well
+    _reader.readtext(_warmup_image(), **_readtext_defaults)
+    _startup_timings.update({"profile": profile["name"], "shared_reader_load_ms": round((time.perf_counter() - started) * 1000, 1)})
+    # Keep the collector from touching (and so copying) every inherited object in the workers
+    gc.freeze()
+    logger.info(f"Shared OCR reader loaded in {os.getpid()}: {_startup_timings}")
+
+
+def _init_forked_worker(threads: int) -> None:
+    started = time.perf_counter()
+    _set_torch_threads(threads)
+    _reader.readtext(_warmup_image(), **_readtext_defaults)
+    _startup_timings["warmup_inference_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"OCR worker {os.getpid()} forked with shared weights ({threads} thread(s)): {_startup_timings}")
+
+
+def worker_memory_mb(pid: int) -> Dict[str, float]:
+    """Resident, private (unshared) and shared memory of a process, from /proc."""
+    fields: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except (OSError, ValueError):
+        return {}
+    private = fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    return {
+        "rss_mb": round(fields.get("Rss", 0.0), 1),
+        "private_mb": round(private, 1),
+        "shared_mb": round(fields.get("Rss", 0.0) - private, 1),
+    }
+
+
+def _worker_startup_report() -> Dict[str, Any]:
+    return {"pid": os.getpid(), **_startup_timings}
+
+
+def _to_detections(results: List[Any]) -> List[Detection]:
+    """Convert EasyOCR output to plain Python types so it pickles and serializes cheaply."""
+    return [
+        ([[float(x), float(y)] for x, y in bbox], str(text), float(prob))
+        for bbox, text, prob in results
+    ]
+
+
+def _worker_readtext(image_np: np.ndarray, options: Dict[str, Any]) -> List[Detection]:
+    return _to_detections(_reader.readtext(image_np, **{**_readtext_defaults, **options}))
+
+
+def _worker_readtext_batch(images: List[np.ndarray], options: Dict[str, Any]) -> List[List[Detection]]:
+    results = _reader.readtext_batched(images, batch_size=OCR_RECOGNIZER_BATCH_SIZE, **{**_readtext_defaults, **options})
+    return [_to_detections(r) for r in results]
+
+
+def _worker_rerecognize(crops: List[np.ndarray]) -> List[List[Reading]]:
+    """Recognition only (no detection) of each crop in several preprocessing variants, with beam search."""
+    from preprocessing import recognition_variants
+
+    readings = []
+    for crop in crops:
+        candidates = []
+        for variant, image in recognition_variants(crop).items():
+            results = _reader.recognize(image, decoder="beamsearch", beamWidth=OCR_REFINE_BEAM_WIDTH, detail=1)
+            if results:
+                text = " ".join(str(text) for _, text, _ in results)
+                candidates.append((text, float(min(prob for _, _, prob in results)), variant))
+        readings.append(candidates)
+    return readings
+
+
+def _as_rgb(image_np: np.ndarray) -> np.ndarray:
+    if image_np.ndim == 2:
+        return np.stack([image_np] * 3, axis=-1)
+    return image_np[:, :, :3]
+
+
+def _bucket_shape(image_np: np.ndarray, bucket: int) -> Tuple[int, int]:
+    height, width = image_np.shape[:2]
+    return math.ceil(height / bucket) * bucket, math.ceil(width / bucket) * bucket
+
+
+def _pad_to(image_np: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Pad bottom/right with white so coordinates of detections are unchanged."""
+    image_np = _as_rgb(image_np)
+    height, width = image_np.shape[:2]
+    if (height, width) == shape:
+        return image_np
+    padded = np.full((shape[0], shape[1], 3), 255, dtype=image_np.dtype)
+    padded[:height, :width] = image_np
+    return padded
+
+
+class OCRWorkerPool:
+    """Runs EasyOCR off the event loop on a pool of workers that each hold a preloaded reader."""
+
+    def __init__(
+        self,
+        workers: int = OCR_WORKERS,
+        threads_per_worker: int = OCR_THREADS_PER_WORKER,
+        queue_size: int = OCR_QUEUE_SIZE,
+        timeout_seconds: float = OCR_TIMEOUT_SECONDS,
+        languages: Sequence[str] = tuple(OCR_LANGUAGES),
+        start_method: str = OCR_START_METHOD,
+        profile: Optional[Dict[str, Any]] = None,
+        share_weights: bool = OCR_SHARE_WEIGHTS,
+        recycle_after_tasks: int = OCR_RECYCLE_AFTER_TASKS,
+        recycle_private_mb: float = OCR_RECYCLE_PRIVATE_MB,
+        tile_size: int = OCR_TILE_SIZE,
+        tile_overlap: int = OCR_TILE_OVERLAP,
+    ):
+        from setup_ocr import resolve_profile
+
+        self.workers = max(0, workers)
+        self.threads_per_worker = threads_per_worker
+        self.queue_size = queue_size
+        self.timeout_seconds = timeout_seconds
+        self.languages = list(languages)
+        self.start_method = start_method
+        # Resolved here so a bad OCR_PROFILE fails at startup rather than in every worker
+        self.profile = profile or resolve_profile()
+        self.share_weights = share_weights and self.workers > 0
+        self.recycle_after_tasks = max(0, recycle_after_tasks)
+        self.recycle_private_mb = max(0.0, recycle_private_mb)
+        # Tiles larger than the detector canvas would be downscaled again inside each worker
+        self.tile_size = min(max(0, tile_size), self.profile["canvas_size"])
+        self.tile_overlap = tile_overlap
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        # Jobs go to the executor only as workers free up, interactive requests first; the
+        # executor's own queue is FIFO and would make them wait behind a batch's backlog
+        self._lanes = PriorityLanes(max(1, self.workers))
+        # Jobs submitted to the current set of workers, and when their memory was last checked
+        self._generation_tasks = 0
+        self._memory_checked = 0.0
+        self.stats = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0, "failed": 0, "recycled": 0, "tiled_images": 0,
+                      "micro_batches": 0, "batched_images": 0}
+
+    @property
+    def capacity(self) -> int:
+        """Jobs that may be running or queued at once before new submissions are rejected."""
+        return max(1, self.workers) + self.queue_size
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        init_args = (self.languages, self.threads_per_worker, self.profile)
+        self._generation_tasks = 0
+        if self.workers == 0:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="ocr", initializer=_init_worker, initargs=init_args
+            )
+        elif self.share_weights:
+            _load_shared_reader(self.languages, self.profile)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_forked_worker,
+                initargs=(self.threads_per_worker,),
+            )
+        else:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=_init_worker,
+                initargs=init_args,
+            )
+        logger.info(
+            f"OCR pool started: {self.workers or 'in-process'} worker(s), "
+            f"{self.threads_per_worker} thread(s) each, queue {self.queue_size}, profile {self.profile['name']}"
+            f"{', shared weights' if self.share_weights else ''}"
+        )
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def worker_pids(self) -> List[int]:
+        processes = getattr(self._executor, "_processes", None) or {}
+        return sorted(processes)
+
+    def _recycle_reason(self) -> Optional[str]:
+        if self.workers == 0 or self._executor is None:
+            return None
+        if self.recycle_after_tasks and self._generation_tasks >= self.recycle_after_tasks * self.workers:
+            return f"{self._generation_tasks} jobs served"
+        now = time.monotonic()
+        if self.recycle_private_mb and now - self._memory_checked >= OCR_RECYCLE_CHECK_SECONDS:
+            self._memory_checked = now
+            for pid in self.worker_pids():
+                private_mb = worker_memory_mb(pid).get("private_mb", 0.0)
+                if private_mb > self.recycle_private_mb:
+                    return f"worker {pid} holds {private_mb:.0f} MB private memory"
+        return None
+
+    def recycle(self, reason: str = "requested") -> None:
+        """Swap in a fresh set of workers; jobs already submitted finish on the old ones first."""
+        retired = self._executor
+        self._executor = None
+        self.start()
+        self.stats["recycled"] += 1
+        logger.info(f"Recycling OCR workers ({reason})")
+        if retired is not None:
+            # Does not cancel queued work; the old workers exit once their jobs are done
+            retired.shutdown(wait=False)
+
+    def _release(self) -> None:
+        self._pending -= 1
+        self._lanes.release()
+
+    async def run(self, fn, *args, timeout_seconds: Optional[float] = None) -> Any:
+        """Submit `fn(*args)` to the pool, enforcing the queue bound and the per-request timeout.
+
+        `timeout_seconds` overrides the pool timeout for jobs holding several images.
+        """
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        if self._pending >= self.capacity:
+            self.stats["rejected"] += 1
+            raise OCRPoolSaturated(f"OCR queue full ({self._pending} jobs pending)")
+        deadline = time.monotonic() + timeout_seconds
+        self._pending += 1
+        try:
+            await asyncio.wait_for(self._lanes.acquire(), timeout=timeout_seconds)
+        except asyncio.TimeoutError:
+            self._pending -= 1
+            self.stats["timeouts"] += 1
+            raise OCRTimeoutError(f"OCR did not start within {timeout_seconds:.0f}s")
+        except BaseException:
+            self._pending -= 1
+            raise
+
+        try:
+            self.start()
+            reason = self._recycle_reason()
+            if reason:
+                self.recycle(reason)
+            try:
+                future = self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed); rebuild the pool so later requests can proceed
+                self.shutdown(wait=False)
+                self.start()
+                future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+
+        self._generation_tasks += 1
+        self.stats["submitted"] += 1
+        # The slot is held until the worker really finishes, even if the caller timed out
+        future.add_done_callback(self._release_threadsafe(asyncio.get_running_loop()))
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise OCRTimeoutError(f"OCR did not finish within {timeout_seconds:.0f}s")
+        except BrokenProcessPool as e:
+            self.stats["failed"] += 1
+            self.shutdown(wait=False)
+            raise OCRPoolError(f"OCR worker crashed: {e}")
+        self.stats["completed"] += 1
+        return result
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop):
+        def callback(_future) -> None:
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                # Event loop already closed during shutdown
+                pass
+        return callback
+
+    async def warmup(self, timeout_seconds: float = 600) -> List[Dict[str, Any]]:
+        """Start the pool and wait until every worker has loaded and warmed its reader.
+
+        Workers warm up inside the initializer, before accepting any job, so a worker is warm once
+        it has answered a startup report. Reports are requested until every worker has answered.
+        """
+        if self.share_weights and self._executor is None:
+            # The parent's model load takes seconds; keep the event loop (and /health) responsive
+            await asyncio.get_running_loop().run_in_executor(None, _load_shared_reader, self.languages, self.profile)
+        self.start()
+        slots = max(1, self.workers)
+        reports: Dict[int, Dict[str, Any]] = {}
+        deadline = time.monotonic() + timeout_seconds
+        while len(reports) < slots:
+            if time.monotonic() > deadline:
+                raise OCRTimeoutError(f"Only {len(reports)}/{slots} OCR workers warmed up in {timeout_seconds:.0f}s")
+            batch = await asyncio.gather(*[
+                asyncio.wrap_future(self._executor.submit(_worker_startup_report)) for _ in range(slots)
+            ])
+            reports.update((report["pid"], report) for report in batch)
+            if len(reports) < slots:
+                await asyncio.sleep(0.5)
+        return list(reports.values())
+
+    def needs_tiling(self, image_np: np.ndarray) -> bool:
+        return bool(self.tile_size) and max(image_np.shape[:2]) > self.tile_size
+
+    async def readtext(self, image_np: np.ndarray, **options: Any) -> List[Detection]:
+        if self.needs_tiling(image_np):
+            return await self.readtext_tiled(image_np, **options)
+        return await self.run(_worker_readtext, image_np, options)
+
+    async def readtext_tiled(self, image_np: np.ndarray, **options: Any) -> List[Detection]:
+        """OCR a large image as overlapping tiles on all workers, merged back into page coordinates.
+
+        At most one tile per worker is copied out and in flight at a time, so memory beyond the
+        image itself stays bounded by the tile size.
+        """
+        height, width = image_np.shape[:2]
+        tiles = tile_grid(height, width, self.tile_size, self.tile_overlap)
+        limiter = asyncio.Semaphore(max(1, self.workers))
+        self.stats["tiled_images"] += 1
+
+        async def run_tile(tile: Dict[str, Any]) -> List[Detection]:
+            x0, y0, x1, y1 = tile["box"]
+            async with limiter:
+                return await self.run(_worker_readtext, np.ascontiguousarray(image_np[y0:y1, x0:x1]), options)
+
+        detections = await asyncio.gather(*[run_tile(tile) for tile in tiles])
+        return merge_tile_detections(tiles, detections, (width, height))
+
+    async def rerecognize(self, crops: List[np.ndarray]) -> List[List[Reading]]:
+        """Second-pass readings of text crops, split evenly over the workers."""
+        if not crops:
+            return []
+        size = math.ceil(len(crops) / max(1, self.workers))
+        parts = await asyncio.gather(*[
+            self.run(_worker_rerecognize, crops[start:start + size]) for start in range(0, len(crops), size)
+        ])
+        return [readings for part in parts for readings in part]
+
+    async def readtext_batch(self, images: List[np.ndarray], **options: Any) -> List[List[Detection]]:
+        """OCR many images using batched EasyOCR inference, returning results in input order.
+
+        Images are grouped by padded size into micro-batches of OCR_MICROBATCH_SIZE, which run
+        concurrently with one batch per worker. Micro-batches of one image are not padded.
+        """
+        results: List[List[Detection]] = [[] for _ in images]
+        # Oversized images are tiled one by one; the tiles already occupy every worker
+        for index, image_np in enumerate(images):
+            if self.needs_tiling(image_np):
+                results[index] = await self.readtext_tiled(image_np, **options)
+
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for index, image_np in enumerate(images):
+            if self.needs_tiling(image_np):
+                continue
+            groups.setdefault(_bucket_shape(image_np, OCR_BATCH_BUCKET), []).append(index)
+
+        jobs = []
+        for shape, indices in groups.items():
+            for start in range(0, len(indices), OCR_MICROBATCH_SIZE):
+                batch = indices[start:start + OCR_MICROBATCH_SIZE]
+                jobs.append((batch, [_pad_to(images[i], shape) if len(batch) > 1 else images[i] for i in batch]))
+
+        self.stats["micro_batches"] += len(jobs)
+        self.stats["batched_images"] += sum(len(batch) for batch, _ in jobs)
+        # One micro-batch per worker at a time, leaving queue room for interactive requests
+        limiter = asyncio.Semaphore(max(1, self.workers))
+
+        async def run_batch(padded: List[np.ndarray]) -> List[List[Detection]]:
+            async with limiter:
+                if len(padded) == 1:
+                    return [await self.run(_worker_readtext, padded[0], options)]
+                return await self.run(_worker_readtext_batch, padded, options, timeout_seconds=self.timeout_seconds * len(padded))
+
+        batch_results = await asyncio.gather(*[run_batch(padded) for _, padded in jobs])
+        for (batch, _), detections in zip(jobs, batch_results):
+            for index, image_detections in zip(batch, detections):
+                results[index] = image_detections
+        return results
+
+    def signature(self) -> str:
+        """Model and tiling settings that change what OCR returns, for cache keys."""
+        return json.dumps({
+            **{key: self.profile[key] for key in ("detector", "quantize", "canvas_size")},
+            "tile_size": self.tile_size,
+            "tile_overlap": self.tile_overlap if self.tile_size else 0,
+            "tile_max_side": OCR_TILE_MAX_SIDE if self.tile_size else 0,
+        }, sort_keys=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "profile": self.profile,
+            "share_weights": self.share_weights,
+            "tile_size": self.tile_size,
+            "worker_memory_mb": {str(pid): worker_memory_mb(pid) for pid in self.worker_pids()},
+            "pending": self._pending,
+            "capacity": self.capacity,
+        }
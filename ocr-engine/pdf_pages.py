@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import math
+import os
+import re
+from typing import AsyncIterator, Optional, Tuple
+
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Rasterization caps: pages render at PDF_MAX_DPI unless that would exceed PDF_MAX_PAGE_PIXELS
+PDF_MAX_DPI = int(os.getenv("PDF_MAX_DPI", "200"))
+PDF_MIN_DPI = int(os.getenv("PDF_MIN_DPI", "72"))
+PDF_MAX_PAGE_PIXELS = int(os.getenv("PDF_MAX_PAGE_PIXELS", "12000000"))
+
+_PAGE_SIZE_RE = re.compile(r"([\d.]+)\s*x\s*([\d.]+)\s*pts")
+
+
+def pdf_info(path: str) -> Tuple[int, Optional[Tuple[float, float]]]:
+    """Return the page count and the first page size in points, if poppler reports it."""
+    info = pdfinfo_from_path(path)
+    size = None
+    match = _PAGE_SIZE_RE.search(str(info.get("Page size", "")))
+    if match:
+        size = (float(match.group(1)), float(match.group(2)))
+    return int(info["Pages"]), size
+
+
+def page_dpi(page_size_pts: Optional[Tuple[float, float]], max_dpi: int = PDF_MAX_DPI,
+             max_pixels: int = PDF_MAX_PAGE_PIXELS) -> int:
+    """Highest DPI up to `max_dpi` whose rendered page stays under `max_pixels`."""
+    if not page_size_pts:
+        return max_dpi
+    width_in, height_in = page_size_pts[0] / 72.0, page_size_pts[1] / 72.0
+    fitting_dpi = int(math.sqrt(max_pixels / max(width_in * height_in, 1e-6)))
+    return max(PDF_MIN_DPI, min(max_dpi, fitting_dpi))
+
+
+def render_page(path: str, page_number: int, dpi: int, max_pixels: int = PDF_MAX_PAGE_PIXELS) -> Image.Image:
+    """Rasterize a single page; later pages of a mixed-size PDF are downscaled if still too large."""
+    with span("pdf_render", page=page_number, dpi=dpi):
+        images = convert_from_path(path, dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        raise ValueError(f"No image generated for page {page_number}")
+    image = images[0]
+    pixels = image.width * image.height
+    if pixels > max_pixels:
+        scale = math.sqrt(max_pixels / pixels)
+        image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+    return image
+
+
+async def iter_pdf_pages(path: str, page_count: int, dpi: int) -> AsyncIterator[Tuple[int, Image.Image]]:
+    """Yield pages in order, rendering page N+1 in a thread while the caller works on page N."""
+    next_render = asyncio.ensure_future(asyncio.to_thread(render_page, path, 1, dpi))
+    try:
+        for page_number in range(1, page_count + 1):
+            image = await next_render
+            if page_number < page_count:
+                next_render = asyncio.ensure_future(asyncio.to_thread(render_page, path, page_number + 1, dpi))
+            yield page_number, image
+    finally:
+        next_render.cancel()
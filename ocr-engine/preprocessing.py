@@ -0,0 +1,255 @@
+import io
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# Skew is searched on a copy of the ink mask at most this many pixels a side, and only corrected when
+# straightening makes the text rows at least this much sharper than leaving the page as it is
+DESKEW_MAX_SIDE = 800
+DESKEW_MIN_GAIN = 0.1
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+@dataclass(frozen=True)
+class PreprocessConfig:
+    """Which OpenCV operations run before OCR. Defaults come from PREPROCESS_* env vars."""
+
+    enabled: bool = _env_flag("PREPROCESS_ENABLED", "1")
+    # EasyOCR's detector resizes to canvas_size=2560 anyway, so this rarely costs detection accuracy
+    max_side: int = int(os.getenv("PREPROCESS_MAX_SIDE", "2560"))
+    grayscale: bool = _env_flag("PREPROCESS_GRAYSCALE", "1")
+    crop_margins: bool = _env_flag("PREPROCESS_CROP_MARGINS", "1")
+    crop_padding: int = int(os.getenv("PREPROCESS_CROP_PADDING", "16"))
+    deskew: bool = _env_flag("PREPROCESS_DESKEW", "0")
+    max_skew_degrees: float = float(os.getenv("PREPROCESS_MAX_SKEW_DEGREES", "15"))
+    binarize: bool = _env_flag("PREPROCESS_BINARIZE", "0")
+
+    def signature(self) -> str:
+        """Stable description used in cache keys, so results from other settings are not reused."""
+        return json.dumps(asdict(self), sort_keys=True)
+
+
+def decode_image(buffer: bytes, grayscale: bool = False) -> np.ndarray:
+    """Decode an uploaded image straight into a NumPy array (RGB, or single-channel if `grayscale`).
+
+    Raises ValueError when the buffer is not a readable image.
+    """
+    image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
+    if image is None:
+        # Formats OpenCV cannot read (e.g. GIF) fall back to Pillow
+        from PIL import Image, UnidentifiedImageError
+        try:
+            with Image.open(io.BytesIO(buffer)) as pil_image:
+                return np.asarray(pil_image.convert("L" if grayscale else "RGB"))
+        except (UnidentifiedImageError, OSError) as e:
+            raise ValueError(f"Unreadable image: {e}")
+    if not grayscale:
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    return image
+
+
+def pil_to_array(image: Any, grayscale: bool = False) -> np.ndarray:
+    """Convert a rendered PIL page to the same array layout `decode_image` produces."""
+    return np.asarray(image.convert("L" if grayscale else "RGB"))
+
+
+def _to_gray(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+def _ink_mask(gray: np.ndarray) -> np.ndarray:
+    """Foreground (ink) mask via inverted Otsu threshold, with speckle noise removed."""
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+
+
+def downscale(image: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image, 1.0
+    resized = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    return resized, scale
+
+
+def crop_margins(image: np.ndarray, padding: int) -> Tuple[np.ndarray, Optional[List[int]]]:
+    """Trim background around the ink bounding box; returns the crop box as [x, y, w, h]."""
+    points = cv2.findNonZero(_ink_mask(_to_gray(image)))
+    if points is None:
+        return image, None
+    x, y, w, h = cv2.boundingRect(points)
+    height, width = image.shape[:2]
+    x0, y0 = max(0, x - padding), max(0, y - padding)
+    x1, y1 = min(width, x + w + padding), min(height, y + h + padding)
+    if (x1 - x0) * (y1 - y0) >= 0.98 * width * height:
+        return image, None
+    return image[y0:y1, x0:x1], [x0, y0, x1 - x0, y1 - y0]
+
+
+def _row_sharpness(mask: np.ndarray, angle: float) -> float:
+    # Text lines at the right angle give row sums that jump between ink and gaps
+    height, width = mask.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    rows = cv2.warpAffine(mask, matrix, (width, height), flags=cv2.INTER_NEAREST).sum(axis=1, dtype=np.float64)
+    return float(np.sum(np.diff(rows) ** 2))
+
+
+def estimate_skew(gray: np.ndarray, max_degrees: float = 15.0) -> float:
+    """Skew angle in degrees of the text lines, by projection profile.
+
+    The ink mask is rotated through candidate angles and the one whose row profile is sharpest
+    wins (coarse 1 degree steps, then 0.1). The shape of the ink as a whole does not matter, so
+    a sparse form is not mistaken for a tilted one; an angle whose profile is not clearly sharper
+    than the unrotated one is reported as 0.
+    """
+    mask, _ = downscale(_ink_mask(gray), DESKEW_MAX_SIDE)
+    if cv2.countNonZero(mask) < 50:
+        return 0.0
+    straight = _row_sharpness(mask, 0.0)
+    coarse = max(np.arange(-max_degrees, max_degrees + 0.5, 1.0), key=lambda a: _row_sharpness(mask, a))
+    best = max(np.arange(coarse - 1.0, coarse + 1.05, 0.1), key=lambda a: _row_sharpness(mask, a))
+    if _row_sharpness(mask, best) < straight * (1 + DESKEW_MIN_GAIN):
+        return 0.0
+    return round(float(best), 2)
+
+
+def rotate(image: np.ndarray, angle: float) -> np.ndarray:
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def binarize(image: np.ndarray) -> np.ndarray:
+    return cv2.adaptiveThreshold(_to_gray(image), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+
+def recognition_variants(crop: np.ndarray) -> Dict[str, np.ndarray]:
+    """Renderings of a low-confidence text crop for a second recognition pass."""
+    gray = _to_gray(crop)
+    return {
+        "original": gray,
+        "contrast": cv2.createCLAHE(clipLimit=2.0, tileGridSize=(4, 4)).apply(gray),
+        "binarized": binarize(gray),
+    }
+
+
+def preprocess_image(image: np.ndarray, config: PreprocessConfig = PreprocessConfig()) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Shrink an image before OCR. Returns the processed image and a report of what changed.
+
+    Detection bboxes refer to the processed image. Operations run in a fixed order: grayscale,
+    downscale, margin crop, deskew, binarize.
+    """
+    pixels_in = int(image.shape[0] * image.shape[1])
+    report: Dict[str, Any] = {"pixels_in": pixels_in, "operations_ms": {}}
+    if not config.enabled:
+        report.update({"pixels_out": pixels_in, "pixels_removed": 0})
+        return image, report
+
+    def timed(name: str, fn: Callable[[], Any]) -> Any:
+        started = time.perf_counter()
+        result = fn()
+        report["operations_ms"][name] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    # Grayscale first so the resize touches one channel instead of three
+    if config.grayscale:
+        image = timed("grayscale", lambda: _to_gray(image))
+    if config.max_side > 0:
+        image, report["scale"] = timed("downscale", lambda: downscale(image, config.max_side))
+    if config.crop_margins:
+        image, report["crop_box"] = timed("crop_margins", lambda: crop_margins(image, config.crop_padding))
+    if config.deskew:
+        angle = timed("estimate_skew", lambda: estimate_skew(_to_gray(image), config.max_skew_degrees))
+        report["skew_degrees"] = round(angle, 2)
+        if 0.3 <= abs(angle) <= config.max_skew_degrees:
+            image = timed("deskew", lambda: rotate(image, angle))
+    if config.binarize:
+        image = timed("binarize", lambda: binarize(image))
+
+    pixels_out = int(image.shape[0] * image.shape[1])
+    report.update({
+        "pixels_out": pixels_out,
+        "pixels_removed": pixels_in - pixels_out,
+        "total_ms": round(sum(report["operations_ms"].values()), 2),
+    })
+    return np.ascontiguousarray(image), report
+
+
+def character_error_rate(predicted: str, expected: str) -> float:
+    """Levenshtein distance between the texts divided by the expected length."""
+    predicted, expected = " ".join(predicted.split()), " ".join(expected.split())
+    if not expected:
+        return 0.0 if not predicted else 1.0
+    previous = list(range(len(expected) + 1))
+    for i, p_char in enumerate(predicted, start=1):
+        current = [i]
+        for j, e_char in enumerate(expected, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (p_char != e_char)))
+        previous = current
+    return previous[-1] / len(expected)
+
+
+def evaluate(samples: Sequence[Tuple[np.ndarray, str]], readtext: Callable[[np.ndarray], List[Any]],
+             configs: Dict[str, PreprocessConfig]) -> Dict[str, Any]:
+    """Compare OCR accuracy (CER) and latency across preprocessing configs on labeled samples."""
+    report = {}
+    for name, config in configs.items():
+        errors, preprocess_ms, ocr_ms = [], [], []
+        for image, expected in samples:
+            processed, prep = preprocess_image(image, config)
+            started = time.perf_counter()
+            results = readtext(processed)
+            ocr_ms.append((time.perf_counter() - started) * 1000)
+            preprocess_ms.append(prep.get("total_ms", 0.0))
+            results.sort(key=lambda r: (r[0][0][1], r[0][0][0]))
+            errors.append(character_error_rate(" ".join(r[1] for r in results), expected))
+        report[name] = {
+            "samples": len(samples),
+            "mean_cer": round(float(np.mean(errors)), 4) if errors else None,
+            "mean_preprocess_ms": round(float(np.mean(preprocess_ms)), 2) if preprocess_ms else None,
+            "mean_ocr_ms": round(float(np.mean(ocr_ms)), 2) if ocr_ms else None,
+        }
+    return report
+
+
+def load_labeled_dir(path: str) -> List[Tuple[np.ndarray, str]]:
+    """Images with a same-named .txt file holding the expected text."""
+    samples = []
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        label_path = os.path.join(path, stem + ".txt")
+        if ext.lower() in (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp") and os.path.exists(label_path):
+            image = cv2.cvtColor(cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+            with open(label_path, encoding="utf-8") as f:
+                samples.append((image, f.read()))
+    return samples
+
+
+if __name__ == "__main__":
+    # Usage: python preprocessing.py <labeled_dir>
+    # Prints CER and latency with preprocessing disabled vs the configured PREPROCESS_* settings.
+    from setup_ocr import build_reader
+
+    samples = load_labeled_dir(sys.argv[1])
+    reader = build_reader()
+    print(json.dumps(evaluate(samples, reader.readtext, {
+        "disabled": PreprocessConfig(enabled=False),
+        "configured": PreprocessConfig(),
+    }), indent=2))
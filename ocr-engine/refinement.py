@@ -0,0 +1,200 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Detections below OCR_LOW_CONFIDENCE are re-recognized (up to OCR_REFINE_MAX_CROPS per page, least
+# confident first); fields still resting on one afterwards are checked by the structuring model (its
+# prompt marks them) or the correction model and, unless it is sure of them, reported in
+# `unclear_fields`. 0 disables both.
+OCR_LOW_CONFIDENCE = float(os.getenv("OCR_LOW_CONFIDENCE", "0.5"))
+OCR_REFINE_MAX_CROPS = int(os.getenv("OCR_REFINE_MAX_CROPS", "32"))
+OCR_REFINE_CROP_PADDING = 4
+# Fields per correction call; the rest of a very messy page is reported as unclear without a call
+LLM_CORRECTION_MAX_FIELDS = int(os.getenv("LLM_CORRECTION_MAX_FIELDS", "40"))
+
+Reading = Tuple[str, float, str]  # text, prob, preprocessing variant
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def settings_signature() -> str:
+    """Refinement settings that change OCR output, for cache keys."""
+    return f"refine:{OCR_LOW_CONFIDENCE}:{OCR_REFINE_MAX_CROPS}"
+
+
+def low_confidence_indices(results: Sequence[Any], threshold: float = OCR_LOW_CONFIDENCE,
+                           limit: int = OCR_REFINE_MAX_CROPS) -> List[int]:
+    """Indices of `(bbox, text, prob)` detections below `threshold`, least confident first."""
+    low = sorted((i for i, (_, _, prob) in enumerate(results) if prob < threshold), key=lambda i: results[i][2])
+    return low[:limit] if limit > 0 else low
+
+
+def crop_detection(image: np.ndarray, bbox: Sequence[Sequence[float]], padding: int = OCR_REFINE_CROP_PADDING) -> np.ndarray:
+    """The axis-aligned region of a detection polygon, with a little margin."""
+    height, width = image.shape[:2]
+    xs, ys = [p[0] for p in bbox], [p[1] for p in bbox]
+    x0, y0 = max(0, int(min(xs)) - padding), max(0, int(min(ys)) - padding)
+    x1, y1 = min(width, int(np.ceil(max(xs))) + padding), min(height, int(np.ceil(max(ys))) + padding)
+    return np.ascontiguousarray(image[y0:y1, x0:x1])
+
+
+def apply_readings(results: List[Any], indices: Sequence[int],
+                   readings: Sequence[Sequence[Reading]]) -> Tuple[Dict[int, List[str]], int]:
+    """Replace each re-recognized detection by its most confident reading, in place.
+
+    Returns the other distinct texts seen per detection (for the correction prompt) and how many
+    detections improved.
+    """
+    alternatives: Dict[int, List[str]] = {}
+    improved = 0
+    for index, candidates in zip(indices, readings):
+        bbox, text, prob = results[index]
+        best = max((c for c in candidates if c[0].strip()), key=lambda c: c[1], default=None)
+        if best is not None and best[1] > prob:
+            results[index] = (bbox, best[0], best[1])
+            improved += 1
+        chosen = results[index][1]
+        others = []
+        for candidate in [text] + [c[0] for c in candidates]:
+            if candidate.strip() and candidate != chosen and candidate not in others:
+                others.append(candidate)
+        if others:
+            alternatives[index] = others
+    return alternatives, improved
+
+
+def _normalize(text: Any) -> str:
+    return _NON_WORD.sub("", str(text).lower())
+
+
+def _supports(element: Dict[str, Any], value: str) -> bool:
+    readings = [_normalize(element["text"])] + [_normalize(alt) for alt in element.get("alternatives", [])]
+    return any(reading and (reading in value or (len(value) >= 2 and value in reading)) for reading in readings)
+
+
+def uncertain_fields(structured: Dict[str, Any], elements: Sequence[Dict[str, Any]],
+                     threshold: float = OCR_LOW_CONFIDENCE) -> List[Dict[str, Any]]:
+    """Fields whose value rests on a low-confidence detection, or that the model marked unreadable.
+
+    A field rests on a detection when either normalized text contains the other, or the value is
+    one of the detection's alternative readings (as when the structuring model picked one). Each entry keeps
+    a reference to the field dict so corrections can be written back; `lines` (the OCR lines of
+    its detections) is empty for an unreadable field no detection supports.
+    """
+    low = [e for e in elements if e.get("clarity", 1.0) < threshold and len(_normalize(e.get("text", ""))) >= 3]
+    lines: Dict[int, List[str]] = {}
+    for element in elements:
+        if "line" in element:
+            lines.setdefault(element["line"], []).append(str(element.get("text", "")))
+
+    found = []
+    for section in structured.get("sections", []):
+        for field in section.get("fields", []):
+            value = _normalize(field.get("field_value", ""))
+            if not value:
+                continue
+            sources = [e for e in low if _supports(e, value)]
+            if not sources and value != "unreadable":
+                continue
+            found.append({
+                "id": len(found),
+                "name": f"{section.get('section_name', '')} / {field.get('field_name', '')}",
+                "field": field,
+                "value": str(field.get("field_value", "")),
+                "ocr_confidence": round(min((e["clarity"] for e in sources), default=0.0), 3),
+                "alternatives": [alt for e in sources for alt in e.get("alternatives", [])],
+                "lines": [" ".join(lines[line]) for line in sorted({e["line"] for e in sources if "line" in e})],
+            })
+    return found
+
+
+def correction_prompt(candidates: Sequence[Dict[str, Any]]) -> str:
+    fields = [
+        {"id": c["id"], "field": c["name"], "value": c["value"], "alternatives": c["alternatives"], "context": c["lines"]}
+        for c in candidates
+    ]
+    return f"""
+        [INST]
+        These values were read from a handwritten form by OCR with low confidence. For each field
+        you get its label, the value as read, alternative OCR readings of the same handwriting and
+        the full text line(s) it came from.
+
+        Correct a value only when the label, the alternatives or the context make the right reading
+        clear (e.g. letters misread as digits in a phone number, a misspelled common name or word).
+        Keep the value as read otherwise. Set "certain" to false when the handwriting stays ambiguous.
+
+        Return ONLY JSON: {{"fields": [{{"id": 0, "value": "...", "certain": true}}]}}
+
+        UNCERTAIN FIELDS:
+        {json.dumps(fields, ensure_ascii=False)}
+        [/INST]
+        """
+
+
+def structuring_reply(candidates: Sequence[Dict[str, Any]], unclear_names: Sequence[Any]) -> Dict[str, Any]:
+    """A correction reply built from the structuring model's own `unclear_fields`.
+
+    The model saw the low-confidence text with its alternatives and already chose a value, so a
+    candidate is certain unless the model listed it (as "Section / Field" or just the field) or
+    left it unreadable.
+    """
+    unclear = {_normalize(name) for name in unclear_names}
+    return {"fields": [
+        {
+            "id": c["id"],
+            "value": c["value"],
+            "certain": _normalize(c["value"]) != "unreadable"
+            and _normalize(c["name"]) not in unclear and _normalize(c["name"].rsplit(" / ", 1)[-1]) not in unclear,
+        }
+        for c in candidates
+    ]}
+
+
+def merge_unclear(unclear: Sequence[str], model_unclear: Sequence[Any]) -> List[str]:
+    """`unclear` plus the names the structuring model listed itself, skipping ones already there.
+
+    A model name matches an entry given either as "Section / Field" or as just the field.
+    """
+    merged = list(unclear)
+    known = {_normalize(name) for name in unclear} | {_normalize(name.rsplit(" / ", 1)[-1]) for name in unclear}
+    for name in model_unclear:
+        if isinstance(name, str) and name.strip() and _normalize(name) not in known:
+            merged.append(name)
+            known.add(_normalize(name))
+    return merged
+
+
+def apply_corrections(candidates: Sequence[Dict[str, Any]], reply: Optional[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Write corrected values back into their fields.
+
+    Returns `unclear_fields` (names of fields still uncertain) and per-field details. Candidates
+    the reply does not cover (not sent, or no usable reply) stay unclear.
+    """
+    fields = reply.get("fields") if isinstance(reply, dict) else None
+    answers = {
+        answer["id"]: answer for answer in fields or []
+        if isinstance(answer, dict) and isinstance(answer.get("id"), int)
+    } if isinstance(fields, list) else {}
+
+    unclear, details = [], []
+    for candidate in candidates:
+        answer = answers.get(candidate["id"], {})
+        detail = {
+            "field": candidate["name"],
+            "value": candidate["value"],
+            "ocr_confidence": candidate["ocr_confidence"],
+            "alternatives": candidate["alternatives"],
+        }
+        value = answer.get("value")
+        if isinstance(value, str) and value.strip() and value != candidate["value"]:
+            candidate["field"]["field_value"] = value
+            detail.update(value=value, corrected_from=candidate["value"])
+        certain = answer.get("certain") is True
+        detail["certain"] = certain
+        if not certain:
+            unclear.append(candidate["name"])
+        details.append(detail)
+    return unclear, details
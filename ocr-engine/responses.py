@@ -0,0 +1,73 @@
+import json
+from typing import Any, Dict, List
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder is used instead
+    orjson = None
+
+FULL, COMPACT = "full", "compact"
+DETAIL_LEVELS = (FULL, COMPACT)
+
+
+def _default(value: Any) -> Any:
+    # NumPy scalars and arrays that slip into a result
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize to UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def ndjson_line(payload: Any) -> bytes:
+    return dumps(payload) + b"\n"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by `dumps`.
+
+    Return it directly from an endpoint so FastAPI skips its jsonable_encoder pass over the result.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _compact_steps(steps: List[Dict[str, Any]], ref_prefix: str) -> List[Dict[str, Any]]:
+    compacted = []
+    for index, step in enumerate(steps):
+        step = {key: value for key, value in step.items() if key != "data"}
+        step["data_ref"] = f"{ref_prefix}/steps/{index}"
+        compacted.append(step)
+    return compacted
+
+
+def compact_result(result: Dict[str, Any], result_id: str) -> Dict[str, Any]:
+    """Drop per-step intermediates (OCR elements, structured and final JSON) from a result.
+
+    Steps keep their status, timings and small metadata, plus a `data_ref` URL that serves the
+    omitted payload. Top-level fields the backend reads (data, raw_text, confidence_score,
+    unclear_fields) are unchanged.
+    """
+    ref_prefix = f"/results/{result_id}"
+    compact = {key: value for key, value in result.items() if key not in ("steps", "pages")}
+    compact["result_id"] = result_id
+    if "steps" in result:
+        compact["steps"] = _compact_steps(result["steps"], ref_prefix)
+    if "pages" in result:
+        # Per-page data and text are already merged into the top-level fields
+        compact["pages"] = [
+            {
+                **{key: value for key, value in page.items() if key not in ("data", "raw_text", "steps")},
+                "steps": _compact_steps(page.get("steps", []), f"{ref_prefix}/pages/{index}"),
+            }
+            for index, page in enumerate(result["pages"])
+        ]
+    return compact
@@ -1,14 +1,100 @@
-
-import easyocr
+import os
 import logging
+from typing import Any, Dict, Optional, Sequence
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Shared with the OCR workers so they load exactly the weights downloaded here
+EASYOCR_MODEL_DIR = os.getenv("EASYOCR_MODEL_DIR") or None
+
+# CPU inference profiles. `quantize` is EasyOCR's dynamic int8 quantization of the Linear/LSTM
+# layers (most of the recognizer; the convolutional detectors barely change). `canvas_size` caps
+# the longest side the detector sees and is the largest latency lever on full-page scans.
+OCR_PROFILES: Dict[str, Dict[str, Any]] = {
+    "accurate": {"detector": "craft", "quantize": False, "canvas_size": 2560},
+    "balanced": {"detector": "craft", "quantize": True, "canvas_size": 2560},
+    "fast": {"detector": "dbnet18", "quantize": True, "canvas_size": 1600},
+}
+OCR_PROFILE = os.getenv("OCR_PROFILE", "balanced")
+
+
+# Profile used instead when the configured one's detector cannot run here
+OCR_FALLBACK_PROFILE = "balanced"
+
+
+def detector_available(detector: str) -> bool:
+    """Whether `detector` can run on CPU here.
+
+    DBNet needs EasyOCR's deformable-convolution extension, compiled ahead of time (see the
+    Dockerfile) or on first import, which needs a C++ compiler. EasyOCR only warns when that
+    fails and then raises on the first page, so it is checked up front.
+    """
+    if detector != "dbnet18":
+        return True
+    try:
+        from easyocr.DBNet.assets.ops.dcn.functions import deform_conv
+    except Exception as e:
+        logger.warning(f"Cannot load DBNet's deformable convolution: {e}")
+        return False
+    return bool(getattr(deform_conv, "dcn_cpu_ready", False))
+
+
+def resolve_profile(name: str = OCR_PROFILE) -> Dict[str, Any]:
+    """Settings of a named profile, with OCR_DETECTOR / OCR_QUANTIZE / OCR_CANVAS_SIZE overrides.
+
+    Falls back to OCR_FALLBACK_PROFILE, with a warning, when the profile's detector cannot run.
+    """
+    if name not in OCR_PROFILES:
+        raise ValueError(f"Unknown OCR_PROFILE {name!r}; expected one of {', '.join(OCR_PROFILES)}")
+    profile = {"name": name, **OCR_PROFILES[name]}
+    if os.getenv("OCR_DETECTOR"):
+        profile["detector"] = os.getenv("OCR_DETECTOR")
+    if os.getenv("OCR_QUANTIZE"):
+        profile["quantize"] = os.getenv("OCR_QUANTIZE") == "1"
+    if os.getenv("OCR_CANVAS_SIZE"):
+        profile["canvas_size"] = int(os.getenv("OCR_CANVAS_SIZE"))
+    if not detector_available(profile["detector"]):
+        logger.warning(f"OCR profile {name!r} needs the {profile['detector']} detector, which cannot run here; "
+                       f"using {OCR_FALLBACK_PROFILE!r} instead")
+        return {"name": OCR_FALLBACK_PROFILE, **OCR_PROFILES[OCR_FALLBACK_PROFILE]}
+    return profile
+
+
+def readtext_options(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-call readtext/readtext_batched arguments implied by a profile."""
+    return {"canvas_size": profile["canvas_size"]}
+
+
+def build_reader(languages: Sequence[str] = ("en",), download_enabled: bool = True, model_dir: Optional[str] = EASYOCR_MODEL_DIR,
+                 profile: Optional[Dict[str, Any]] = None):
+    import easyocr
+    profile = profile or resolve_profile()
+    return easyocr.Reader(
+        list(languages),
+        gpu=False,
+        verbose=False,
+        model_storage_directory=model_dir,
+        download_enabled=download_enabled,
+        detect_network=profile["detector"],
+        quantize=profile["quantize"],
+    )
+
 def setup():
     logger.info("Initializing EasyOCR and downloading models if missing...")
-    # This will trigger the download of English models
-    reader = easyocr.Reader(['en']) 
+    # Fetch the detector of every profile so OCR_PROFILE can be switched without a download
+    for detector in sorted({profile["detector"] for profile in OCR_PROFILES.values()}):
+        if not detector_available(detector):
+            logger.warning(f"Skipping the {detector} detector, which cannot run here; "
+                           f"profiles that use it fall back to {OCR_FALLBACK_PROFILE!r}")
+            continue
+        try:
+            build_reader(profile={**resolve_profile(), "detector": detector})
+        except Exception as e:
+            if detector == OCR_PROFILES[OCR_FALLBACK_PROFILE]["detector"]:
+                raise
+            logger.warning(f"Could not load the {detector} detector ({e}); "
+                           f"profiles that use it fall back to {OCR_FALLBACK_PROFILE!r}")
     logger.info("EasyOCR is ready.")
 
 if __name__ == "__main__":
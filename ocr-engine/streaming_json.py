@@ -0,0 +1,67 @@
+import json
+from typing import Any, List, Optional
+
+
+class SectionStream:
+    """Pulls complete elements of a top-level JSON array out of a streamed JSON object.
+
+    Feed text deltas as they arrive; `feed` returns the array elements that closed in that
+    delta, already decoded. Only the new text is scanned, tracking string/escape state and
+    nesting depth, so the cost over the whole stream is linear. Text before the opening brace
+    (chatty preambles, a ``` fence) is skipped.
+    """
+
+    def __init__(self, key: str = "sections"):
+        self.key = key
+        self.text = ""
+        self.count = 0
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._last_key: Optional[str] = None
+        self._in_array = False
+        self._element_start: Optional[int] = None
+
+    def feed(self, delta: str) -> List[Any]:
+        self.text += delta
+        text = self.text
+        elements = []
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start + 1:i]
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":":
+                if self._depth == 1:
+                    self._last_key = self._last_string
+            elif c in "{[":
+                self._depth += 1
+                if c == "[" and self._depth == 2 and self._last_key == self.key:
+                    self._in_array = True
+                elif self._in_array and self._depth == 3:
+                    self._element_start = i
+            elif c in "}]":
+                if self._in_array and self._depth == 3 and self._element_start is not None:
+                    try:
+                        elements.append(json.loads(text[self._element_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._element_start = None
+                elif self._in_array and self._depth == 2:
+                    self._in_array = False
+                self._depth = max(self._depth - 1, 0)
+        self._pos = len(text)
+        self.count += len(elements)
+        return elements
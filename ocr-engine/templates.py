@@ -0,0 +1,313 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from layout import page_extent
+
+logger = logging.getLogger(__name__)
+
+# Fraction of a template's label anchors that must be found (near their learned position) to match
+TEMPLATE_MATCH_THRESHOLD = float(os.getenv("TEMPLATE_MATCH_THRESHOLD", "0.8"))
+# How far (as a fraction of the page) a label may drift from its learned position and still count
+TEMPLATE_POSITION_TOLERANCE = float(os.getenv("TEMPLATE_POSITION_TOLERANCE", "0.06"))
+# A matched template only replaces the LLM when its mapped values average at least this OCR confidence
+TEMPLATE_MIN_CLARITY = float(os.getenv("TEMPLATE_MIN_CLARITY", "0.5"))
+# Layouts with fewer mappable fields than this are not worth learning
+TEMPLATE_MIN_FIELDS = int(os.getenv("TEMPLATE_MIN_FIELDS", "3"))
+# A matched template replaces the LLM only when it mapped every field the LLM found on the page it
+# was learned from, and its fields plus known printed text account for this share of the page's
+# text; otherwise its values pre-fill the result and the LLM reads the rest of the page
+TEMPLATE_MIN_COVERAGE = float(os.getenv("TEMPLATE_MIN_COVERAGE", "0.95"))
+# Printed texts (titles, instructions) remembered per template to tell boilerplate from content
+TEMPLATE_MAX_STATIC_TEXTS = 200
+
+_LABEL_SPLIT_RE = re.compile(r"^(.{1,40}?)\s*[:：]\s*(.*)$")
+_NON_WORD_RE = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD_RE.sub(" ", str(text).lower()).strip()
+
+
+def _split_label(text: str) -> Tuple[str, str]:
+    """("Policy No", "AB-1") for "Policy No: AB-1"; (text, "") when there is no colon."""
+    match = _LABEL_SPLIT_RE.match(text)
+    if match:
+        return match.group(1), match.group(2)
+    return text, ""
+
+
+def _relative_box(bbox: List[int], width: int, height: int) -> List[float]:
+    return [round(bbox[0] / width, 4), round(bbox[1] / height, 4), round(bbox[2] / width, 4), round(bbox[3] / height, 4)]
+
+
+def _center(box: List[float]) -> Tuple[float, float]:
+    return (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+
+
+class TemplateRegistry:
+    """Learned form layouts, matched by the positions of their printed labels.
+
+    An inverted index from normalized label text to template ids keeps matching proportional to
+    the labels on the page rather than to the number of registered templates.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.templates: Dict[str, Dict[str, Any]] = {}
+        self._index: Dict[str, set] = defaultdict(set)
+        self.stats = {"lookups": 0, "matched": 0, "skipped_llm": 0, "prefilled": 0, "low_confidence": 0, "learned": 0}
+        self._llm_ms_total = 0.0
+        self._llm_calls = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for template in json.load(f):
+                    self._add(template)
+            logger.info(f"Loaded {len(self.templates)} form template(s) from {self.path}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable template registry {self.path}: {e}")
+
+    def _add(self, template: Dict[str, Any]):
+        self.templates[template["id"]] = template
+        for field in template["fields"]:
+            self._index[field["label"]].add(template["id"])
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Write-then-rename so a crash never leaves a half-written registry
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False, encoding="utf-8") as f:
+            json.dump(list(self.templates.values()), f)
+        os.replace(f.name, self.path)
+
+    def _page_labels(self, raw_data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+        """Page elements keyed by the normalized label text they start with."""
+        elements = [e for e in raw_data.get("elements", []) if "bbox" in e]
+        width, height = raw_data.get("page_size") or page_extent(elements)
+        labels: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for element in elements:
+            label, inline_value = _split_label(element["text"])
+            key = normalize(label)
+            if key:
+                labels[key].append({
+                    "element": element,
+                    "box": _relative_box(element["bbox"], width, height),
+                    "inline_value": inline_value,
+                })
+        return labels
+
+    def _find_anchor(self, field: Dict[str, Any], labels: Dict[str, List[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        tx, ty = _center(field["label_box"])
+        best, best_distance = None, TEMPLATE_POSITION_TOLERANCE
+        for candidate in labels.get(field["label"], []):
+            cx, cy = _center(candidate["box"])
+            distance = max(abs(cx - tx), abs(cy - ty))
+            if distance <= best_distance:
+                best, best_distance = candidate, distance
+        return best
+
+    def match(self, raw_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Best-matching template as {"template", "score", "anchors"}, or None."""
+        self.stats["lookups"] += 1
+        labels = self._page_labels(raw_data)
+        hits: Dict[str, int] = defaultdict(int)
+        for label in labels:
+            for template_id in self._index.get(label, ()):
+                hits[template_id] += 1
+
+        best = None
+        for template_id, hit_count in hits.items():
+            template = self.templates[template_id]
+            total = len(template["fields"])
+            # Shared label text is an upper bound on the score; skip candidates that cannot pass
+            if hit_count < TEMPLATE_MATCH_THRESHOLD * total:
+                continue
+            anchors = [self._find_anchor(field, labels) for field in template["fields"]]
+            score = sum(anchor is not None for anchor in anchors) / total
+            if score >= TEMPLATE_MATCH_THRESHOLD and (best is None or (score, total) > (best["score"], len(best["template"]["fields"]))):
+                best = {"template": template, "score": round(score, 3), "anchors": anchors}
+        if best:
+            self.stats["matched"] += 1
+        return best
+
+    def extract(self, raw_data: Dict[str, Any], match: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Map field values from the bboxes of a matched page, or None if they are not confident enough.
+
+        Returns {"data", "coverage", "score", "skip_llm", "remaining"}: `coverage` is the share of
+        the page's text the template accounts for (mapped labels and values, known printed text)
+        and `score` the match score scaled by it. When `skip_llm` is false, `data` holds only the
+        fields that have a value, to pre-fill the result, and `remaining` the page elements the
+        template did not consume, for the LLM.
+        """
+        elements = [e for e in raw_data.get("elements", []) if "bbox" in e]
+        width, height = raw_data.get("page_size") or page_extent(elements)
+        anchor_ids = {id(anchor["element"]) for anchor in match["anchors"] if anchor}
+        consumed = set(anchor_ids)
+        fields: List[Tuple[str, Dict[str, Any]]] = []
+        clarities = []
+        for field, anchor in zip(match["template"]["fields"], match["anchors"]):
+            value, clarity = "", 0.0
+            if anchor and field["mode"] == "inline":
+                value, clarity = anchor["inline_value"], anchor["element"]["clarity"]
+            elif anchor:
+                # Shift the learned value region by how far the label moved on this scan
+                dx = anchor["box"][0] - field["label_box"][0]
+                dy = anchor["box"][1] - field["label_box"][1]
+                x0, y0, x1, y1 = field["value_box"]
+                pad = TEMPLATE_POSITION_TOLERANCE / 2
+                region = [x0 + dx - pad, y0 + dy - pad, x1 + dx + pad, y1 + dy + pad]
+                parts = []
+                for element in elements:
+                    if id(element) in anchor_ids:
+                        continue
+                    cx, cy = _center(_relative_box(element["bbox"], width, height))
+                    if region[0] <= cx <= region[2] and region[1] <= cy <= region[3]:
+                        parts.append(element)
+                parts.sort(key=lambda e: (e["line"], e["bbox"][0]))
+                consumed.update(id(e) for e in parts)
+                value = " ".join(e["text"] for e in parts).strip()
+                if parts:
+                    clarity = sum(e["clarity"] for e in parts) / len(parts)
+            clarities.append(clarity if value else 0.0)
+            fields.append((field["section"], {"field_name": field["field_name"], "field_value": value}))
+
+        mean_clarity = sum(clarities) / len(clarities) if clarities else 0.0
+        if mean_clarity < TEMPLATE_MIN_CLARITY:
+            self.stats["low_confidence"] += 1
+            return None
+
+        template = match["template"]
+        static = set(template.get("static", []))
+        lengths = [(element, len(normalize(element["text"]).replace(" ", ""))) for element in elements]
+        total = sum(length for _, length in lengths)
+        accounted = sum(length for element, length in lengths
+                        if id(element) in consumed or normalize(element["text"]) in static)
+        coverage = accounted / total if total else 1.0
+        # Templates learned before coverage was tracked carry no "complete" flag and only pre-fill
+        skip_llm = bool(template.get("complete")) and coverage >= TEMPLATE_MIN_COVERAGE
+        self.stats["skipped_llm" if skip_llm else "prefilled"] += 1
+
+        sections: Dict[str, List[Dict[str, Any]]] = {}
+        for section, field in fields:
+            # A blank field is left for the LLM to fill when it reads the rest of the page
+            if skip_llm or field["field_value"]:
+                sections.setdefault(section, []).append(field)
+        return {
+            "data": {
+                "document_type": template["document_type"],
+                "summary": f"{template['document_type']} extracted with a learned form template",
+                "sections": [{"section_name": name, "fields": section_fields} for name, section_fields in sections.items()],
+                "key_entities": {},
+                "signatures_detected": template.get("signatures_detected", False),
+                "confidence_score": round(mean_clarity * coverage, 3),
+            },
+            "coverage": round(coverage, 3),
+            "score": round(match["score"] * coverage, 3),
+            "skip_llm": skip_llm,
+            "remaining": [element for element in elements if id(element) not in consumed],
+        }
+
+    def learn(self, raw_data: Dict[str, Any], structured: Dict[str, Any]) -> Optional[str]:
+        """Register the layout of a page the LLM structured, from fields whose value sits next to a label.
+
+        The template is `complete` when every field the LLM found was tied to a label; printed text
+        that is neither a label nor part of any value is kept as `static`, so later pages can tell
+        how much of their text the template accounts for. Returns the new template id, or None
+        when too few fields could be tied to label positions.
+        """
+        elements = [e for e in raw_data.get("elements", []) if "bbox" in e]
+        if not elements:
+            return None
+        width, height = raw_data.get("page_size") or page_extent(elements)
+        labels = self._page_labels(raw_data)
+        fields, used_labels, consumed = [], set(), set()
+        values, total = [], 0
+        for section in structured.get("sections", []):
+            for field in section.get("fields", []):
+                value = normalize(field.get("field_value", ""))
+                if not value:
+                    continue
+                total += 1
+                values.append(value)
+                learned, used = self._learn_field(value, labels, elements, width, height)
+                if learned and learned["label"] not in used_labels:
+                    used_labels.add(learned["label"])
+                    consumed.update(id(e) for e in used)
+                    fields.append({
+                        "section": section.get("section_name", "General Information"),
+                        "field_name": field.get("field_name"),
+                        **learned,
+                    })
+        if len(fields) < TEMPLATE_MIN_FIELDS:
+            return None
+        all_values = " ".join(values)
+        static = sorted({
+            text for text in (normalize(e["text"]) for e in elements if id(e) not in consumed)
+            if text and text not in all_values
+        })[:TEMPLATE_MAX_STATIC_TEXTS]
+        template = {
+            "id": uuid.uuid4().hex[:12],
+            "document_type": structured.get("document_type", "Handwritten Form"),
+            "signatures_detected": bool(structured.get("signatures_detected", False)),
+            "fields": fields,
+            "complete": len(fields) == total,
+            "static": static,
+            "created_at": time.time(),
+        }
+        self._add(template)
+        self.stats["learned"] += 1
+        return template["id"]
+
+    def _learn_field(self, value: str, labels: Dict[str, List[Dict[str, Any]]], elements: List[Dict[str, Any]],
+                     width: int, height: int) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """How a value is found from its label, and the elements (label and value) it uses."""
+        # "Label: value" in one detection
+        for label, candidates in labels.items():
+            for candidate in candidates:
+                if candidate["inline_value"] and normalize(candidate["inline_value"]) == value:
+                    return {"label": label, "label_box": candidate["box"], "mode": "inline"}, [candidate["element"]]
+        # Value detections on the label's line, to its right
+        for label, candidates in labels.items():
+            for candidate in candidates:
+                anchor = candidate["element"]
+                if candidate["inline_value"] or normalize(anchor["text"]) == value:
+                    continue
+                parts = sorted(
+                    (e for e in elements if e is not anchor and e["line"] == anchor["line"] and e["bbox"][0] >= anchor["bbox"][2]),
+                    key=lambda e: e["bbox"][0],
+                )
+                for end in range(1, len(parts) + 1):
+                    if normalize(" ".join(e["text"] for e in parts[:end])) == value:
+                        box = [min(e["bbox"][0] for e in parts[:end]), min(e["bbox"][1] for e in parts[:end]),
+                               max(e["bbox"][2] for e in parts[:end]), max(e["bbox"][3] for e in parts[:end])]
+                        return ({"label": label, "label_box": candidate["box"], "mode": "region",
+                                 "value_box": _relative_box(box, width, height)}, [anchor] + parts[:end])
+        return None, []
+
+    def record_llm_latency(self, latency_ms: float):
+        """Running average of LLM structuring latency, used to estimate the time templates save."""
+        self._llm_ms_total += latency_ms
+        self._llm_calls += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        average_llm_ms = self._llm_ms_total / self._llm_calls if self._llm_calls else 0.0
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "templates": len(self.templates),
+            "skip_rate": round(self.stats["skipped_llm"] / lookups, 4) if lookups else 0.0,
+            "average_llm_ms": round(average_llm_ms, 1),
+            "latency_saved_ms_estimate": round(self.stats["skipped_llm"] * average_llm_ms, 1),
+        }
@@ -0,0 +1,144 @@
+from typing import Any, Dict, List, Sequence, Tuple
+
+Detection = Tuple[List[List[float]], str, float]
+
+# A detection within this many pixels of a tile edge that is not an image border was cut by the tile
+EDGE_MARGIN = 4
+# Two detections covering this share of the smaller one's area are the same text seen twice
+DUPLICATE_OVERLAP = 0.5
+
+
+def _starts(length: int, tile: int, overlap: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    count = -(-(length - overlap) // (tile - overlap))
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def _cores(starts: List[int], tile: int, length: int) -> List[Tuple[float, float]]:
+    # Neighbouring tiles split their overlap down the middle, so the cores partition the axis
+    seams = [(starts[i + 1] + min(starts[i] + tile, length)) / 2 for i in range(len(starts) - 1)]
+    bounds = [0.0] + seams + [float(length)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def tile_grid(height: int, width: int, tile: int, overlap: int) -> List[Dict[str, Any]]:
+    """Overlapping tiles covering a height x width image, row by row.
+
+    Each tile has its pixel `box` and a `core`: the part of the image it is responsible for.
+    Cores do not overlap, so a detection is kept only by the tile whose core holds its centre.
+    Text up to `overlap` pixels long is therefore always whole in the tile that keeps it.
+    """
+    overlap = max(0, min(overlap, tile // 2))
+    rows, cols = _starts(height, tile, overlap), _starts(width, tile, overlap)
+    row_cores, col_cores = _cores(rows, tile, height), _cores(cols, tile, width)
+    return [
+        {
+            "box": (x0, y0, min(x0 + tile, width), min(y0 + tile, height)),
+            "core": (col_cores[c][0], row_cores[r][0], col_cores[c][1], row_cores[r][1]),
+        }
+        for r, y0 in enumerate(rows)
+        for c, x0 in enumerate(cols)
+    ]
+
+
+class _Piece:
+    """One tile detection in page coordinates, with the tile edges it touches."""
+
+    def __init__(self, detection: Detection, tile: Dict[str, Any], image_size: Tuple[int, int]):
+        x_off, y_off, x_end, y_end = tile["box"]
+        bbox, self.text, self.prob = detection
+        self.bbox = [[x + x_off, y + y_off] for x, y in bbox]
+        xs, ys = [p[0] for p in self.bbox], [p[1] for p in self.bbox]
+        self.box = (min(xs), min(ys), max(xs), max(ys))
+        self.tile = tile
+        width, height = image_size
+        self.cut_left = x_off > 0 and self.box[0] <= x_off + EDGE_MARGIN
+        self.cut_right = x_end < width and self.box[2] >= x_end - EDGE_MARGIN
+        self.cut_top = y_off > 0 and self.box[1] <= y_off + EDGE_MARGIN
+        self.cut_bottom = y_end < height and self.box[3] >= y_end - EDGE_MARGIN
+        self.joined = False
+
+    @property
+    def cut(self) -> bool:
+        return self.cut_left or self.cut_right or self.cut_top or self.cut_bottom
+
+    @property
+    def area(self) -> float:
+        return max(1.0, (self.box[2] - self.box[0]) * (self.box[3] - self.box[1]))
+
+    def owned(self) -> bool:
+        cx, cy = (self.box[0] + self.box[2]) / 2, (self.box[1] + self.box[3]) / 2
+        x0, y0, x1, y1 = self.tile["core"]
+        return x0 <= cx < x1 and y0 <= cy < y1
+
+
+def _intersection(a: Sequence[float], b: Sequence[float]) -> float:
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    return max(0.0, width) * max(0.0, height)
+
+
+def _same_line(a: Sequence[float], b: Sequence[float]) -> bool:
+    shared = min(a[3], b[3]) - max(a[1], b[1])
+    return shared >= 0.5 * min(a[3] - a[1], b[3] - b[1])
+
+
+def _join_text(left: _Piece, right: _Piece) -> str:
+    """Text of a line cut by a vertical seam, read once across the overlap."""
+    a, b = left.text, right.text
+    for size in range(min(len(a), len(b)), 2, -1):
+        if a[-size:] == b[:size]:
+            return a + b[size:]
+    # No common run of characters: cut both at the middle of their overlap, by character share
+    middle = (right.box[0] + left.box[2]) / 2
+    keep_a = round(len(a) * (middle - left.box[0]) / max(1.0, left.box[2] - left.box[0]))
+    skip_b = round(len(b) * (middle - right.box[0]) / max(1.0, right.box[2] - right.box[0]))
+    return a[:keep_a] + b[skip_b:]
+
+
+def _join(left: _Piece, right: _Piece) -> _Piece:
+    x0, y0 = min(left.box[0], right.box[0]), min(left.box[1], right.box[1])
+    x1, y1 = max(left.box[2], right.box[2]), max(left.box[3], right.box[3])
+    left.text = _join_text(left, right)
+    left.prob = min(left.prob, right.prob)
+    left.bbox = [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+    left.box = (x0, y0, x1, y1)
+    left.cut_right = right.cut_right
+    left.cut_top = left.cut_top or right.cut_top
+    left.cut_bottom = left.cut_bottom or right.cut_bottom
+    left.joined = True
+    return left
+
+
+def merge_tile_detections(tiles: List[Dict[str, Any]], detections: List[List[Detection]],
+                          image_size: Tuple[int, int]) -> List[Detection]:
+    """Combine per-tile detections into one `(bbox, text, prob)` list in page coordinates.
+
+    Lines cut by a vertical seam are joined from their two halves; otherwise each detection is
+    kept by the tile whose core holds its centre, and remaining duplicates from the overlaps are
+    dropped, preferring uncut, larger boxes.
+    """
+    pieces = [_Piece(d, tile, image_size) for tile, tile_detections in zip(tiles, detections) for d in tile_detections]
+
+    # Left halves meet right halves of the same line from the tile to their right
+    # (a line crossing several seams is joined piece by piece, left to right)
+    rights = [p for p in pieces if p.cut_left]
+    for left in sorted((p for p in pieces if p.cut_right), key=lambda p: p.box[0]):
+        while left.cut_right and left in pieces:
+            right = next((r for r in rights if r.tile["box"][0] > left.tile["box"][0] and r.box[0] > left.box[0]
+                          and _intersection(left.box, r.box) > 0 and _same_line(left.box, r.box)), None)
+            if right is None:
+                break
+            rights.remove(right)
+            pieces.remove(right)
+            _join(left, right)
+
+    candidates = [p for p in pieces if p.joined or p.owned()]
+    candidates.sort(key=lambda p: (p.cut, -p.area, -p.prob))
+    kept: List[_Piece] = []
+    for piece in candidates:
+        if all(_intersection(piece.box, other.box) < DUPLICATE_OVERLAP * min(piece.area, other.area) for other in kept):
+            kept.append(piece)
+    kept.sort(key=lambda p: (p.box[1], p.box[0]))
+    return [(p.bbox, p.text, p.prob) for p in kept]
@@ -0,0 +1,163 @@
+import hashlib
+import io
+import os
+import tempfile
+from typing import Any, BinaryIO, Optional, Tuple, Union
+
+import numpy as np
+
+# Uploads stay in memory up to UPLOAD_SPOOL_THRESHOLD_BYTES and move to a temp file beyond it, so
+# waiting requests hold little. Decoding maps a spooled file instead of copying it, so one image in
+# flight holds up to UPLOAD_MAX_BYTES of encoded bytes (page cache) plus the decoded image, which
+# UPLOAD_MAX_PIXELS bounds (pixels x 3 bytes).
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_SPOOL_THRESHOLD_BYTES = int(os.getenv("UPLOAD_SPOOL_THRESHOLD_BYTES", str(1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", "40000000"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+
+class UploadRejected(Exception):
+    """The upload exceeds a configured limit (HTTP 413)."""
+
+    def __init__(self, message: str, status_code: int = 413):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SpooledUpload:
+    """Upload bytes held in memory up to a threshold, then in a named temp file.
+
+    The SHA-256 is updated as chunks are written, so the content hash is known without another pass.
+    """
+
+    def __init__(self, threshold: int = UPLOAD_SPOOL_THRESHOLD_BYTES):
+        self.threshold = threshold
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[Any] = None
+        self._path: Optional[str] = None
+
+    @classmethod
+    def from_path(cls, path: str) -> "SpooledUpload":
+        """Wrap a file that is already on disk (e.g. a queued job); it is not removed on close."""
+        upload = cls()
+        upload._memory = None
+        upload._path = path
+        upload.size = os.path.getsize(path)
+        upload._digest = None
+        return upload
+
+    @property
+    def on_disk(self) -> bool:
+        return self._path is not None
+
+    @property
+    def sha256(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha256()
+            with open(self._path, "rb") as f:
+                for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+                    self._digest.update(chunk)
+        return self._digest.hexdigest()
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        self._digest.update(chunk)
+        if self._file is None and self.size > self.threshold:
+            self._roll_over()
+        (self._file or self._memory).write(chunk)
+
+    def _roll_over(self) -> None:
+        self._file = tempfile.NamedTemporaryFile(prefix="upload-", dir=UPLOAD_SPOOL_DIR)
+        self._path = self._file.name
+        self._file.write(self._memory.getbuffer())
+        self._memory = None
+
+    def path(self) -> str:
+        """A file path with the contents (moving in-memory bytes to disk), for tools like poppler."""
+        if self._path is None:
+            self._roll_over()
+        if self._file is not None:
+            self._file.flush()
+        return self._path
+
+    def open(self) -> BinaryIO:
+        """A fresh reader positioned at the start."""
+        if self._memory is not None:
+            return io.BytesIO(self._memory.getbuffer())
+        self.path()
+        return open(self._path, "rb")
+
+    def buffer(self) -> Any:
+        """The whole contents as one buffer for decoding: the in-memory bytes, or the file mapped read-only."""
+        if self._memory is not None:
+            return self._memory.getbuffer()
+        path = self.path()
+        return np.memmap(path, dtype=np.uint8, mode="r") if self.size else b""
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = None
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+async def spool(file: Any, max_bytes: int = UPLOAD_MAX_BYTES, threshold: int = UPLOAD_SPOOL_THRESHOLD_BYTES) -> SpooledUpload:
+    """Copy an UploadFile into a SpooledUpload chunk by chunk, hashing it on the way.
+
+    Raises UploadRejected at the first chunk that would take it past `max_bytes`; nothing past the
+    limit is stored.
+    """
+    upload = SpooledUpload(threshold)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                return upload
+            if max_bytes and upload.size + len(chunk) > max_bytes:
+                raise UploadRejected(f"Upload exceeds {max_bytes} bytes")
+            upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+
+
+def image_dimensions(upload: Union[SpooledUpload, Any]) -> Optional[Tuple[int, int]]:
+    """Width and height from the image header alone, or None if Pillow does not recognize it.
+
+    Takes a SpooledUpload or the encoded bytes themselves (any buffer).
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    with (upload.open() if isinstance(upload, SpooledUpload) else io.BytesIO(upload)) as f:
+        try:
+            with Image.open(f) as image:
+                return image.size
+        except (UnidentifiedImageError, OSError):
+            return None
+
+
+def check_image_pixels(upload: Union[SpooledUpload, Any], max_pixels: int = UPLOAD_MAX_PIXELS) -> None:
+    """Reject an image whose header declares more than `max_pixels`, before it is decoded."""
+    from PIL import Image
+
+    try:
+        size = image_dimensions(upload)
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(str(e))
+    if size and max_pixels and size[0] * size[1] > max_pixels:
+        raise UploadRejected(f"Image is {size[0]}x{size[1]} pixels; the limit is {max_pixels}")
+
+
+def check_page_count(page_count: int, max_pages: int = PDF_MAX_PAGES) -> None:
+    if max_pages and page_count > max_pages:
+        raise UploadRejected(f"PDF has {page_count} pages; the limit is {max_pages}")
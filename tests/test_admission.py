@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+
+from admission import BULK, INTERACTIVE, AdmissionController, AdmissionRejected, PriorityLanes, current_priority
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def controller(**kwargs):
+    options = dict(max_concurrent=2, interactive_reserved=1, queue_limits={INTERACTIVE: 4, BULK: 4},
+                   deadlines={INTERACTIVE: 60, BULK: 600}, request_memory_mb=0)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_bulk_never_takes_the_reserved_slot():
+    admission = controller()
+
+    async def main():
+        bulk = await admission.acquire(BULK)
+        waiting = asyncio.ensure_future(admission.acquire(BULK))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        # The reserved slot is still free for an interactive request
+        interactive = await admission.acquire(INTERACTIVE)
+        admission.release(interactive)
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        admission.release(bulk)
+        admission.release(await waiting)
+
+    run(main())
+    assert admission.running == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_freed_slots_go_to_interactive_waiters_first():
+    admission = controller(interactive_reserved=0, max_concurrent=1)
+    order = []
+
+    async def request(priority, name):
+        async with admission.admit(priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        first = await admission.acquire(BULK)
+        tasks = [asyncio.ensure_future(request(BULK, "bulk")), asyncio.ensure_future(request(INTERACTIVE, "interactive"))]
+        await asyncio.sleep(0)
+        admission.release(first)
+        await asyncio.gather(*tasks)
+
+    run(main())
+    assert order == ["interactive", "bulk"]
+
+
+def test_admit_sets_the_current_priority():
+    admission = controller()
+    seen = []
+
+    async def main():
+        async with admission.admit(BULK):
+            seen.append(current_priority.get())
+        seen.append(current_priority.get())
+
+    run(main())
+    assert seen == [BULK, INTERACTIVE]
+
+
+def test_full_queue_is_rejected_with_429_and_retry_after():
+    admission = controller(max_concurrent=1, interactive_reserved=0, queue_limits={INTERACTIVE: 1, BULK: 1})
+
+    async def main():
+        ticket = await admission.acquire(INTERACTIVE)
+        queued = asyncio.ensure_future(admission.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire(INTERACTIVE)
+        queued.cancel()
+        admission.release(ticket)
+        return rejected.value
+
+    rejected = run(main())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+    assert admission.stats["interactive_rejected_queue_full"] == 1
+
+
+def test_request_that_cannot_meet_its_deadline_is_rejected_with_503():
+    admission = controller(max_concurrent=1, interactive_reserved=0)
+    admission._service_seconds[INTERACTIVE] = 10.0
+
+    async def main():
+        ticket = await admission.acquire(INTERACTIVE)
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                await admission.acquire(INTERACTIVE, deadline_seconds=15)
+        finally:
+            admission.release(ticket, record=False)
+        return rejected.value
+
+    rejected = run(main())
+    assert rejected.status_code == 503
+    # One request ahead at ~10s each
+    assert rejected.retry_after == 10
+    assert admission.stats["interactive_rejected_deadline"] == 1
+
+
+def test_queued_request_gives_up_when_its_deadline_passes():
+    admission = controller(max_concurrent=1, interactive_reserved=0)
+    admission._service_seconds[INTERACTIVE] = 0.01
+
+    async def main():
+        ticket = await admission.acquire(INTERACTIVE)
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                await admission.acquire(INTERACTIVE, deadline_seconds=0.05)
+        finally:
+            admission.release(ticket, record=False)
+        return rejected.value
+
+    assert run(main()).status_code == 503
+    assert admission.snapshot()["queued"] == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_lanes_serve_interactive_waiters_before_bulk_ones():
+    lanes = PriorityLanes(2, reserved=0)
+    order = []
+
+    async def call(priority, name):
+        current_priority.set(priority)
+        async with lanes:
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*[call(BULK, f"bulk{i}") for i in range(4)], call(INTERACTIVE, "interactive"))
+
+    run(main())
+    assert order[:3] == ["bulk0", "bulk1", "interactive"]
+    assert lanes.in_use == 0
+
+
+def test_lanes_keep_reserved_slots_for_interactive_work():
+    lanes = PriorityLanes(2, reserved=1)
+
+    async def main():
+        await lanes.acquire(BULK)
+        bulk = asyncio.ensure_future(lanes.acquire(BULK))
+        await asyncio.sleep(0)
+        assert not bulk.done()
+        await lanes.acquire(INTERACTIVE)
+        lanes.release()
+        lanes.release()
+        await bulk
+        lanes.release()
+
+    run(main())
+    assert lanes.in_use == 0
+
+
+def test_cancelled_lane_waiter_does_not_leak_its_slot():
+    lanes = PriorityLanes(1)
+
+    async def main():
+        await lanes.acquire(INTERACTIVE)
+        waiter = asyncio.ensure_future(lanes.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        # Granted and cancelled in the same loop iteration: the slot must be passed on
+        lanes.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert lanes.in_use == 0
+        assert lanes.waiting() == {INTERACTIVE: 0, BULK: 0}
+
+    run(main())
@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+import pytest
+
+from cache import ResultCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_computation():
+    cache = ResultCache("test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": [1, 2]}
+
+    async def main():
+        return await asyncio.gather(*[cache.get_or_compute("k", compute) for _ in range(5)])
+
+    results = run(main())
+    assert len(calls) == 1
+    assert cache.stats["coalesced"] == 4
+    assert all(result == {"value": [1, 2]} for result in results)
+    # Every caller gets its own copy
+    results[0]["value"].append(3)
+    assert results[1] == {"value": [1, 2]}
+    assert cache.get("k") == {"value": [1, 2]}
+
+
+def test_cancelled_leader_does_not_fail_waiters():
+    cache = ResultCache("test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"value": 1}
+
+    async def main():
+        leader = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert run(main()) == {"value": 1}
+    assert len(calls) == 1
+    assert cache.get("k") == {"value": 1}
+
+
+def test_computation_is_cancelled_when_every_caller_gives_up():
+    cache = ResultCache("test")
+    started, cancelled = [], []
+
+    async def compute():
+        started.append(1)
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return {"value": 1}
+
+    async def fast():
+        return {"value": 2}
+
+    async def main():
+        caller = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        # The next caller starts afresh instead of joining the cancelled computation
+        return await cache.get_or_compute("k", fast)
+
+    assert run(main()) == {"value": 2}
+    assert started == [1] and cancelled == [1]
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    cache = ResultCache("test")
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*[cache.get_or_compute("k", compute) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in run(main()))
+    assert cache.get("k") is None
+
+
+def test_should_cache_filters_results():
+    cache = ResultCache("test")
+
+    async def compute():
+        return {"ok": False}
+
+    run(cache.get_or_compute("k", compute, should_cache=lambda value: value["ok"]))
+    assert cache.get("k") is None
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    first = ResultCache("test", disk_dir=str(tmp_path))
+    run(first.aset("k", {"value": 1}))
+    second = ResultCache("test", disk_dir=str(tmp_path))
+    assert run(second.aget("k")) == {"value": 1}
+    assert second.stats["disk_hits"] == 1
+
+
+def test_lru_eviction_and_ttl():
+    cache = ResultCache("test", max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    assert cache.get("a") is None and cache.get("c") == "c"
+    expiring = ResultCache("test", ttl_seconds=0.01)
+    expiring.set("k", 1)
+    time.sleep(0.02)
+    assert expiring.get("k") is None
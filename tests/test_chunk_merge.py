@@ -0,0 +1,42 @@
+import os
+
+# main builds its clients at import; the local stand-in LLM needs no API key and no OCR workers start
+os.environ.setdefault("LLM_BACKEND", "local")
+os.environ.setdefault("OCR_WORKERS", "0")
+
+from main import agent  # noqa: E402
+
+
+def section(name, **fields):
+    return {"section_name": name, "fields": [{"field_name": k, "field_value": v} for k, v in fields.items()]}
+
+
+def test_sections_split_across_chunks_are_merged_in_document_order():
+    chunks = [
+        {"document_type": "Claim Form", "summary": "Page top.", "sections": [section("Claimant", Name="Jane Roe", Phone="555-0123")],
+         "key_entities": {"policy": "P-1"}, "unclear_fields": ["Claimant / Phone"]},
+        {"document_type": "Claim Form", "summary": "Page bottom.",
+         "sections": [section("claimant ", Email="jane@example.com", Name="J. Roe"), section("Incident", Date="2024-01-02")],
+         "key_entities": {"policy": "P-2", "date": "2024-01-02"}, "unclear_fields": ["Incident / Date", "Claimant / Phone"]},
+    ]
+    merged, conflicts = agent._merge_chunk_results(chunks)
+    assert [s["section_name"] for s in merged["sections"]] == ["Claimant", "Incident"]
+    assert [(f["field_name"], f["field_value"]) for f in merged["sections"][0]["fields"]] == [
+        ("Name", "Jane Roe"), ("Phone", "555-0123"), ("Email", "jane@example.com")]
+    assert merged["key_entities"] == {"policy": "P-1", "date": "2024-01-02"}
+    assert merged["summary"] == "Page top. Page bottom."
+    assert merged["unclear_fields"] == ["Claimant / Phone", "Incident / Date"]
+    assert conflicts == [
+        {"section": "claimant ", "field": "Name", "kept": "Jane Roe", "dropped": "J. Roe", "chunk": 2},
+        {"key_entity": "policy", "kept": "P-1", "dropped": "P-2", "chunk": 2},
+    ]
+
+
+def test_unclear_fields_are_left_out_when_a_chunk_did_not_report_them():
+    chunks = [
+        {"document_type": "Claim Form", "sections": [section("Claimant", Name="Jane Roe")], "unclear_fields": ["Claimant / Name"]},
+        {"document_type": "Claim Form", "sections": [section("Incident", Date="2024-01-02")]},
+    ]
+    merged, _ = agent._merge_chunk_results(chunks)
+    # The field correction step then decides for every field
+    assert "unclear_fields" not in merged
@@ -0,0 +1,109 @@
+import asyncio
+import io
+import time
+
+import pytest
+
+from admission import AdmissionRejected
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobRunner, check_callback_url
+from ocr_pool import OCRPoolSaturated
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs"))
+
+
+def enqueue(queue, name="a.png", callback_url=None):
+    return queue.enqueue(name, "image/png", io.BytesIO(b"image bytes"), callback_url)
+
+
+def test_claim_takes_the_oldest_job_once(queue):
+    first, second = enqueue(queue, "first.png"), enqueue(queue, "second.png")
+    job = queue.claim()
+    assert job["id"] == first and job["attempts"] == 1
+    assert queue.get(first)["status"] == RUNNING
+    assert queue.claim()["id"] == second
+    assert queue.claim() is None
+    with open(queue.upload_path(first), "rb") as f:
+        assert f.read() == b"image bytes"
+
+
+def test_requeued_job_waits_and_keeps_its_attempts(queue):
+    job_id = enqueue(queue)
+    queue.claim()
+    queue.requeue(job_id, delay_seconds=60)
+    assert queue.get(job_id)["status"] == QUEUED and queue.get(job_id)["attempts"] == 0
+    assert queue.claim() is None
+    # Only a running job can be put back
+    queue.requeue(job_id, delay_seconds=0)
+    assert queue.get(job_id)["attempts"] == 0 and queue.claim() is None
+
+    other = enqueue(queue)
+    queue.claim()
+    queue.requeue(other, delay_seconds=0)
+    job = queue.claim()
+    assert job["id"] == other and job["attempts"] == 1
+
+
+def test_stale_claims_are_recovered_until_the_attempts_run_out(queue):
+    job_id = enqueue(queue)
+    for attempt in range(1, 3):
+        assert queue.claim()["attempts"] == attempt
+        # The process stopped while the job was running
+        assert queue.recover(max_attempts=2) == ({"requeued": 1, "failed": 0} if attempt < 2 else {"requeued": 0, "failed": 1})
+    job = queue.get(job_id)
+    assert job["status"] == FAILED and "Interrupted" in job["error"]
+
+
+def test_purge_drops_only_old_finished_jobs(queue):
+    done, failed, waiting = enqueue(queue), enqueue(queue), enqueue(queue)
+    queue.claim(), queue.claim()
+    queue.finish(done, result={"status": "success"})
+    queue.finish(failed, error="Unreadable image")
+    assert queue.get(done)["status"] == SUCCEEDED and queue.get(done)["result"] == {"status": "success"}
+    assert queue.purge(older_than_seconds=60) == 0
+    time.sleep(0.01)
+    assert queue.purge(older_than_seconds=0) == 2
+    assert queue.get(done) is None and queue.get(failed) is None
+    assert queue.get(waiting)["status"] == QUEUED
+
+
+@pytest.mark.parametrize("error", [OCRPoolSaturated("queue full"), AdmissionRejected("busy", 429, retry_after=30)])
+def test_busy_engine_requeues_the_job_without_using_an_attempt(queue, error):
+    async def busy(path, filename, content_type):
+        raise error
+
+    runner = JobRunner(queue, busy)
+    job_id = enqueue(queue)
+    asyncio.run(runner._run(queue.claim()))
+    job = queue.get(job_id)
+    assert job["status"] == QUEUED and job["attempts"] == 0 and job["available_at"] > time.time()
+    assert runner.stats["requeued"] == 1
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/hook",
+    "http://example.com/hook",
+    "https://127.0.0.1/hook",
+    "https://localhost/hook",
+    "https://10.0.0.5/hook",
+    "https://169.254.169.254/latest/meta-data",
+    "https://[::1]/hook",
+])
+def test_callbacks_to_plain_http_or_internal_addresses_are_refused(url):
+    with pytest.raises(ValueError):
+        check_callback_url(url, allowed_hosts=set())
+
+
+def test_callback_allow_list_is_trusted_and_exclusive():
+    check_callback_url("http://10.0.0.5:9000/hook", allowed_hosts={"10.0.0.5"})
+    check_callback_url("https://8.8.8.8/hook", allowed_hosts=set())
+    with pytest.raises(ValueError):
+        check_callback_url("https://8.8.8.8/hook", allowed_hosts={"10.0.0.5"})
+
+
+def test_enqueue_refuses_an_internal_callback(queue):
+    with pytest.raises(ValueError):
+        enqueue(queue, callback_url="https://127.0.0.1/hook")
+    assert queue.counts()[QUEUED] == 0
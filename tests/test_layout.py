@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+from layout import chunk_lines, encode_compact, estimate_tokens, group_lines, key_value_pairs
+
+WIDTH, HEIGHT = 1000, 5000
+
+
+def line(y, text, x=50):
+    return [{"text": text, "clarity": 0.9, "bbox": [x, y, x + 10 * len(text), y + 20]}]
+
+
+def tokens(chunk):
+    return sum(estimate_tokens(encode_compact([l], WIDTH, HEIGHT)) + 1 for l in chunk)
+
+
+def test_full_chunk_is_cut_at_its_widest_gap():
+    # Two sections of four lines with a wide gap between them; the budget holds about six lines
+    lines = [line(100 + 30 * i, f"Applicant field {i}") for i in range(4)]
+    lines += [line(600 + 30 * i, f"Employer field {i}") for i in range(4)]
+    chunks = chunk_lines(lines, WIDTH, HEIGHT, max_tokens=6 * tokens(lines[:1]))
+    assert chunks == [lines[:4], lines[4:]]
+
+
+def test_line_over_the_budget_gets_a_chunk_of_its_own():
+    lines = [line(100, "Name: Jane"), line(130, "Remarks: " + "x" * 400), line(160, "Date: 2024-01-02")]
+    chunks = chunk_lines(lines, WIDTH, HEIGHT, max_tokens=20)
+    assert chunks == [[lines[0]], [lines[1]], [lines[2]]]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_chunks_keep_every_line_in_order_and_stay_within_the_budget(seed):
+    rng = random.Random(seed)
+    y, lines = 0, []
+    for i in range(rng.randint(1, 60)):
+        y += rng.choice([25, 30, 35, 120])
+        lines.append(line(y, f"{i} " + "w" * rng.randint(1, 120)))
+    max_tokens = rng.randint(10, 120)
+    chunks = chunk_lines(lines, WIDTH, HEIGHT, max_tokens)
+    assert [l for chunk in chunks for l in chunk] == lines
+    assert all(chunk and (tokens(chunk) <= max_tokens or len(chunk) == 1) for chunk in chunks)
+
+
+def word(x, y, text, height=20):
+    return {"text": text, "clarity": 0.9, "bbox": [x, y, x + 12 * len(text), y + height]}
+
+
+def texts(lines):
+    return [" ".join(e["text"] for e in l) for l in lines]
+
+
+def test_tilted_lines_stay_together():
+    # Lines 40 px apart that drift down 8 px per word: the last word of a line sits lower than
+    # the first word of the next one, yet each line stays whole and in reading order
+    first = [word(50 + 100 * i, 100 + 8 * i, f"a{i}") for i in range(6)]
+    second = [word(50 + 100 * i, 140 + 8 * i, f"b{i}") for i in range(6)]
+    shuffled = first + second
+    random.Random(0).shuffle(shuffled)
+    assert texts(group_lines(shuffled)) == ["a0 a1 a2 a3 a4 a5", "b0 b1 b2 b3 b4 b5"]
+
+
+def pairs(*rows):
+    # Each row is a list of cells; cells are spaced far apart, words within a cell close together
+    lines = []
+    for row_index, row in enumerate(rows):
+        line, x = [], 50
+        for cell in row:
+            for text in cell.split():
+                line.append(word(x, 100 + 40 * row_index, text))
+                x += 12 * len(text) + 8
+            x += 200
+        lines.append(line)
+    return key_value_pairs(lines)
+
+
+def test_label_and_value_in_one_cell():
+    assert pairs(["Name: Jane Roe"]) == [{"key": "Name", "value": "Jane Roe"}]
+
+
+def test_label_cell_followed_by_a_value_cell():
+    assert pairs(["Date of birth:", "02/03/1990", "Sex:", "F"]) == [
+        {"key": "Date of birth", "value": "02/03/1990"}, {"key": "Sex", "value": "F"}]
+
+
+def test_two_cell_row_without_a_colon():
+    assert pairs(["Policy No.", "AB-12345"], ["Email", "jane@example.com"]) == [
+        {"key": "Policy No.", "value": "AB-12345"}, {"key": "Email", "value": "jane@example.com"}]
+
+
+@pytest.mark.parametrize("row", [
+    ["Applicant", "Employer"],
+    ["Please read the notes overleaf before signing", "Office use only"],
+    ["Section A", "Section B"],
+])
+def test_two_cell_rows_that_are_not_label_and_value_are_not_paired(row):
+    assert pairs(row) == []
@@ -0,0 +1,67 @@
+import asyncio
+
+from llm_client import LocalStandInLLM, StructuringLLMClient, is_streaming_unsupported
+
+PROMPT = "RAW OCR DATA\n1|1:Name: John\n[/INST]"
+
+
+class ProviderError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RefusesToStream(LocalStandInLLM):
+    message: str = "json mode does not support streaming responses"
+    status_code: int = 400
+    stream_attempts: int = 0
+
+    async def _astream(self, *args, **kwargs):
+        self.stream_attempts += 1
+        raise ProviderError(self.message, self.status_code)
+        yield
+
+
+def test_streaming_refusals_are_told_apart_from_other_errors():
+    assert is_streaming_unsupported(ProviderError("json mode does not support streaming responses"))
+    assert is_streaming_unsupported(ProviderError("`stream` is not supported with response_format"))
+    assert not is_streaming_unsupported(ProviderError("Invalid value for stream_options"))
+    assert not is_streaming_unsupported(ProviderError("stream does not support this", status_code=500))
+    assert not is_streaming_unsupported(ProviderError("streaming is not available", status_code=429))
+
+
+def test_refused_stream_falls_back_to_whole_completions_for_a_while():
+    llm = RefusesToStream(latency_seconds=0)
+    client = StructuringLLMClient(llm, stream_retry_seconds=60)
+    deltas = []
+
+    async def main():
+        first = await client.astream(PROMPT, on_text=deltas.append)
+        second = await client.astream(PROMPT)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first.content and first.content == second.content
+    assert deltas == [first.content]
+    assert llm.stream_attempts == 1
+    assert client.snapshot()["streaming"] is False
+    assert client.stats["stream_refused"] == 1
+
+    client._stream_paused_until = 0.0
+    assert client.snapshot()["streaming"] is True
+
+
+def test_other_client_errors_do_not_turn_streaming_off():
+    llm = RefusesToStream(latency_seconds=0, message="Invalid value for stream_options")
+    client = StructuringLLMClient(llm)
+
+    async def main():
+        try:
+            await client.astream(PROMPT)
+        except ProviderError:
+            return True
+        return False
+
+    assert asyncio.run(main())
+    assert client.streaming_now()
+    assert client.stats["stream_refused"] == 0
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from preprocessing import PreprocessConfig, estimate_skew, preprocess_image
+
+
+def form(seed, tilt=0.0):
+    """A sparse form: a title, a few label/value rows in two columns and a signature line."""
+    rng = np.random.default_rng(seed)
+    page = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(page)
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:
+        font = ImageFont.load_default()
+    draw.text((80, 60), f"CLAIM FORM {seed:05d}", fill="black", font=font)
+    for row in range(int(rng.integers(3, 9))):
+        column, line = divmod(row, 4)
+        x, y = 80 + column * 600, 200 + line * 120
+        draw.text((x, y), "Label:", fill="black", font=font)
+        draw.text((x + 200, y), "X" * int(rng.integers(3, 12)), fill="black", font=font)
+    draw.line((80, 1554, 500, 1554), fill="black", width=2)
+    if tilt:
+        page = page.rotate(tilt, fillcolor="white", resample=Image.BICUBIC)
+    return np.asarray(page)
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_unskewed_form_is_left_alone(seed):
+    image, report = preprocess_image(form(seed), PreprocessConfig(deskew=True, crop_margins=False, max_side=0, grayscale=True))
+    assert report["skew_degrees"] == 0
+    assert "deskew" not in report["operations_ms"]
+
+
+@pytest.mark.parametrize("tilt", [-6.0, -1.5, 2.0, 9.0])
+def test_tilt_of_the_text_lines_is_measured(tilt):
+    gray = form(3, tilt)[:, :, 0]
+    # PIL rotates counter-clockwise; the estimate is the rotation that undoes it
+    assert estimate_skew(gray) == pytest.approx(-tilt, abs=0.3)
+
@@ -0,0 +1,54 @@
+from layout import encode_compact
+from refinement import apply_corrections, merge_unclear, structuring_reply, uncertain_fields
+
+
+def element(text, x, clarity=0.9, alternatives=None):
+    found = {"text": text, "clarity": clarity, "bbox": [x, 0, x + 50, 10], "line": 0}
+    if alternatives:
+        found["alternatives"] = alternatives
+    return found
+
+
+def test_low_confidence_text_is_marked_with_its_alternatives():
+    line = [element("Phone:", 0), element("555-0l23", 60, clarity=0.3, alternatives=["555-0123"]), element("x", 115, clarity=0.2)]
+    assert encode_compact([line], 200, 100, uncertain_below=0.5) == "0|0:Phone: 555-0l23{?555-0123} x{?}"
+    assert encode_compact([line], 200, 100) == "0|0:Phone: 555-0l23 x"
+
+
+def test_structuring_models_unclear_fields_decide_without_a_call():
+    elements = [element("Jonh", 0, clarity=0.3), element("555-0l23", 60, clarity=0.3)]
+    structured = {"sections": [{"section_name": "Contact", "fields": [
+        {"field_name": "Name", "field_value": "John"},
+        {"field_name": "Phone", "field_value": "555-0l23"},
+        {"field_name": "Email", "field_value": "unreadable"},
+    ]}]}
+    candidates = uncertain_fields(structured, elements)
+    # "John" was chosen over the OCR reading, so it no longer rests on a low-confidence detection
+    assert [c["name"] for c in candidates] == ["Contact / Phone", "Contact / Email"]
+
+    unclear, details = apply_corrections(candidates, structuring_reply(candidates, []))
+    assert unclear == ["Contact / Email"]
+    assert [d["certain"] for d in details] == [True, False]
+
+    unclear, _ = apply_corrections(candidates, structuring_reply(candidates, ["phone"]))
+    assert unclear == ["Contact / Phone", "Contact / Email"]
+
+
+def test_value_taken_from_an_alternative_stays_unclear_when_the_model_says_so():
+    elements = [element("Phone:", 0), element("555-0l23", 60, clarity=0.3, alternatives=["555-0123"])]
+    structured = {"sections": [{"section_name": "Contact", "fields": [{"field_name": "Phone", "field_value": "555-0123"}]}],
+                  "unclear_fields": ["Phone", "Signature"]}
+    candidates = uncertain_fields(structured, elements)
+    # The model read "555-0l23{?555-0123}" and chose the alternative
+    assert [c["name"] for c in candidates] == ["Contact / Phone"]
+    assert candidates[0]["alternatives"] == ["555-0123"]
+
+    unclear, details = apply_corrections(candidates, structuring_reply(candidates, structured["unclear_fields"]))
+    assert unclear == ["Contact / Phone"]
+    assert details[0]["value"] == "555-0123" and details[0]["certain"] is False
+    # Fields the model listed that no low-confidence detection supports are kept too
+    assert merge_unclear(unclear, structured["unclear_fields"]) == ["Contact / Phone", "Signature"]
+
+
+def test_merging_unclear_fields_skips_names_already_listed():
+    assert merge_unclear(["Contact / Phone"], ["phone", "Contact / Phone", "Date", "date", "", None]) == ["Contact / Phone", "Date"]
@@ -0,0 +1,72 @@
+import json
+import random
+
+import pytest
+
+from streaming_json import SectionStream
+
+DOCUMENT = {
+    "document_type": "Claim \"Form\" {draft}",
+    "summary": "sections: [ignored] \\ backslash",
+    "sections": [
+        {"section_name": "Policy}", "fields": [{"field_name": "Policy No", "field_value": "[AB-123]"}]},
+        {"section_name": "Nested", "fields": {"inner": {"list": [1, {"deep": "}]"}]}, "none": None}},
+        {"section_name": "Unicode éè", "fields": [{"field_name": "Note", "field_value": "line\nbreak \"quoted\""}]},
+    ],
+    "key_entities": {"sections": [{"not": "a section"}]},
+}
+
+
+def feed_in_chunks(text, sizes):
+    stream = SectionStream()
+    elements, start = [], 0
+    for size in sizes:
+        elements.extend(stream.feed(text[start:start + size]))
+        start += size
+    elements.extend(stream.feed(text[start:]))
+    return stream, elements
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_sections_survive_arbitrary_chunk_boundaries(seed):
+    rng = random.Random(seed)
+    text = json.dumps(DOCUMENT, ensure_ascii=seed % 2 == 0)
+    sizes = [rng.randint(1, 9) for _ in range(len(text))]
+    stream, elements = feed_in_chunks(text, sizes)
+    assert elements == DOCUMENT["sections"]
+    assert stream.count == len(DOCUMENT["sections"])
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(DOCUMENT, indent=2)
+    _, elements = feed_in_chunks(text, [1] * len(text))
+    assert elements == DOCUMENT["sections"]
+
+
+def test_preamble_and_code_fence_are_skipped():
+    text = "Here is the extraction you asked for:\n```json\n" + json.dumps(DOCUMENT) + "\n```\nLet me know!"
+    _, elements = feed_in_chunks(text, [7] * len(text))
+    assert elements == DOCUMENT["sections"]
+
+
+def test_sections_are_returned_as_soon_as_they_close():
+    text = json.dumps(DOCUMENT)
+    first_end = text.index(json.dumps(DOCUMENT["sections"][0])) + len(json.dumps(DOCUMENT["sections"][0]))
+    stream = SectionStream()
+    assert stream.feed(text[:first_end - 1]) == []
+    assert stream.feed(text[first_end - 1:first_end]) == [DOCUMENT["sections"][0]]
+
+
+def test_escaped_quote_at_a_chunk_boundary():
+    text = json.dumps({"sections": [{"section_name": 'a\\"b', "fields": []}]})
+    split = text.index('\\"') + 1
+    _, elements = feed_in_chunks(text, [split])
+    assert elements == [{"section_name": 'a\\"b', "fields": []}]
+
+
+def test_other_keys_and_truncated_output_yield_nothing():
+    assert SectionStream().feed(json.dumps({"pages": [{"a": 1}], "key_entities": {"sections": [1]}})) == []
+    text = json.dumps(DOCUMENT)
+    cut = text.index('{"section_name": "Nested"') + 10
+    _, elements = feed_in_chunks(text[:cut], [5] * cut)
+    assert elements == DOCUMENT["sections"][:1]
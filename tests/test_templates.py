@@ -0,0 +1,133 @@
+from templates import TemplateRegistry
+
+WIDTH, HEIGHT = 1000, 1400
+
+
+def page(rows, clarity=0.9):
+    """OCR result for `rows` of (y, [(x, text), ...]); each detection is 20 px per character wide."""
+    elements = []
+    for line, (y, cells) in enumerate(rows):
+        for x, text in cells:
+            elements.append({"label": "Detected Text", "text": text, "clarity": clarity,
+                             "bbox": [x, y, x + 20 * len(text), y + 30], "line": line})
+    return {"elements": elements, "page_size": [WIDTH, HEIGHT], "visual_context": "\n".join(e["text"] for e in elements)}
+
+
+def form(name, policy, phone, extra_rows=()):
+    return page([
+        (60, [(80, "CLAIM FORM")]),
+        (200, [(80, "Name:"), (320, name)]),
+        (320, [(80, "Policy No:"), (320, policy)]),
+        (440, [(80, "Phone:"), (320, phone)]),
+        *extra_rows,
+    ])
+
+
+def structured(name, policy, phone, extra_fields=()):
+    return {
+        "document_type": "Claim Form",
+        "sections": [{"section_name": "Claimant", "fields": [
+            {"field_name": "Name", "field_value": name},
+            {"field_name": "Policy Number", "field_value": policy},
+            {"field_name": "Phone", "field_value": phone},
+            *extra_fields,
+        ]}],
+    }
+
+
+def values(data):
+    return {field["field_name"]: field["field_value"] for section in data["sections"] for field in section["fields"]}
+
+
+def test_complete_template_skips_the_llm():
+    registry = TemplateRegistry()
+    assert registry.learn(form("Jane", "AB123", "5550123"), structured("Jane", "AB123", "5550123"))
+    raw = form("Omar", "CD456", "5559876")
+    match = registry.match(raw)
+    assert match is not None and match["score"] == 1.0
+    extraction = registry.extract(raw, match)
+    assert extraction["skip_llm"]
+    # The title is printed text remembered at learning time
+    assert extraction["coverage"] == 1.0
+    assert values(extraction["data"]) == {"Name": "Omar", "Policy Number": "CD456", "Phone": "5559876"}
+    assert registry.stats["skipped_llm"] == 1
+
+
+def test_fields_the_template_cannot_map_keep_the_llm():
+    registry = TemplateRegistry()
+    narrative = [(560, [(80, "Incident:")]), (600, [(80, "car hit the fence at night")])]
+    learned_from = structured("Jane", "AB123", "5550123",
+                              [{"field_name": "Incident", "field_value": "car hit the fence at night"}])
+    assert registry.learn(form("Jane", "AB123", "5550123", narrative), learned_from)
+
+    raw = form("Omar", "CD456", "5559876", [(560, [(80, "Incident:")]), (600, [(80, "water leak in the kitchen")])])
+    extraction = registry.extract(raw, registry.match(raw))
+    assert not extraction["skip_llm"]
+    assert extraction["coverage"] < 1.0 and extraction["score"] < 1.0
+    assert values(extraction["data"]) == {"Name": "Omar", "Policy Number": "CD456", "Phone": "5559876"}
+    # The narrative is left for the LLM; the mapped labels and values are not sent again
+    remaining = [e["text"] for e in extraction["remaining"]]
+    assert "water leak in the kitchen" in remaining
+    assert "Omar" not in remaining and "Name:" not in remaining
+    assert registry.stats["prefilled"] == 1
+
+
+def test_unexpected_content_on_a_complete_layout_keeps_the_llm():
+    registry = TemplateRegistry()
+    registry.learn(form("Jane", "AB123", "5550123"), structured("Jane", "AB123", "5550123"))
+    raw = form("Omar", "CD456", "5559876", [(700, [(80, "Notes:"), (320, "customer called twice about the delay")])])
+    extraction = registry.extract(raw, registry.match(raw))
+    assert not extraction["skip_llm"]
+    assert extraction["coverage"] < 0.95
+
+
+def test_blank_template_fields_are_left_to_the_llm_when_prefilling():
+    registry = TemplateRegistry()
+    narrative = [(560, [(80, "Incident:")]), (600, [(80, "car hit the fence")])]
+    registry.learn(form("Jane", "AB123", "5550123", narrative), structured(
+        "Jane", "AB123", "5550123", [{"field_name": "Incident", "field_value": "car hit the fence"}]))
+    # The phone number was written below its box, outside the learned value region
+    raw = page([
+        (60, [(80, "CLAIM FORM")]),
+        (200, [(80, "Name:"), (320, "Omar")]),
+        (320, [(80, "Policy No:"), (320, "CD456")]),
+        (440, [(80, "Phone:")]),
+        (560, [(80, "Incident:")]),
+        (600, [(80, "a broken window")]),
+        (900, [(320, "5559876")]),
+    ])
+    extraction = registry.extract(raw, registry.match(raw))
+    assert extraction is not None and not extraction["skip_llm"]
+    assert values(extraction["data"]) == {"Name": "Omar", "Policy Number": "CD456"}
+    assert "5559876" in [e["text"] for e in extraction["remaining"]]
+
+
+def test_unclear_values_fall_back_to_the_llm():
+    registry = TemplateRegistry()
+    registry.learn(form("Jane", "AB123", "5550123"), structured("Jane", "AB123", "5550123"))
+    raw = form("Omar", "CD456", "5559876")
+    for element in raw["elements"]:
+        element["clarity"] = 0.1
+    assert registry.extract(raw, registry.match(raw)) is None
+    assert registry.stats["low_confidence"] == 1
+
+
+def test_too_few_mappable_fields_are_not_learned():
+    registry = TemplateRegistry()
+    raw = page([(200, [(80, "Name:"), (320, "Jane")]), (400, [(80, "free text about the claim")])])
+    data = {"sections": [{"section_name": "A", "fields": [
+        {"field_name": "Name", "field_value": "Jane"},
+        {"field_name": "Notes", "field_value": "free text about the claim"},
+    ]}]}
+    assert registry.learn(raw, data) is None
+    assert registry.match(raw) is None
+
+
+def test_registry_round_trips_through_its_file(tmp_path):
+    path = str(tmp_path / "templates.json")
+    registry = TemplateRegistry(path)
+    template_id = registry.learn(form("Jane", "AB123", "5550123"), structured("Jane", "AB123", "5550123"))
+    registry.save()
+    reloaded = TemplateRegistry(path)
+    match = reloaded.match(form("Omar", "CD456", "5559876"))
+    assert match["template"]["id"] == template_id and match["template"]["complete"]
@@ -0,0 +1,117 @@
+import pytest
+
+from tiling import merge_tile_detections, tile_grid
+
+
+def box(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+
+def local(tile, x0, y0, x1, y1):
+    """A detection given in page coordinates, expressed in the tile's coordinates."""
+    tx, ty = tile["box"][:2]
+    return box(x0 - tx, y0 - ty, x1 - tx, y1 - ty)
+
+
+@pytest.mark.parametrize("height,width,tile,overlap", [(1000, 1000, 1000, 100), (1000, 2500, 1024, 128), (3001, 2047, 1024, 200)])
+def test_tiles_cover_the_image_and_cores_partition_it(height, width, tile, overlap):
+    tiles = tile_grid(height, width, tile, overlap)
+    core_area = 0.0
+    for t in tiles:
+        x0, y0, x1, y1 = t["box"]
+        cx0, cy0, cx1, cy1 = t["core"]
+        assert 0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height
+        assert x1 - x0 <= tile and y1 - y0 <= tile
+        assert x0 <= cx0 < cx1 <= x1 and y0 <= cy0 < cy1 <= y1
+        core_area += (cx1 - cx0) * (cy1 - cy0)
+    assert core_area == pytest.approx(height * width)
+    # Neighbouring boxes overlap by at least `overlap` pixels
+    xs = sorted({t["box"][0] for t in tiles})
+    ends = sorted({t["box"][2] for t in tiles})
+    assert all(end - start >= overlap for start, end in zip(xs[1:], ends[:-1]))
+
+
+def test_small_image_is_one_tile():
+    assert tile_grid(500, 800, 1024, 128) == [{"box": (0, 0, 800, 500), "core": (0.0, 0.0, 800.0, 500.0)}]
+
+
+def test_text_in_the_overlap_is_kept_once():
+    tiles = tile_grid(1000, 1800, 1000, 200)
+    left, right = tiles
+    # Whole in both tiles (the overlap is x 800..1000); its centre lies in the right tile's core
+    word = (880, 400, 960, 430)
+    merged = merge_tile_detections(tiles, [[(local(left, *word), "Total", 0.9)], [(local(right, *word), "Total", 0.8)]], (1800, 1000))
+    assert merged == [(box(*word), "Total", 0.8)]
+
+
+def test_line_cut_by_a_seam_is_joined_on_its_common_text():
+    tiles = tile_grid(1000, 1800, 1000, 200)
+    left, right = tiles
+    # The left tile sees "Claimant Smi" up to its edge (x=1000); the right one "t Smith" from its edge (x=800)
+    halves = [
+        [(local(left, 700, 100, 1000, 130), "Claimant Smi", 0.9)],
+        [(local(right, 800, 100, 1100, 130), "t Smith", 0.7)],
+    ]
+    merged = merge_tile_detections(tiles, halves, (1800, 1000))
+    assert merged == [(box(700, 100, 1100, 130), "Claimant Smith", 0.7)]
+
+
+def test_line_cut_by_a_seam_without_common_text_is_cut_at_the_overlap_middle():
+    tiles = tile_grid(1000, 1800, 1000, 200)
+    left, right = tiles
+    # 300 px / 10 chars on each side; the overlap 800..1000 has its middle at x=900
+    halves = [
+        [(local(left, 700, 100, 1000, 130), "ABCDEFGHIJ", 0.9)],
+        [(local(right, 800, 100, 1100, 130), "ghijKLMNOP", 0.9)],
+    ]
+    merged = merge_tile_detections(tiles, halves, (1800, 1000))
+    assert merged[0][1] == "ABCDEFG" + "jKLMNOP"
+    assert merged[0][0] == box(700, 100, 1100, 130)
+
+
+def test_line_crossing_two_seams_is_joined_left_to_right():
+    tiles = tile_grid(500, 2600, 1000, 200)
+    assert len(tiles) == 3
+    a, b, c = tiles
+    ax1, (bx0, _, bx1, _), cx0 = a["box"][2], b["box"], c["box"][0]
+    pieces = [
+        [(local(a, 600, 50, ax1, 80), "one two th", 0.9)],
+        [(local(b, bx0, 50, bx1, 80), "ree four fi", 0.8)],
+        [(local(c, cx0, 50, 2200, 80), "ive six", 0.9)],
+    ]
+    merged = merge_tile_detections(tiles, pieces, (2600, 500))
+    assert len(merged) == 1
+    assert merged[0][0] == box(600, 50, 2200, 80)
+    assert merged[0][2] == 0.8
+
+
+def test_separate_lines_near_a_seam_are_not_joined_or_dropped():
+    tiles = tile_grid(1000, 1800, 1000, 200)
+    left, right = tiles
+    detections = [
+        [(local(left, 100, 100, 400, 130), "Name:", 0.9)],
+        [(local(right, 1200, 100, 1500, 130), "Date:", 0.9), (local(right, 1200, 300, 1500, 330), "Amount:", 0.9)],
+    ]
+    merged = merge_tile_detections(tiles, detections, (1800, 1000))
+    assert [text for _, text, _ in merged] == ["Name:", "Date:", "Amount:"]
+
+
+def test_cut_fragment_outside_its_core_is_dropped_for_the_whole_word():
+    tiles = tile_grid(1000, 1800, 1000, 200)
+    left, right = tiles
+    # The left tile cut the word at its edge; the right tile saw it whole and owns its centre
+    detections = [
+        [(local(left, 930, 500, 1000, 530), "Sign", 0.6)],
+        [(local(right, 930, 500, 1060, 530), "Signature", 0.9)],
+    ]
+    merged = merge_tile_detections(tiles, detections, (1800, 1000))
+    assert [text for _, text, _ in merged] == ["Signature"]
+
+
+def test_overlapping_detections_are_deduplicated_keeping_the_larger_box():
+    tiles = tile_grid(1000, 1800, 1000, 200)
+    detections = [[], [(local(tiles[1], 1200, 500, 1260, 530), "Sign", 0.95),
+                        (local(tiles[1], 1200, 500, 1330, 530), "Signature", 0.9),
+                        (local(tiles[1], 1200, 560, 1330, 590), "Below", 0.9)]]
+    merged = merge_tile_detections(tiles, detections, (1800, 1000))
+    assert [text for _, text, _ in merged] == ["Signature", "Below"]
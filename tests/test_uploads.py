@@ -0,0 +1,33 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+from uploads import UploadRejected, spool
+
+
+class Upload:
+    """The part of UploadFile that spool() reads."""
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    async def read(self, size):
+        return self._stream.read(size)
+
+
+@pytest.mark.parametrize("size", [0, 1000, 3 * 256 * 1024 + 7])
+def test_spool_hashes_and_keeps_the_bytes(size):
+    data = bytes(range(256)) * (size // 256) + b"x" * (size % 256)
+    upload = asyncio.run(spool(Upload(data), max_bytes=size, threshold=4096))
+    with upload:
+        assert upload.size == size
+        assert upload.sha256 == hashlib.sha256(data).hexdigest()
+        assert upload.on_disk == (size > 4096)
+        assert bytes(upload.buffer()) == data
+
+
+def test_spool_rejects_past_the_limit():
+    with pytest.raises(UploadRejected):
+        asyncio.run(spool(Upload(b"x" * 1001), max_bytes=1000))